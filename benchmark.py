@@ -0,0 +1,1124 @@
+"""
+Benchmarks for the local computations of the Sales Enablement Tool.
+
+Runs on synthetic data, without BigQuery credentials:
+
+    python benchmark.py recommendations --live-cars 20000 --dealers 50
+    python benchmark.py batch --live-cars 5000 --dealers 1500
+    python benchmark.py buyers --live-cars 5000 --dealers 1500
+    python benchmark.py startup --max-login-ms 1500
+    python benchmark.py suite --dealers 100 1000 10000 --output results.json
+    python benchmark.py sessions --sessions 20
+    python benchmark.py checks
+
+The suite replays synthetic query results through a fake BigQuery client, so load_data(),
+the per-dealer lookups and a full AppTest render of the app run without production access.
+The checks compare rewritten queries and computations with the reference SQL in fixtures/,
+run in DuckDB (pip install duckdb); without it those checks are skipped.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import streamlit as st
+
+
+def import_app():
+    """Import tgr with the login bypassed, so its functions can be called outside `streamlit run`."""
+    st.session_state['password_correct'] = True
+    import tgr
+    return tgr
+
+
+def legacy_get_recommended_cars(dealer_historical, live_cars):
+    """Row-by-row scorer that get_recommended_cars() replaced, kept as the reference for its scores."""
+    if dealer_historical.empty or live_cars.empty:
+        return pd.DataFrame()
+
+    # Calculate make preferences
+    make_counts = dealer_historical['make'].value_counts()
+    total_purchases = len(dealer_historical)
+    make_scores = make_counts / total_purchases * 3  # Scale to 0-3 points
+
+    # Calculate model preferences within each make
+    model_preferences = {}
+    for make in make_counts.index:
+        make_data = dealer_historical[dealer_historical['make'] == make]
+        model_counts = make_data['model'].value_counts()
+        model_preferences[make] = model_counts / len(make_data) * 2  # Scale to 0-2 points
+
+    # Calculate year and mileage ranges
+    year_mean = dealer_historical['year'].mean()
+    year_std = dealer_historical['year'].std()
+    km_mean = dealer_historical['kilometers'].mean()
+    km_std = dealer_historical['kilometers'].std()
+
+    # Score each available car
+    scored_cars = []
+    for _, car in live_cars.iterrows():
+        # Initialize score components
+        make_score = make_scores.get(car['make'], 0)
+        model_score = model_preferences.get(car['make'], pd.Series()).get(car['model'], 0)
+
+        # Year score (0-2 points)
+        year_diff = abs(car['year'] - year_mean)
+        year_score = max(0, 2 - (year_diff / year_std)) if year_std > 0 else 0
+        year_score = min(2, max(0, year_score))  # Clamp between 0 and 2
+
+        # Kilometer score (0-2 points)
+        km_diff = abs(car['kilometers'] - km_mean)
+        km_score = max(0, 2 - (km_diff / km_std)) if km_std > 0 else 0
+        km_score = min(2, max(0, km_score))  # Clamp between 0 and 2
+
+        # Total score
+        total_score = make_score + model_score + year_score + km_score
+
+        # Create score breakdown
+        score_breakdown = f"Make: {make_score:.1f}, Model: {model_score:.1f}, Year: {year_score:.1f}, Mileage: {km_score:.1f}"
+
+        # Add to results
+        scored_cars.append({
+            'sf_vehicle_name': car['sf_vehicle_name'],
+            'make': car['make'],
+            'model': car['model'],
+            'year': car['year'],
+            'kilometers': car['kilometers'],
+            'match_score': total_score,
+            'score_breakdown': score_breakdown
+        })
+
+    # Convert to DataFrame and sort by score
+    recommendations = pd.DataFrame(scored_cars)
+    if not recommendations.empty:
+        recommendations = recommendations.sort_values('match_score', ascending=False)
+
+    return recommendations
+
+
+def make_cars(rng, n, makes, models_per_make, missing=0.02):
+    """Synthetic cars with categorical make/model and a few missing values, like the loaded datasets."""
+    make = rng.choice(makes, n, p=np.linspace(2, 1, len(makes)) / np.linspace(2, 1, len(makes)).sum())
+    model = np.array([f"{m} {rng.integers(models_per_make)}" for m in make], dtype=object)
+    year = rng.integers(2008, 2025, n).astype(float)
+    kilometers = rng.gamma(2.0, 40000.0, n).round(-3)
+    year[rng.random(n) < missing] = np.nan
+    kilometers[rng.random(n) < missing] = np.nan
+    model[rng.random(n) < missing] = None
+    return pd.DataFrame({
+        'make': pd.Categorical(make),
+        'model': pd.Categorical(model),
+        'year': year,
+        'kilometers': kilometers
+    })
+
+
+def make_recommendation_data(live_cars, dealers, purchases, seed=0):
+    """
+    Synthetic inventory and dealer purchase histories.
+    Returns:
+        Tuple of (live_cars, histories): the inventory and a list of per-dealer purchase frames
+    """
+    rng = np.random.default_rng(seed)
+    makes = [f"Make{i}" for i in range(30)]
+    live = make_cars(rng, live_cars, makes, models_per_make=12)
+    live.insert(0, 'sf_vehicle_name', [f"V{i:06d}" for i in range(live_cars)])
+
+    histories = []
+    for dealer in range(dealers):
+        # Dealers concentrate on a few makes
+        favourites = list(rng.choice(makes, 4, replace=False))
+        history = make_cars(rng, max(1, int(rng.poisson(purchases))), favourites, models_per_make=6)
+        histories.append(history)
+    return live, histories
+
+
+def timed(func, repeat):
+    """Median wall time of func() in milliseconds, and its last result."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times), result
+
+
+def check_recommendations(expected, actual):
+    """Raise AssertionError unless both scorers give every car identical scores and breakdowns."""
+    actual = actual.sort_index()
+    expected = expected.sort_index()
+    assert len(actual) == len(expected), f"{len(actual)} rows instead of {len(expected)}"
+    assert np.array_equal(actual['match_score'].to_numpy(), expected['match_score'].to_numpy()), "scores differ"
+    assert list(actual['score_breakdown']) == list(expected['score_breakdown']), "breakdowns differ"
+
+
+def bench_recommendations(args):
+    tgr = import_app()
+    live, histories = make_recommendation_data(args.live_cars, args.dealers, args.purchases, args.seed)
+    print(f"{len(live)} live cars, {len(histories)} dealers")
+
+    legacy_ms, vectorized_ms, top_k_ms = [], [], []
+    for history in histories:
+        ms, expected = timed(lambda: legacy_get_recommended_cars(history, live), 1)
+        legacy_ms.append(ms)
+
+        ms, actual = timed(lambda: tgr.get_recommended_cars(history, live, top_k=None), args.repeat)
+        vectorized_ms.append(ms)
+        check_recommendations(expected, actual)
+
+        ms, top = timed(lambda: tgr.get_recommended_cars(history, live), args.repeat)
+        top_k_ms.append(ms)
+        best = np.sort(expected['match_score'].to_numpy())[::-1][:len(top)]
+        assert np.array_equal(top['match_score'].to_numpy(), best), "top-k scores differ"
+
+    print("Scores identical to the legacy scorer for every dealer")
+    print(f"legacy iterrows:      {statistics.median(legacy_ms):10.2f} ms per dealer")
+    print(f"vectorized, all cars: {statistics.median(vectorized_ms):10.2f} ms per dealer")
+    print(f"vectorized, top {tgr.RECOMMENDED_CARS_SHOWN}:  {statistics.median(top_k_ms):10.2f} ms per dealer")
+
+
+def combine_histories(histories):
+    """One historical frame of all dealers, like the loaded dataset. Returns (historical, dealer codes)."""
+    codes = [f"D{i:05d}" for i in range(len(histories))]
+    historical = pd.concat(
+        [history.assign(dealer_code=code, dealer_name=f"Dealer {code}") for code, history in zip(codes, histories)],
+        ignore_index=True
+    )
+    historical['dealer_code'] = historical['dealer_code'].astype('category')
+    historical['dealer_name'] = historical['dealer_name'].astype('category')
+    return historical, codes
+
+
+def bench_batch(args):
+    tgr = import_app()
+    live, histories = make_recommendation_data(args.live_cars, args.dealers, args.purchases, args.seed)
+    historical, codes = combine_histories(histories)
+    print(f"{len(live)} live cars, {len(histories)} dealers, {len(historical)} purchases")
+
+    batch_ms, engine = timed(
+        lambda: tgr.RecommendationEngine(tgr.DealerPreferences(historical), live), args.repeat)
+    per_dealer_ms, expected = timed(lambda: [tgr.get_recommended_cars(history, live) for history in histories], 1)
+
+    for code, recommendations in zip(codes, expected):
+        actual = engine.for_dealer(code)
+        assert len(actual) == len(recommendations), f"{code}: {len(actual)} rows instead of {len(recommendations)}"
+        assert np.allclose(actual['match_score'], recommendations['match_score'], rtol=0, atol=1e-9), \
+            f"{code}: scores differ"
+
+    print("Top scores match get_recommended_cars() for every dealer")
+    print(f"per dealer, all dealers: {per_dealer_ms:10.2f} ms")
+    print(f"batch engine:            {batch_ms:10.2f} ms")
+    print(f"batch lookup:            {timed(lambda: engine.for_dealer(codes[0]), args.repeat)[0]:10.2f} ms per dealer")
+
+
+def bench_buyers(args):
+    tgr = import_app()
+    live, histories = make_recommendation_data(args.live_cars, args.dealers, args.purchases, args.seed)
+    historical, codes = combine_histories(histories)
+    print(f"{len(live)} live cars, {len(histories)} dealers, {len(historical)} purchases")
+
+    preferences_ms, preferences = timed(lambda: tgr.DealerPreferences(historical), args.repeat)
+    buyers_ms, buyers = timed(lambda: tgr.BuyerIndex(preferences, live), args.repeat)
+
+    # Every listed buyer scores the car as get_recommended_cars() does, and no dealer who bought
+    # the make scores higher than the last one listed
+    rng = np.random.default_rng(args.seed)
+    dealer_scores = {}
+    for car in rng.choice(len(live), args.check_cars, replace=False):
+        make = live['make'].iloc[car]
+        bought_make = [i for i, history in enumerate(histories) if (history['make'] == make).any()]
+        for i in bought_make:
+            if i not in dealer_scores:
+                dealer_scores[i] = tgr.get_recommended_cars(histories[i], live, top_k=None)['match_score']
+        expected = np.sort([dealer_scores[i][car] for i in bought_make])[::-1][:tgr.BUYERS_PER_CAR]
+
+        actual = buyers.buyers_for_car(car)
+        assert len(actual) == len(expected), f"car {car}: {len(actual)} buyers instead of {len(expected)}"
+        if actual.empty:
+            continue
+        assert np.allclose(actual['match_score'], expected, rtol=0, atol=1e-9), f"car {car}: scores differ"
+        for code, score in zip(actual['dealer_code'], actual['match_score']):
+            assert abs(dealer_scores[codes.index(code)][car] - score) < 1e-9, f"car {car}: {code} scored differently"
+
+    print(f"Buyers of {args.check_cars} sampled cars match get_recommended_cars() scores")
+    print(f"dealer preferences:     {preferences_ms:10.2f} ms")
+    print(f"buyer index, all cars:  {buyers_ms:10.2f} ms")
+    print(f"buyer lookup:           {timed(lambda: buyers.buyers_for_car(0), args.repeat)[0]:10.2f} ms per car")
+
+
+# Modules the login form must not wait for
+HEAVY_MODULES = ('numpy', 'pandas', 'pyarrow', 'plotly.express', 'google.cloud.bigquery')
+
+# Imports the app in a fresh interpreter and reports its timings as JSON
+STARTUP_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import streamlit as st
+imported = time.perf_counter()
+if {logged_in}:
+    st.session_state['password_correct'] = True
+import tgr
+done = time.perf_counter()
+print(json.dumps({{
+    'streamlit_ms': (imported - start) * 1000,
+    'app_ms': (done - imported) * 1000,
+    'heavy_modules': [name for name in {heavy!r} if name in sys.modules]
+}}))
+"""
+
+
+def probe_startup(logged_in):
+    """Timings of one cold import of tgr, logged out (login form) or logged in (app definitions)."""
+    result = subprocess.run(
+        [sys.executable, '-c', STARTUP_PROBE.format(logged_in=logged_in, heavy=HEAVY_MODULES)],
+        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def bench_startup(args):
+    login = [probe_startup(logged_in=False) for _ in range(args.repeat)]
+    app = [probe_startup(logged_in=True) for _ in range(args.repeat)]
+    streamlit_ms = statistics.median(run['streamlit_ms'] for run in login)
+    login_ms = statistics.median(run['streamlit_ms'] + run['app_ms'] for run in login)
+    app_ms = statistics.median(run['app_ms'] for run in app)
+
+    print(f"import streamlit:       {streamlit_ms:10.2f} ms")
+    print(f"time to login form:     {login_ms:10.2f} ms")
+    print(f"app import after login: {app_ms:10.2f} ms")
+    print(f"loaded after login:     {', '.join(app[-1]['heavy_modules']) or 'none'}")
+
+    failures = []
+    if login[-1]['heavy_modules']:
+        failures.append(f"login form imports {', '.join(login[-1]['heavy_modules'])}")
+    if login_ms > args.max_login_ms:
+        failures.append(f"time to login form {login_ms:.0f} ms exceeds {args.max_login_ms:.0f} ms")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+# Vocabulary of the synthetic datasets
+SYNTHETIC_MAKES = [f"Make{i}" for i in range(30)]
+SYNTHETIC_MODELS_PER_MAKE = 12
+REQUEST_STATUSES = ['Succeeded', 'Failed Before Visit', 'Failed After Visit', 'Pending', 'Payment Log']
+
+
+def dealer_identities(dealers):
+    """Codes, names and phone numbers of the synthetic dealers."""
+    codes = np.array([f"D{i:05d}" for i in range(dealers)], dtype=object)
+    names = np.array([f"Dealer {code}" for code in codes], dtype=object)
+    phones = np.array([f"01{i:09d}" for i in range(dealers)], dtype=object)
+    return codes, names, phones
+
+
+def synthetic_cars(rng, n, make_codes=None):
+    """Make, model, year and mileage arrays of n cars, optionally of the given make codes."""
+    if make_codes is None:
+        make_codes = rng.integers(len(SYNTHETIC_MAKES), size=n)
+    model_codes = make_codes * SYNTHETIC_MODELS_PER_MAKE + rng.integers(SYNTHETIC_MODELS_PER_MAKE, size=n)
+    models = np.array([f"{make} {i}" for make in SYNTHETIC_MAKES for i in range(SYNTHETIC_MODELS_PER_MAKE)],
+                      dtype=object)
+    year = rng.integers(2008, 2025, n).astype(float)
+    kilometers = rng.gamma(2.0, 40000.0, n).round(-3)
+    return np.array(SYNTHETIC_MAKES, dtype=object)[make_codes], models[model_codes], year, kilometers
+
+
+def rows_per_dealer(rng, dealers, mean, inactive=0.0):
+    """Dealer position of every row when dealers have Poisson(mean) rows and some have none."""
+    counts = rng.poisson(mean, dealers)
+    counts[rng.random(dealers) < inactive] = 0
+    return np.repeat(np.arange(dealers), counts)
+
+
+def random_times(rng, n, days, now):
+    """n UTC timestamps in the last `days` days, newest first."""
+    seconds = np.sort(rng.integers(0, days * 86400, n))
+    return now - pd.to_timedelta(seconds, unit='s')
+
+
+def make_query_results(dealers, live_cars=5000, views_per_dealer=20, seed=0):
+    """
+    Synthetic results of every BigQuery query the app runs, shaped like the query results.
+    Args:
+        dealers: Number of dealers, 100 to 50k
+        live_cars: Cars in the current inventory
+        views_per_dealer: Mean car views per dealer in the last 30 days; filters are half as many
+        seed: Random seed
+    Returns:
+        Dict mapping a query name to a pyarrow.Table: the load_data() queries plus the
+        per-dealer 'dealer_requests' lookup
+    """
+    rng = np.random.default_rng(seed)
+    now = pd.Timestamp.now(tz='UTC').floor('s')
+    today = now.normalize()
+    codes, names, phones = dealer_identities(dealers)
+    results = {}
+
+    make, model, year, kilometers = synthetic_cars(rng, live_cars)
+    results['live_cars'] = pa.table({
+        'date_key': pa.array(np.full(live_cars, today.date()), pa.date32()),
+        'sf_vehicle_name': [f"V{i:06d}" for i in range(live_cars)],
+        'make': make, 'model': model, 'year': year, 'kilometers': kilometers
+    })
+
+    # Dealers concentrate their purchases on a few makes
+    favourites = rng.integers(len(SYNTHETIC_MAKES), size=(dealers, 4))
+    owner = rows_per_dealer(rng, dealers, 8, inactive=0.3)
+    n = len(owner)
+    make, model, year, kilometers = synthetic_cars(rng, n, favourites[owner, rng.integers(4, size=n)])
+    price = rng.normal(600000, 150000, n).round(-3)
+    results['historical'] = pa.table({
+        'request_date': pa.array((today - pd.to_timedelta(rng.integers(0, 730, n), unit='D')).date, pa.date32()),
+        'dealer_code': codes[owner], 'time_on_app': rng.integers(0, 60, n).astype(float), 'price': price,
+        'make': make, 'model': model, 'year': year, 'kilometers': kilometers,
+        'sylndr_acquisition_price': price * 0.9, 'market_retail_price': price * 1.1,
+        'dealer_name': names[owner], 'dealer_phone': phones[owner]
+    })
+
+    # Daily purchase and request counts; lapsed dealers' events stop some months ago
+    last_active = np.where(rng.random(dealers) < 0.3, rng.integers(60, 300, dealers), 0)
+    events = []
+    for event_type, mean in (('purchase', 6), ('request', 25)):
+        owner = rows_per_dealer(rng, dealers, mean, inactive=0.1)
+        days_ago = last_active[owner] + rng.integers(0, 365, len(owner))
+        events.append(pd.DataFrame({
+            'dealer_code': codes[owner], 'event_type': event_type,
+            'event_date': (today - pd.to_timedelta(days_ago, unit='D')).date,
+            'n_events': rng.integers(1, 4, len(owner))
+        }).drop_duplicates(['dealer_code', 'event_type', 'event_date']))
+    events = pd.concat(events, ignore_index=True)
+    # Dealers without events come back once with nulls from the LEFT JOIN
+    dealer_events = pd.DataFrame({'dealer_code': codes, 'dealer_name': names}).merge(events, how='left')
+    results['dealer_events'] = pa.Table.from_pandas(dealer_events, preserve_index=False).cast(pa.schema([
+        ('dealer_code', pa.string()), ('dealer_name', pa.string()), ('event_type', pa.string()),
+        ('event_date', pa.date32()), ('n_events', pa.int64())
+    ]))
+
+    active = np.flatnonzero(rng.random(dealers) < 0.7)
+    days_30d = rng.integers(1, 31, len(active))
+    days_7d = np.minimum(days_30d, rng.integers(0, 8, len(active)))
+    results['dealer_activity'] = pa.table({
+        'dealer_code': codes[active], 'dealer_name': names[active],
+        'active_days_30d': days_30d, 'total_car_events_30d': days_30d * rng.integers(1, 20, len(active)),
+        'active_days_7d': days_7d, 'total_car_events_7d': days_7d * rng.integers(1, 20, len(active))
+    })
+
+    owner = rows_per_dealer(rng, dealers, views_per_dealer, inactive=0.2)
+    n = len(owner)
+    make, model, year, kilometers = synthetic_cars(rng, n)
+    results['recent_views'] = pa.table({
+        'time': random_times(rng, n, 30, now), 'make': make, 'model': model,
+        'trim': rng.choice(['Base', 'Mid', 'Top'], n), 'year': year, 'kilometrage': kilometers,
+        'transmission': rng.choice(['Automatic', 'Manual'], n), 'listing_title': model,
+        'buy_now_price': rng.normal(600000, 150000, n).round(-3),
+        'body_style': rng.choice(['Sedan', 'Hatchback', 'SUV'], n), 'dealer_code': codes[owner]
+    })
+
+    owner = rows_per_dealer(rng, dealers, views_per_dealer / 2, inactive=0.2)
+    n = len(owner)
+    make, model, year, kilometers = synthetic_cars(rng, n)
+    results['recent_filters'] = pa.table({
+        'time': random_times(rng, n, 30, now), 'make': make, 'model': model, 'year': year,
+        'kilometrage': kilometers, 'group_filter': rng.choice(['Buy Now', 'Auction', 'All'], n),
+        'status': rng.choice(['applied', 'cleared'], n), 'no_of_cars': rng.integers(0, 500, n),
+        'dealer_code': codes[owner]
+    })
+
+    owner = rows_per_dealer(rng, dealers, 0.5)
+    n = len(owner)
+    make, model, year, kilometers = synthetic_cars(rng, n)
+    results['olx_listings'] = pa.table({
+        'id': [f"OLX{i:08d}" for i in range(n)], 'title': model, 'year': year.astype(int).astype(str),
+        'kilometers': kilometers, 'make': make, 'model': model,
+        'condition': rng.choice(['used', 'new'], n, p=[0.95, 0.05]),
+        'region': rng.choice(['Cairo', 'Giza', 'Alexandria'], n),
+        'price': rng.normal(600000, 150000, n).round(-3), 'is_active': rng.random(n) < 0.6,
+        'added_at': random_times(rng, n, 30, now).tz_localize(None), 'phone_number': phones[owner],
+        'dealer_code': codes[owner]
+    })
+
+    # Ranked like the per-dealer requests query, before its QUALIFY filter
+    owner = rows_per_dealer(rng, dealers, 15, inactive=0.2)
+    n = len(owner)
+    status = rng.choice(REQUEST_STATUSES, n)
+    created = now - pd.to_timedelta(rng.integers(0, 365 * 86400, n), unit='s')
+    make, model, year, kilometers = synthetic_cars(rng, n)
+    requests = pd.DataFrame({
+        'dealer_code': codes[owner], 'vehicle_request_created_at': created, 'request_type': 'Buy Now',
+        'request_status': status, 'contacted_at': created + pd.Timedelta(hours=2), 'contacted_user': 'agent',
+        'visited_at': created + pd.Timedelta(days=1), 'visited_user': 'agent',
+        'succeeded_at': (created + pd.Timedelta(days=2)).where(status == 'Succeeded'),
+        'failed_before_visit_at': (created + pd.Timedelta(hours=5)).where(status == 'Failed Before Visit'),
+        'failed_after_visit_at': (created + pd.Timedelta(days=2)).where(status == 'Failed After Visit'),
+        'failure_reason': np.where(np.char.startswith(status.astype(str), 'Failed'), 'Price', None),
+        'car_name': model, 'car_make': make, 'car_model': model, 'car_year': year,
+        'car_kilometrage': kilometers, 'buy_now_price': rng.normal(600000, 150000, n).round(-3),
+        'discounted_price': np.nan
+    }).sort_values(['dealer_code', 'vehicle_request_created_at'], ascending=[True, False], ignore_index=True)
+    requests['all_rank'] = requests.groupby('dealer_code').cumcount() + 1
+    requests['status_rank'] = requests.groupby(['dealer_code', 'request_status']).cumcount() + 1
+    results['dealer_requests'] = pa.Table.from_pandas(requests, preserve_index=False)
+
+    return results
+
+
+class FakeQueryJob:
+    """
+    Stands in for a google.cloud.bigquery QueryJob holding its result, with job statistics
+    derived from the result size.
+    """
+
+    def __init__(self, name, table, latency=0.0):
+        self.name = name
+        self.table = table
+        self.latency = latency
+        self.job_id = f"fake_{name}_{id(self):x}"
+        self.total_bytes_processed = table.nbytes
+        # BigQuery bills at least 10 MB per query
+        self.total_bytes_billed = max(table.nbytes, 10 * 1024 ** 2)
+        self.slot_millis = int(table.num_rows / 1000) + 1
+        self.cache_hit = False
+        self.created = datetime.now(timezone.utc)
+        self.started = self.created
+        self.ended = None
+
+    def result(self):
+        if self.ended is None:
+            time.sleep(self.latency)
+            self.ended = datetime.now(timezone.utc)
+        return self
+
+    def to_arrow(self, **kwargs):
+        self.result()
+        return self.table
+
+    def to_dataframe(self, **kwargs):
+        return self.to_arrow().to_pandas()
+
+    def done(self):
+        return True
+
+    def cancel(self):
+        return False
+
+
+class FakeBigQueryClient:
+    """
+    Stands in for bigquery.Client with the results of make_query_results().
+    Each query is recognised by the table it reads and filtered by its dealer and watermark parameters.
+    """
+
+    # Text identifying each query of the app, checked in order
+    ROUTES = [
+        ('@dealer_id', 'dealer_requests'),
+        ('screen_car_profile_event', 'recent_views'),
+        ('action_filter', 'recent_filters'),
+        ('olx.listings', 'olx_listings'),
+        ('ajans_wholesale_to_retail_publishing_logs', 'historical'),
+        ("'purchase' as event_type", 'dealer_events'),
+        ('dealers_activity', 'dealer_activity'),
+        ('avh.date_key', 'live_cars')
+    ]
+
+    def __init__(self, results, latency=0.0):
+        """
+        Args:
+            results: Dict of pyarrow.Tables from make_query_results()
+            latency: Seconds every job takes to return its result
+        """
+        self.results = results
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.dealer_rows = {}
+        self.queries = Counter()
+        # Text of the last query of each result
+        self.sql = {}
+
+    def route(self, sql):
+        for marker, name in self.ROUTES:
+            if marker in sql:
+                return name
+        raise ValueError(f"No synthetic result for query: {sql[:80]}")
+
+    def rows_of_dealer(self, name, dealer_code):
+        with self.lock:
+            if name not in self.dealer_rows:
+                codes = self.results[name].column('dealer_code').to_pandas()
+                self.dealer_rows[name] = codes.groupby(codes, sort=False).indices
+        return self.dealer_rows[name].get(dealer_code, np.array([], dtype=int))
+
+    def query(self, sql, job_config=None):
+        name = self.route(sql)
+        params = {p.name: p.value for p in getattr(job_config, 'query_parameters', None) or []}
+        table = self.results[name]
+
+        dealer_code = params.get('dealer_code', params.get('dealer_id'))
+        if dealer_code is not None:
+            table = table.take(self.rows_of_dealer(name, dealer_code))
+        if name == 'dealer_requests':
+            per_list = params['per_list']
+            table = table.filter(pc.or_(
+                pc.less_equal(table['all_rank'], per_list),
+                pc.and_(pc.is_in(table['request_status'], pa.array(REQUEST_STATUSES[:3])),
+                        pc.less_equal(table['status_rank'], per_list))
+            ))
+        if 'watermark' in params:
+            watermark = pd.Timestamp(params['watermark'])
+            watermark = watermark.tz_localize('UTC') if watermark.tzinfo is None else watermark
+            table = table.filter(pc.greater_equal(table['time'], pa.scalar(watermark, table['time'].type)))
+
+        with self.lock:
+            self.queries[name] += 1
+            self.sql[name] = sql
+        return FakeQueryJob(name, table, self.latency)
+
+
+def install_fake_bigquery(tgr, client):
+    """Make the app's shared BigQuery client factory hand out the fake client."""
+    factory = tgr.BigQueryClientFactory()
+    factory.client = client
+    tgr.get_bigquery_client_factory = lambda: factory
+    return factory
+
+
+def profile_app():
+    """AppTest script: the whole app, logged in, using the store and client installed by the suite."""
+    import streamlit as st
+    st.session_state['password_correct'] = True
+    import tgr
+    tgr.main()
+
+
+def bench_profile_renders(tgr, dataset, dealer_names, repeat):
+    """Median wall time of full AppTest runs with each dealer's profile open, in milliseconds."""
+    from streamlit.testing.v1 import AppTest
+
+    store = tgr.DatasetStore()
+    store.dataset = dataset
+    tgr.get_dataset_store = lambda: store
+
+    at = AppTest.from_function(profile_app, default_timeout=600)
+    times = []
+    for name in dealer_names[:repeat]:
+        at.query_params['dealer'] = name
+        start = time.perf_counter()
+        at.run()
+        times.append((time.perf_counter() - start) * 1000)
+        if at.exception:
+            raise RuntimeError(f"Profile of {name} failed: {at.exception[0].value}")
+    return statistics.median(times)
+
+
+def reset_app_caches(tgr):
+    """Drop the event windows and per-dealer caches, which outlive a dataset size within the process."""
+    for cached in (tgr.get_event_windows, tgr.get_dealer_activity_cache, tgr.get_dealer_lookup_cache):
+        cached.clear()
+
+
+def bench_suite_size(tgr, args, dealers):
+    """Timings of one dataset size, in milliseconds by stage."""
+    reset_app_caches(tgr)
+    results = make_query_results(dealers, args.live_cars, args.views_per_dealer, args.seed)
+    client = FakeBigQueryClient(results, latency=args.latency_ms / 1000)
+    install_fake_bigquery(tgr, client)
+    rows = {name: table.num_rows for name, table in results.items()}
+    print(f"{dealers} dealers: " + ", ".join(f"{rows[name]} {name}" for name in rows))
+
+    timings = {}
+    with tempfile.TemporaryDirectory() as snapshot_dir:
+        tgr.SNAPSHOT_DIR = snapshot_dir
+        timings['load_data'], (datasets, created_at) = timed(
+            lambda: tgr.load_data(snapshot_max_age=timedelta(0)), args.repeat)
+        timings['load_snapshot'], _ = timed(tgr.load_data, args.repeat)
+    if created_at is None:
+        raise RuntimeError("load_data() failed on the synthetic results")
+
+    timings['dataset_build'], dataset = timed(lambda: tgr.Dataset(1, created_at, datasets), 1)
+    dealer_seg_df = datasets[2]
+    timings['dealers_needing_attention'], _ = timed(
+        lambda: tgr.get_dealers_needing_attention(dealer_seg_df), args.repeat)
+
+    # The dealer with the longest purchase history is the slowest to score
+    historical = datasets[0]
+    busiest = historical['dealer_code'].value_counts().index[0]
+    dealer_historical = tgr.drop_unused_categories(dataset.index.rows('historical', busiest).copy())
+    timings['recommended_cars'], _ = timed(
+        lambda: tgr.get_recommended_cars(dealer_historical, datasets[1]), args.repeat)
+
+    # Only dealers with recent activity get a full profile
+    rng = np.random.default_rng(args.seed)
+    dealer_names = list(rng.permutation(datasets[3]['dealer_name'].dropna().astype(str).unique()))
+    timings['profile_render'] = bench_profile_renders(tgr, dataset, dealer_names, args.repeat)
+
+    for stage, ms in timings.items():
+        print(f"  {stage + ':':28}{ms:10.2f} ms")
+    return {'dealers': dealers, 'rows': rows, 'timings_ms': timings}
+
+
+def compare_runs(runs, baseline_path, tolerance):
+    """Stages slower than the same stage and size of a baseline results file, beyond the tolerance."""
+    with open(baseline_path) as f:
+        baseline = {run['dealers']: run['timings_ms'] for run in json.load(f)['runs']}
+    regressions = []
+    for run in runs:
+        for stage, ms in run['timings_ms'].items():
+            before = baseline.get(run['dealers'], {}).get(stage)
+            if before and ms > before * (1 + tolerance):
+                regressions.append(f"{stage} at {run['dealers']} dealers: {before:.1f} -> {ms:.1f} ms")
+    return regressions
+
+
+def bench_suite(args):
+    tgr = import_app()
+    # Eager mode downloads every dealer's views and filters with the datasets
+    tgr.LAZY_RECENT_ACTIVITY = not args.eager_activity
+    with tempfile.TemporaryDirectory() as stats_dir:
+        job_stats = tgr.JobStatsStore(os.path.join(stats_dir, 'job_stats.sqlite'))
+        tgr.get_job_stats_store = lambda: job_stats
+        runs = [bench_suite_size(tgr, args, dealers) for dealers in args.dealers]
+
+    report = {
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'versions': {
+            'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+            'pyarrow': pa.__version__, 'streamlit': st.__version__
+        },
+        'args': {key: value for key, value in vars(args).items() if key != 'run'},
+        'runs': runs
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        regressions = compare_runs(runs, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+def current_rss_mb():
+    """Resident set size of this process in MB, read from /proc (Linux only)."""
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    raise RuntimeError("VmRSS missing from /proc/self/status")
+
+
+def measure_sessions(get_frames, sessions):
+    """Mean milliseconds per call of get_frames and the RSS added while every session holds its result."""
+    gc.collect()
+    before = current_rss_mb()
+    held = []
+    start = time.perf_counter()
+    for _ in range(sessions):
+        held.append(get_frames())
+    ms = (time.perf_counter() - start) * 1000 / sessions
+    gc.collect()
+    return ms, current_rss_mb() - before
+
+
+def bench_sessions(args):
+    tgr = import_app()
+    tgr.LAZY_RECENT_ACTIVITY = args.lazy_activity
+    results = make_query_results(args.dealers, args.live_cars, args.views_per_dealer, args.seed)
+    install_fake_bigquery(tgr, FakeBigQueryClient(results))
+    with tempfile.TemporaryDirectory() as snapshot_dir:
+        tgr.SNAPSHOT_DIR = snapshot_dir
+        datasets, created_at = tgr.load_data(snapshot_max_age=timedelta(0))
+    if created_at is None:
+        raise RuntimeError("load_data() failed on the synthetic results")
+    print(", ".join(f"{len(frame)} {name}" for name, frame in zip(
+        ['historical', 'live_cars', 'dealer_seg', 'dealer_activity', 'recent_views', 'recent_filters', 'olx'],
+        datasets)))
+
+    # The shared handle first, so memory freed by the copies below cannot hide its cost
+    store = tgr.DatasetStore()
+    store.swap(datasets, created_at)
+    shared_ms, shared_mb = measure_sessions(lambda: store.get().frames, args.sessions)
+
+    # The st.cache_data handoff it replaced returns an unpickled copy on every call
+    @st.cache_data
+    def cached_datasets():
+        return datasets
+
+    cached_datasets()
+    copy_ms, copy_mb = measure_sessions(cached_datasets, args.sessions)
+    cached_datasets.clear()
+
+    print(f"{args.sessions} sessions:          per rerun      RSS added")
+    print(f"  st.cache_data copies: {copy_ms:10.2f} ms {copy_mb:10.0f} MB")
+    print(f"  shared Dataset:       {shared_ms:10.2f} ms {shared_mb:10.0f} MB")
+
+
+def check_inbox_name_sort(tgr):
+    """The inbox sorts dealer names alphabetically, not in the order Arrow first saw them."""
+    names = ['Zed Motors', 'Alpha Cars', 'Mid Auto']
+    today = pd.Timestamp.now(tz='UTC').normalize()
+    events = pa.table({
+        'dealer_code': ['Z1', 'A1', 'M1'],
+        'dealer_name': names,
+        'event_type': ['purchase'] * 3,
+        'event_date': pa.array([(today - pd.Timedelta(days=200)).date()] * 3, pa.date32()),
+        'n_events': [1, 1, 1]
+    })
+    dealer_seg_df = tgr.compute_segmentation(tgr.arrow_to_dataframe(events, tgr.RESULT_DTYPES['dealer_events']))
+    attention_dealers = tgr.get_dealers_needing_attention(dealer_seg_df)
+    assert attention_dealers['dealer_name'].dtype == 'category', "dealer_name is no longer categorical"
+
+    dealers = tgr.filter_attention_dealers(attention_dealers, tgr.PRIORITY_LEVELS, '', 'Dealer Name')
+    actual = list(dealers['dealer_name'].astype(str))
+    assert actual == sorted(names), f"sorted as {actual} instead of {sorted(names)}"
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# BigQuery functions used by the dealer queries, rewritten to the DuckDB macros of run_bigquery_sql()
+BIGQUERY_TO_DUCKDB = [
+    (r'ajans_dealers\.', ''),
+    (r'\bCURRENT_DATE\(\)', 'bq_current_date()'),
+    (r'INTERVAL (\d+) DAY\)', r'\1)'),
+    (r',\s*(DAY|MONTH)\)', ')'),
+    (r'\bDATE\(', 'bq_date('),
+    (r'\bDATE_SUB\(', 'bq_date_sub('),
+    (r'\bDATE_DIFF\(', 'bq_date_diff('),
+    (r'\bDATE_TRUNC\(', 'bq_month(')
+]
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name)) as f:
+        return f.read()
+
+
+def run_bigquery_sql(sql, tables, as_of):
+    """
+    Run one of the app's BigQuery queries in DuckDB.
+    Args:
+        sql: Query text, using only the date functions of BIGQUERY_TO_DUCKDB
+        tables: Dict of DataFrames by table name, without the dataset prefix
+        as_of: Date that CURRENT_DATE() returns
+    Returns:
+        DataFrame of the query result
+    """
+    import duckdb
+
+    for pattern, replacement in BIGQUERY_TO_DUCKDB:
+        sql = re.sub(pattern, replacement, sql)
+    con = duckdb.connect()
+    con.execute(f"CREATE MACRO bq_current_date() AS DATE '{pd.Timestamp(as_of).date()}'")
+    con.execute("CREATE MACRO bq_date(x) AS CAST(x AS DATE)")
+    con.execute("CREATE MACRO bq_date_sub(d, n) AS CAST(d - to_days(n) AS DATE)")
+    con.execute("CREATE MACRO bq_date_diff(a, b) AS date_diff('day', b, a)")
+    con.execute("CREATE MACRO bq_month(x) AS CAST(date_trunc('month', x) AS DATE)")
+    for name, frame in tables.items():
+        con.register(name, frame)
+    return con.execute(sql).df()
+
+
+def boundary_dealer_requests(as_of):
+    """
+    Buy Now requests of dealers whose purchases and requests fall exactly on the segmentation thresholds:
+    last purchases 30, 60, 90 and 120 days back and either side of them, purchase intervals of exactly
+    15 to 60 days, and dealers that request without ever purchasing.
+    """
+    as_of = pd.Timestamp(as_of) + pd.Timedelta(hours=10)
+    rows = []
+
+    def add(code, days_ago, sold):
+        for days in days_ago:
+            at = as_of - pd.Timedelta(days=days)
+            rows.append((code, f"Dealer {code}", 'Buy Now', at, at if sold else pd.NaT))
+
+    for age in (0, 15, 16, 29, 30, 31, 45, 59, 60, 61, 89, 90, 91, 119, 120, 121):
+        add(f"B{age:03d}", [age], sold=True)
+        for gap in (15, 30, 45, 60):
+            add(f"B{age:03d}G{gap:02d}", [age, age + gap, age + 2 * gap], sold=True)
+    for gap in (5, 10, 21):
+        add(f"R{gap:02d}", [0, gap, 2 * gap], sold=False)
+        add(f"R{gap:02d}OLD", [61, 61 + gap], sold=False)
+    return pd.DataFrame(rows, columns=['dealer_code', 'dealer_name', 'request_type', 'received_at',
+                                       'wholesale_vehicle_sold_date'])
+
+
+def make_dealer_request_tables(as_of, dealers=300, seed=0):
+    """
+    Synthetic ajans_dealers.dealer_requests and ajans_dealers.dealers for the dealer queries.
+    Includes dealers without requests, requests without dates, same-day purchases, a dealer listed
+    twice under two names, a dealer without a code and the dealers of boundary_dealer_requests().
+    """
+    rng = np.random.default_rng(seed)
+    as_of = pd.Timestamp(as_of)
+    codes = [f"D{i:04d}" for i in range(dealers)]
+    n_requests = rng.choice([0, 0, 1, 2, 3, 5, 10, 40], dealers)
+    dealer_code = np.repeat(codes, n_requests)
+    n = len(dealer_code)
+
+    received_at = pd.Series(as_of - pd.to_timedelta(rng.integers(0, 400, n), 'D')
+                            + pd.to_timedelta(rng.integers(0, 24, n), 'h'))
+    # Sold within three weeks of the request and never after as_of
+    sold_at = (received_at + pd.to_timedelta(rng.integers(0, 21, n), 'D')).clip(upper=as_of + pd.Timedelta(hours=1))
+    dealer_requests = pd.DataFrame({
+        'dealer_code': dealer_code,
+        'dealer_name': [f"Dealer {code}" for code in dealer_code],
+        'request_type': rng.choice(['Buy Now', 'Buy Now', 'Other'], n),
+        'received_at': received_at.where(rng.random(n) >= 0.05),
+        'wholesale_vehicle_sold_date': sold_at.where(rng.random(n) < 0.5)
+    })
+    boundary = boundary_dealer_requests(as_of)
+    dealer_requests = pd.concat([dealer_requests, boundary], ignore_index=True)
+    dealer_table = pd.concat([
+        pd.DataFrame({
+            'dealer_code': codes + ['D0001', 'D0002', None, 'D9999'],
+            'dealer_name': [f"Dealer {code}" for code in codes] + ['Dealer D0001', 'Dealer D0002 (old)', 'No code', 'Ghost']
+        }),
+        boundary[['dealer_code', 'dealer_name']].drop_duplicates()
+    ], ignore_index=True)
+    return {'dealer_requests': dealer_requests, 'dealers': dealer_table}
+
+
+def comparable(values):
+    """Column values as strings that compare equal across DuckDB and pandas dtypes."""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        values = values.dt.strftime('%Y-%m-%d')
+    elif pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        values = values.astype('float64').round(6)
+    return values.astype(object).where(values.notna(), None).map(str)
+
+
+def assert_same_rows(expected, actual, key):
+    """Both frames have the same columns in the same order and the same values, matched by key."""
+    assert list(actual.columns) == list(expected.columns), \
+        f"columns {list(actual.columns)} instead of {list(expected.columns)}"
+    assert len(actual) == len(expected), f"{len(actual)} rows instead of {len(expected)}"
+    expected = expected.sort_values(key, key=comparable, kind='stable').reset_index(drop=True)
+    actual = actual.sort_values(key, key=comparable, kind='stable').reset_index(drop=True)
+    differences = []
+    for column in expected.columns:
+        before, after = comparable(expected[column]), comparable(actual[column])
+        mismatched = before != after
+        if mismatched.any():
+            first = mismatched.idxmax()
+            differences.append(f"{column} ({mismatched.sum()} rows, e.g. {expected.loc[first, key].tolist()}: "
+                               f"{before[first]} -> {after[first]})")
+    assert not differences, "; ".join(differences)
+
+
+def check_dealer_seg_preaggregation(tgr):
+    """Pre-aggregating the event CTEs of dealer_seg_query returns the rows of the fan-out join."""
+    as_of = '2025-06-01'
+    tables = make_dealer_request_tables(as_of)
+    legacy = run_bigquery_sql(read_fixture('dealer_seg_query_legacy.sql'), tables, as_of)
+    preaggregated = run_bigquery_sql(read_fixture('dealer_seg_query_preaggregated.sql'), tables, as_of)
+    assert_same_rows(legacy, preaggregated, ['dealer_code', 'dealer_name'])
+
+
+def app_queries(tgr):
+    """The SQL text of every query load_data() sends, by result name."""
+    client = FakeBigQueryClient(make_query_results(10))
+    install_fake_bigquery(tgr, client)
+    with tempfile.TemporaryDirectory() as snapshot_dir:
+        tgr.SNAPSHOT_DIR = snapshot_dir
+        tgr.load_data(snapshot_max_age=timedelta(0))
+    return client.sql
+
+
+def check_segmentation_engine(tgr):
+    """compute_segmentation() labels dealers as the CASE logic of the legacy dealer_seg_query did."""
+    as_of = '2025-06-01'
+    tables = make_dealer_request_tables(as_of)
+    legacy = run_bigquery_sql(read_fixture('dealer_seg_query_legacy.sql'), tables, as_of)
+
+    # The daily counts the app now queries, converted as load_data() converts BigQuery's Arrow result
+    events = run_bigquery_sql(app_queries(tgr)['dealer_events'], tables, as_of)
+    events['event_date'] = events['event_date'].dt.date
+    events = tgr.arrow_to_dataframe(pa.Table.from_pandas(events, preserve_index=False),
+                                    tgr.RESULT_DTYPES['dealer_events'])
+    segmentation = tgr.compute_segmentation(events, as_of=as_of)
+    assert_same_rows(legacy, segmentation, ['dealer_code', 'dealer_name'])
+
+
+def legacy_priority(tgr, current_seg):
+    """Substring rules of the original get_priority() and get_priority_score(), the reference for PRIORITY_TABLE."""
+    if any(case in current_seg for case in tgr.critical_cases):
+        status, cases = '🔴 Critical Priority', tgr.critical_cases
+    elif any(case in current_seg for case in tgr.high_cases):
+        status, cases = '🟠 High Priority', tgr.high_cases
+    elif any(case in current_seg for case in tgr.medium_cases):
+        status, cases = '🟡 Medium Priority', tgr.medium_cases
+    else:
+        status, cases = '⚪ Low Priority', tgr.low_cases
+
+    for i, case in enumerate(cases):
+        if case in current_seg:
+            return status, i
+    return status, len(cases)
+
+
+def check_priority_rules(tgr):
+    """classify_segmentations() gives every segmentation the priority of the original substring rules."""
+    as_of = '2025-06-01'
+    events = run_bigquery_sql(app_queries(tgr)['dealer_events'], make_dealer_request_tables(as_of), as_of)
+    produced = set(tgr.compute_segmentation(events, as_of=as_of)['current_segmentation'])
+    missing = produced - set(tgr.SEGMENTATION_VALUES)
+    assert not missing, f"segmentations missing from SEGMENTATION_VALUES: {sorted(missing)}"
+
+    # Unexpected values are classified too, by matching them one by one
+    segmentations = tgr.SEGMENTATION_VALUES + ['Inactive - Frequent (New) - Unexpected', 'Unexpected']
+    status, priority_score, _ = tgr.classify_segmentations(pd.Series(segmentations))
+    changed = [
+        f"{segmentation}: {expected} -> {(actual_status, actual_score)}"
+        for segmentation, actual_status, actual_score in zip(segmentations, status, priority_score)
+        if (expected := legacy_priority(tgr, segmentation)) != (actual_status, actual_score)
+    ]
+    assert not changed, "; ".join(changed)
+
+
+def check_event_window_merge(tgr):
+    """Refetched events at the watermark are merged once, and late events sharing its timestamp are kept."""
+    now = pd.Timestamp.now(tz='UTC').floor('s')
+    older, newest = now - pd.Timedelta(minutes=5), now - pd.Timedelta(minutes=1)
+
+    def events(rows):
+        frame = pd.DataFrame(rows, columns=['time', 'make', 'dealer_code', 'buy_now_price'])
+        return frame.astype({'make': 'category', 'dealer_code': 'category'})
+
+    window = tgr.EventWindow()
+    window.merge(events([(newest, 'Kia', 'D1', np.nan), (older, 'BMW', 'D2', 100.0)]))
+    assert window.watermark == newest, f"watermark {window.watermark} instead of {newest}"
+
+    # The next fetch repeats the event at the watermark, with one that arrived late at the same time
+    frame = window.merge(events([(now, 'Fiat', 'D3', 50.0), (newest, 'Kia', 'D1', np.nan), (newest, 'Kia', 'D4', 70.0)]))
+    actual = sorted(zip(frame['time'], frame['dealer_code'].astype(str)))
+    expected = sorted([(now, 'D3'), (newest, 'D1'), (newest, 'D4'), (older, 'D2')])
+    assert actual == expected, f"window {actual} instead of {expected}"
+
+    # Naive times are read as UTC
+    frame = window.merge(events([(now.tz_localize(None), 'Fiat', 'D3', 50.0)]))
+    assert len(frame) == 4 and str(frame['time'].dt.tz) == 'UTC', f"{len(frame)} events, times in {frame['time'].dt.tz}"
+
+
+# Correctness checks run by `benchmark.py checks`
+CHECKS = {
+    'inbox_name_sort': check_inbox_name_sort,
+    'dealer_seg_preaggregation': check_dealer_seg_preaggregation,
+    'segmentation_engine': check_segmentation_engine,
+    'priority_rules': check_priority_rules,
+    'event_window_merge': check_event_window_merge
+}
+
+
+def run_checks(args):
+    unknown = set(args.only) - set(CHECKS)
+    if unknown:
+        sys.exit(f"Unknown checks: {', '.join(sorted(unknown))}")
+    tgr = import_app()
+    failed = []
+    for name in args.only or CHECKS:
+        try:
+            CHECKS[name](tgr)
+        except AssertionError as e:
+            failed.append(name)
+            print(f"FAIL {name}: {e}")
+        except ModuleNotFoundError as e:
+            # The SQL checks need DuckDB, which the app itself does not use
+            print(f"skip {name}: {e}")
+        else:
+            print(f"ok   {name}")
+    if failed:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    recommendations = subparsers.add_parser('recommendations', help="get_recommended_cars() against the legacy scorer")
+    recommendations.add_argument('--live-cars', type=int, default=20000)
+    recommendations.add_argument('--dealers', type=int, default=20)
+    recommendations.add_argument('--purchases', type=int, default=40, help="Mean purchases per dealer")
+    recommendations.add_argument('--repeat', type=int, default=5)
+    recommendations.add_argument('--seed', type=int, default=0)
+    recommendations.set_defaults(run=bench_recommendations)
+
+    batch = subparsers.add_parser('batch', help="RecommendationEngine against get_recommended_cars() per dealer")
+    batch.add_argument('--live-cars', type=int, default=5000)
+    batch.add_argument('--dealers', type=int, default=1500)
+    batch.add_argument('--purchases', type=int, default=40, help="Mean purchases per dealer")
+    batch.add_argument('--repeat', type=int, default=3)
+    batch.add_argument('--seed', type=int, default=0)
+    batch.set_defaults(run=bench_batch)
+
+    buyers = subparsers.add_parser('buyers', help="BuyerIndex against get_recommended_cars() scores")
+    buyers.add_argument('--live-cars', type=int, default=5000)
+    buyers.add_argument('--dealers', type=int, default=1500)
+    buyers.add_argument('--purchases', type=int, default=40, help="Mean purchases per dealer")
+    buyers.add_argument('--check-cars', type=int, default=10)
+    buyers.add_argument('--repeat', type=int, default=3)
+    buyers.add_argument('--seed', type=int, default=0)
+    buyers.set_defaults(run=bench_buyers)
+
+    startup = subparsers.add_parser('startup', help="Cold import time of tgr and time to the login form")
+    startup.add_argument('--repeat', type=int, default=5)
+    startup.add_argument('--max-login-ms', type=float, default=1500,
+                         help="Fail when the median time to the login form exceeds this")
+    startup.set_defaults(run=bench_startup)
+
+    suite = subparsers.add_parser('suite', help="Data loading, inbox, recommendations and profile renders "
+                                                "on synthetic data, written to JSON")
+    suite.add_argument('--dealers', type=int, nargs='+', default=[100, 1000, 10000])
+    suite.add_argument('--live-cars', type=int, default=5000)
+    suite.add_argument('--views-per-dealer', type=float, default=20,
+                       help="Mean car views per active dealer; 20%% of dealers have none, "
+                            "so 50k dealers at 20 give about 800k view events")
+    suite.add_argument('--eager-activity', action='store_true',
+                       help="Load all recent views and filters in load_data() instead of per dealer")
+    suite.add_argument('--latency-ms', type=float, default=0, help="Simulated time of every BigQuery job")
+    suite.add_argument('--repeat', type=int, default=3)
+    suite.add_argument('--seed', type=int, default=0)
+    suite.add_argument('--output', default='benchmark_results.json')
+    suite.add_argument('--baseline', help="Results file to compare against; regressions exit non-zero")
+    suite.add_argument('--tolerance', type=float, default=0.25,
+                       help="Allowed slowdown against the baseline, as a fraction")
+    suite.set_defaults(run=bench_suite)
+
+    sessions = subparsers.add_parser('sessions', help="Per-rerun time and memory of concurrent sessions "
+                                                      "reading the datasets, shared against copied")
+    sessions.add_argument('--sessions', type=int, default=20)
+    sessions.add_argument('--dealers', type=int, default=5000)
+    sessions.add_argument('--live-cars', type=int, default=5000)
+    sessions.add_argument('--views-per-dealer', type=float, default=250,
+                          help="Mean car views per dealer; 5k dealers at 250 give about a million view events")
+    sessions.add_argument('--lazy-activity', action='store_true',
+                          help="Leave recent views and filters out of the datasets, as the app does by default")
+    sessions.add_argument('--seed', type=int, default=0)
+    sessions.set_defaults(run=bench_sessions)
+
+    checks = subparsers.add_parser('checks', help="Compare the optimized code paths with fixtures and legacy logic")
+    checks.add_argument('only', nargs='*', metavar='CHECK', help=f"Checks to run, all by default: {', '.join(CHECKS)}")
+    checks.set_defaults(run=run_checks)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
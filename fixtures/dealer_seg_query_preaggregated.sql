@@ -0,0 +1,419 @@
+-- dealer_seg_query with every event CTE aggregated per dealer_code before the join.
+-- `python benchmark.py checks` compares it with dealer_seg_query_legacy.sql.
+WITH dealer_purchases_60d AS (
+SELECT 
+    dealer_code,
+    dealer_name,
+    DATE(wholesale_vehicle_sold_date) as purchase_date
+FROM ajans_dealers.dealer_requests
+WHERE request_type = 'Buy Now' 
+AND DATE(wholesale_vehicle_sold_date) >= DATE_SUB(CURRENT_DATE(), INTERVAL 60 DAY)
+),
+
+dealer_purchases_previous_60d AS (
+    SELECT 
+        dealer_code,
+        dealer_name,
+        DATE(wholesale_vehicle_sold_date) as purchase_date
+    FROM ajans_dealers.dealer_requests
+    WHERE request_type = 'Buy Now' 
+    AND DATE(wholesale_vehicle_sold_date) BETWEEN DATE_SUB(CURRENT_DATE(), INTERVAL 120 DAY) AND DATE_SUB(CURRENT_DATE(), INTERVAL 60 DAY)
+),
+
+dealer_purchases_lifetime AS (
+    SELECT 
+        dealer_code,
+        dealer_name,
+        DATE(wholesale_vehicle_sold_date) as purchase_date
+    FROM ajans_dealers.dealer_requests
+    WHERE request_type = 'Buy Now' and wholesale_vehicle_sold_date is not null
+),
+
+dealer_requests_60d AS (
+    SELECT 
+        dealer_code,
+        dealer_name,
+        DATE(received_at) as request_date
+    FROM ajans_dealers.dealer_requests
+    WHERE request_type = 'Buy Now'
+    AND DATE(received_at) >= DATE_SUB(CURRENT_DATE(), INTERVAL 60 DAY)
+),
+
+dealer_requests_lifetime AS (
+    SELECT 
+        dealer_code,
+        dealer_name,
+        DATE(received_at) as request_date
+    FROM ajans_dealers.dealer_requests
+    WHERE request_type = 'Buy Now'
+),
+
+purchase_intervals_lifetime AS (
+    SELECT 
+        dealer_code,
+        purchase_date,
+        DATE_DIFF(purchase_date, 
+            LAG(purchase_date) OVER (PARTITION BY dealer_code ORDER BY purchase_date),
+            DAY) as days_between_purchases
+    FROM dealer_purchases_lifetime
+),
+
+purchase_intervals_60d AS (
+    SELECT 
+        dealer_code,
+        purchase_date,
+        DATE_DIFF(purchase_date, 
+            LAG(purchase_date) OVER (PARTITION BY dealer_code ORDER BY purchase_date),
+            DAY) as days_between_purchases
+    FROM dealer_purchases_60d
+),
+
+purchase_intervals_previous_60d AS (
+    SELECT 
+        dealer_code,
+        purchase_date,
+        DATE_DIFF(purchase_date, 
+            LAG(purchase_date) OVER (PARTITION BY dealer_code ORDER BY purchase_date),
+            DAY) as days_between_purchases
+    FROM dealer_purchases_previous_60d
+),
+
+request_intervals_lifetime AS (
+    SELECT 
+        dealer_code,
+        request_date,
+        DATE_DIFF(request_date, 
+            LAG(request_date) OVER (PARTITION BY dealer_code ORDER BY request_date),
+            DAY) as days_between_requests
+    FROM dealer_requests_lifetime
+),
+
+request_intervals_60d AS (
+    SELECT 
+        dealer_code,
+        request_date,
+        DATE_DIFF(request_date, 
+            LAG(request_date) OVER (PARTITION BY dealer_code ORDER BY request_date),
+            DAY) as days_between_requests
+    FROM dealer_requests_60d
+),
+
+avg_intervals AS (
+    SELECT 
+        dealer_code,
+        AVG(days_between_purchases) as lifetime_avg_days_between_purchases
+    FROM purchase_intervals_lifetime
+    WHERE days_between_purchases IS NOT NULL
+    GROUP BY dealer_code
+),
+
+avg_intervals_60d AS (
+    SELECT 
+        dealer_code,
+        AVG(days_between_purchases) as sixty_day_avg_days_between_purchases
+    FROM purchase_intervals_60d
+    WHERE days_between_purchases IS NOT NULL
+    GROUP BY dealer_code
+),
+
+avg_intervals_previous_60d AS (
+    SELECT 
+        dealer_code,
+        AVG(days_between_purchases) as previous_sixty_day_avg_days_between_purchases
+    FROM purchase_intervals_previous_60d
+    WHERE days_between_purchases IS NOT NULL
+    GROUP BY dealer_code
+),
+
+avg_request_intervals AS (
+    SELECT 
+        dealer_code,
+        AVG(days_between_requests) as lifetime_avg_days_between_requests
+    FROM request_intervals_lifetime
+    WHERE days_between_requests IS NOT NULL
+    GROUP BY dealer_code
+),
+
+avg_request_intervals_60d AS (
+    SELECT 
+        dealer_code,
+        AVG(days_between_requests) as sixty_day_avg_days_between_requests
+    FROM request_intervals_60d
+    WHERE days_between_requests IS NOT NULL
+    GROUP BY dealer_code
+),
+
+dealer_requests_30d AS (
+    SELECT 
+        dealer_code,
+        COUNT(*) as buy_requests_30d
+    FROM ajans_dealers.dealer_requests
+    WHERE request_type = 'Buy Now'
+    AND DATE(received_at) >= DATE_SUB(CURRENT_DATE(), INTERVAL 30 DAY)
+    GROUP BY dealer_code
+),
+
+sold_cars_30d AS (
+    SELECT 
+        dealer_code,
+        COUNT(*) as sold_cars_30d
+    FROM ajans_dealers.dealer_requests
+    WHERE request_type = 'Buy Now'
+    AND DATE(wholesale_vehicle_sold_date) >= DATE_SUB(CURRENT_DATE(), INTERVAL 30 DAY)
+    GROUP BY dealer_code
+),
+
+last_purchase_dates AS (
+    SELECT 
+        dealer_code,
+        MAX(DATE(wholesale_vehicle_sold_date)) as last_purchase_date,
+        DATE_DIFF(CURRENT_DATE(), MAX(DATE(wholesale_vehicle_sold_date)), DAY) as days_since_last_purchase
+    FROM ajans_dealers.dealer_requests
+    WHERE request_type = 'Buy Now' 
+    AND wholesale_vehicle_sold_date IS NOT NULL
+    GROUP BY dealer_code
+),
+
+last_purchase_dates_previous_60d AS (
+    SELECT 
+        dealer_code,
+        MAX(DATE(wholesale_vehicle_sold_date)) as last_purchase_date_previous_60d,
+        DATE_DIFF(DATE_SUB(CURRENT_DATE(), INTERVAL 60 DAY), 
+                 MAX(DATE(wholesale_vehicle_sold_date)), DAY) as days_since_last_purchase_previous_60d
+    FROM ajans_dealers.dealer_requests
+    WHERE request_type = 'Buy Now' 
+    AND DATE(wholesale_vehicle_sold_date) BETWEEN DATE_SUB(CURRENT_DATE(), INTERVAL 120 DAY) AND DATE_SUB(CURRENT_DATE(), INTERVAL 60 DAY)
+    GROUP BY dealer_code
+),
+
+purchases_lifetime_agg AS (
+    SELECT 
+        dealer_code,
+        COUNT(DISTINCT purchase_date) as total_purchases,
+        COUNT(DISTINCT DATE_TRUNC(purchase_date, MONTH)) as active_months
+    FROM dealer_purchases_lifetime
+    GROUP BY dealer_code
+),
+
+purchases_60d_agg AS (
+    SELECT 
+        dealer_code,
+        COUNT(DISTINCT purchase_date) as total_purchases,
+        COUNT(DISTINCT DATE_TRUNC(purchase_date, MONTH)) as active_months
+    FROM dealer_purchases_60d
+    GROUP BY dealer_code
+),
+
+purchases_previous_60d_agg AS (
+    SELECT 
+        dealer_code,
+        COUNT(DISTINCT purchase_date) as total_purchases,
+        COUNT(DISTINCT DATE_TRUNC(purchase_date, MONTH)) as active_months
+    FROM dealer_purchases_previous_60d
+    GROUP BY dealer_code
+),
+
+requests_lifetime_agg AS (
+    SELECT 
+        dealer_code,
+        COUNT(DISTINCT request_date) as total_requests,
+        COUNT(DISTINCT DATE_TRUNC(request_date, MONTH)) as active_months
+    FROM dealer_requests_lifetime
+    GROUP BY dealer_code
+),
+
+requests_60d_agg AS (
+    SELECT 
+        dealer_code,
+        COUNT(DISTINCT request_date) as total_requests,
+        COUNT(DISTINCT DATE_TRUNC(request_date, MONTH)) as active_months
+    FROM dealer_requests_60d
+    GROUP BY dealer_code
+),
+
+-- One row per dealer: every joined CTE is already aggregated per dealer_code
+metrics AS (
+    SELECT 
+        d.dealer_code,
+        d.dealer_name,
+        CASE 
+            WHEN COALESCE(pl.total_purchases, 0) > 0 THEN 'Dealer'
+            ELSE 'User'
+        END as user_vs_dealer_flag,
+        ai.lifetime_avg_days_between_purchases,
+        ai60.sixty_day_avg_days_between_purchases,
+        aip60.previous_sixty_day_avg_days_between_purchases,
+        ari.lifetime_avg_days_between_requests,
+        ari60.sixty_day_avg_days_between_requests,
+        lpd.last_purchase_date,
+        lpd.days_since_last_purchase,
+        lpdp.last_purchase_date_previous_60d,
+        lpdp.days_since_last_purchase_previous_60d,
+        COALESCE(pl.total_purchases, 0) as total_purchases_lifetime,
+        COALESCE(p60.total_purchases, 0) as total_purchases_60d,
+        COALESCE(pp60.total_purchases, 0) as total_purchases_previous_60d,
+        COALESCE(rl.total_requests, 0) as total_requests_lifetime,
+        COALESCE(r60.total_requests, 0) as total_requests_60d,
+        ROUND(pl.total_purchases / NULLIF(pl.active_months, 0), 2) as avg_purchases_per_month_lifetime,
+        ROUND(p60.total_purchases / NULLIF(p60.active_months, 0), 2) as avg_purchases_per_month_60d,
+        ROUND(pp60.total_purchases / NULLIF(pp60.active_months, 0), 2) as avg_purchases_per_month_previous_60d,
+        ROUND(rl.total_requests / NULLIF(rl.active_months, 0), 2) as avg_requests_per_month_lifetime,
+        ROUND(r60.total_requests / NULLIF(r60.active_months, 0), 2) as avg_requests_per_month_60d,
+        sc.sold_cars_30d,
+        dr30.buy_requests_30d
+    FROM (SELECT DISTINCT dealer_code, dealer_name FROM ajans_dealers.dealers) d
+    LEFT JOIN purchases_lifetime_agg pl ON d.dealer_code = pl.dealer_code
+    LEFT JOIN purchases_60d_agg p60 ON d.dealer_code = p60.dealer_code
+    LEFT JOIN purchases_previous_60d_agg pp60 ON d.dealer_code = pp60.dealer_code
+    LEFT JOIN requests_lifetime_agg rl ON d.dealer_code = rl.dealer_code
+    LEFT JOIN requests_60d_agg r60 ON d.dealer_code = r60.dealer_code
+    LEFT JOIN avg_intervals ai ON d.dealer_code = ai.dealer_code
+    LEFT JOIN avg_intervals_60d ai60 ON d.dealer_code = ai60.dealer_code
+    LEFT JOIN avg_intervals_previous_60d aip60 ON d.dealer_code = aip60.dealer_code
+    LEFT JOIN avg_request_intervals ari ON d.dealer_code = ari.dealer_code
+    LEFT JOIN avg_request_intervals_60d ari60 ON d.dealer_code = ari60.dealer_code
+    LEFT JOIN sold_cars_30d sc ON d.dealer_code = sc.dealer_code
+    LEFT JOIN dealer_requests_30d dr30 ON d.dealer_code = dr30.dealer_code
+    LEFT JOIN last_purchase_dates lpd ON d.dealer_code = lpd.dealer_code
+    LEFT JOIN last_purchase_dates_previous_60d lpdp ON d.dealer_code = lpdp.dealer_code
+)
+
+SELECT 
+    *,
+    CASE 
+        WHEN total_purchases_lifetime = 0 THEN 'No Purchase'
+        WHEN total_purchases_lifetime = 1 THEN '1 Time Purchaser'
+        WHEN lifetime_avg_days_between_purchases <= 15 THEN '0-15 days'
+        WHEN lifetime_avg_days_between_purchases <= 30 THEN '15-30 days'
+        WHEN lifetime_avg_days_between_purchases <= 60 THEN '30-60 days'
+        ELSE '60+ days'
+    END as purchase_segment_lifetime,
+    CASE 
+        WHEN total_purchases_60d = 0 THEN 'No Purchase'
+        WHEN total_purchases_60d = 1 THEN '1 Time Purchaser'
+        WHEN sixty_day_avg_days_between_purchases <= 15 THEN 
+            CASE
+                WHEN sixty_day_avg_days_between_purchases <= 7.5 THEN '0-15 days (New)'
+                ELSE '0-15 days (At Risk)'
+            END
+        WHEN sixty_day_avg_days_between_purchases <= 30 THEN 
+            CASE
+                WHEN sixty_day_avg_days_between_purchases <= 22.5 THEN '15-30 days (New)'
+                ELSE '15-30 days (At Risk)'
+            END
+        WHEN sixty_day_avg_days_between_purchases <= 60 THEN 
+            CASE
+                WHEN sixty_day_avg_days_between_purchases <= 45 THEN '30-60 days (New)'
+                ELSE '30-60 days (At Risk)'
+            END
+        ELSE '60+ days'
+    END as purchase_segment_60d,
+    CASE 
+        WHEN total_purchases_previous_60d = 0 THEN 'No Purchase'
+        WHEN total_purchases_previous_60d = 1 THEN '1 Time Purchaser'
+        WHEN previous_sixty_day_avg_days_between_purchases <= 15 THEN '0-15 days'
+        WHEN previous_sixty_day_avg_days_between_purchases <= 30 THEN '15-30 days'
+        WHEN previous_sixty_day_avg_days_between_purchases <= 60 THEN '30-60 days'
+        ELSE '60+ days'
+    END as purchase_segment_previous_60d,
+    CASE 
+        WHEN total_purchases_lifetime = 0 THEN 'No Purchase'
+        WHEN total_purchases_lifetime = 1 THEN '1 Time Purchaser'
+        WHEN lifetime_avg_days_between_purchases <= 30 THEN 'Frequent'
+        WHEN lifetime_avg_days_between_purchases <= 60 THEN 'Active'
+        ELSE 'Inactive'
+    END as final_bucket_lifetime,
+    CASE 
+        WHEN total_purchases_60d = 0 THEN 'No Purchase'
+        WHEN total_purchases_60d = 1 THEN '1 Time Purchaser'
+        WHEN sixty_day_avg_days_between_purchases <= 30 THEN 
+            CASE
+                WHEN sixty_day_avg_days_between_purchases <= 15 THEN 'Frequent (New)'
+                ELSE 'Frequent (At Risk)'
+            END
+        WHEN sixty_day_avg_days_between_purchases <= 60 THEN 
+            CASE
+                WHEN sixty_day_avg_days_between_purchases <= 45 THEN 'Active (New)'
+                ELSE 'Active (At Risk)'
+            END
+        ELSE 'Inactive'
+    END as final_bucket_60d,
+    CASE 
+        WHEN total_purchases_previous_60d = 0 THEN 'No Purchase'
+        WHEN total_purchases_previous_60d = 1 THEN '1 Time Purchaser'
+        WHEN previous_sixty_day_avg_days_between_purchases <= 30 THEN 'Frequent'
+        WHEN previous_sixty_day_avg_days_between_purchases <= 60 THEN 'Active'
+        ELSE 'Inactive'
+    END as final_bucket_previous_60d,
+    CASE
+        WHEN total_purchases_previous_60d = 0 AND total_purchases_60d = 0 THEN 'No Purchase'
+        WHEN total_purchases_previous_60d = 0 AND total_purchases_60d = 1 THEN 'No Purchase - 1 Time Purchaser'
+        WHEN total_purchases_previous_60d = 1 AND total_purchases_60d = 0 THEN '1 Time Purchaser - No Purchase'
+        ELSE 
+            CONCAT(
+                CASE 
+                    WHEN total_purchases_previous_60d = 0 THEN 'No Purchase'
+                    WHEN previous_sixty_day_avg_days_between_purchases <= 30 THEN 'Frequent'
+                    WHEN previous_sixty_day_avg_days_between_purchases <= 60 THEN 'Active'
+                    ELSE 'Inactive'
+                END,
+                ' - ',
+                CASE 
+                    WHEN total_purchases_60d = 0 THEN 'No Purchase'
+                    WHEN total_purchases_60d = 1 THEN '1 Time Purchaser'
+                    WHEN sixty_day_avg_days_between_purchases <= 30 THEN 
+                        CASE
+                            WHEN days_since_last_purchase <= 15 THEN 
+                                CASE 
+                                    WHEN previous_sixty_day_avg_days_between_purchases > 30 
+                                         OR previous_sixty_day_avg_days_between_purchases IS NULL THEN 'Frequent (New)'
+                                    ELSE 'Frequent'
+                                END
+                            ELSE 'Frequent (At Risk)'
+                        END
+                    WHEN sixty_day_avg_days_between_purchases <= 60 THEN 
+                        CASE
+                            WHEN days_since_last_purchase <= 30 THEN 
+                                CASE 
+                                    WHEN previous_sixty_day_avg_days_between_purchases > 60 
+                                         OR previous_sixty_day_avg_days_between_purchases IS NULL THEN 'Active (New)'
+                                    ELSE 'Active'
+                                END
+                            ELSE 'Active (At Risk)'
+                        END
+                    ELSE 'Inactive'
+                END
+            )
+    END as current_segmentation,
+    CASE 
+        WHEN total_requests_lifetime = 0 THEN 'No Requests'
+        WHEN total_requests_lifetime = 1 THEN '1 Request'
+        WHEN lifetime_avg_days_between_requests <= 5 THEN '0-5 days'
+        WHEN lifetime_avg_days_between_requests <= 10 THEN '5-10 days'
+        WHEN lifetime_avg_days_between_requests <= 21 THEN '10-21 days'
+        ELSE '21+ days'
+    END as request_segment_lifetime,
+    CASE 
+        WHEN total_requests_60d = 0 THEN 'No Requests'
+        WHEN total_requests_60d = 1 THEN '1 Request'
+        WHEN sixty_day_avg_days_between_requests <= 5 THEN '0-5 days'
+        WHEN sixty_day_avg_days_between_requests <= 10 THEN '5-10 days'
+        WHEN sixty_day_avg_days_between_requests <= 21 THEN '10-21 days'
+        ELSE '21+ days'
+    END as request_segment_60d,
+    CASE 
+        WHEN total_requests_lifetime = 0 THEN 'No Requests'
+        WHEN total_requests_lifetime = 1 THEN '1 Request'
+        WHEN lifetime_avg_days_between_requests <= 10 THEN 'Frequent'
+        WHEN lifetime_avg_days_between_requests <= 21 THEN 'Active'
+        ELSE 'Inactive'
+    END as request_activity_bucket_lifetime,
+    CASE 
+        WHEN total_requests_60d = 0 THEN 'No Requests'
+        WHEN total_requests_60d = 1 THEN '1 Request'
+        WHEN sixty_day_avg_days_between_requests <= 10 THEN 'Frequent'
+        WHEN sixty_day_avg_days_between_requests <= 21 THEN 'Active'
+        ELSE 'Inactive'
+    END as request_activity_bucket_60d
+FROM metrics
+ORDER BY total_requests_lifetime DESC NULLS LAST;
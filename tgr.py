@@ -1,12 +1,16 @@
 import streamlit as st
-import pandas as pd
-from google.cloud import bigquery
-import plotly.express as px
-import plotly.graph_objects as go
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import deque
+from contextlib import contextmanager
 import hashlib
+import threading
+import time
 import json
-from google.oauth2 import service_account
+import os
+import shutil
+import sqlite3
+import sys
 
 # Authentication credentials
 CREDENTIALS = {
@@ -24,6 +28,7 @@ def check_password():
                 hashlib.sha256(st.session_state["password"].encode()).hexdigest() == CREDENTIALS[
             st.session_state["username"]]:
             st.session_state["password_correct"] = True
+            st.session_state["authenticated_user"] = st.session_state["username"]  # Gates the admin tab
             del st.session_state["password"]  # Don't store the password
             del st.session_state["username"]  # Don't store the username
         else:
@@ -53,28 +58,1193 @@ st.set_page_config(
 
 # Main app logic
 if check_password():
-    # Function to load data from BigQuery
-    @st.cache_data(ttl=43200)  # Cache data for 12 hours
-    def load_data():
-        # Try to get credentials from Streamlit secrets first
+    # Imported after login so the login form renders without them.
+    # BigQuery is imported when data is loaded and Plotly when the charts render.
+    import numpy as np
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+    from cachetools import TTLCache
+
+    # Frames are shared across sessions, so derived frames must never write back into them
+    pd.set_option("mode.copy_on_write", True)
+
+    # Declared column types for the load_data() result sets, applied to the Arrow
+    # results before conversion so the DataFrames need no coercion afterwards.
+    # 'category' columns are dictionary-encoded; other strings become string[pyarrow].
+    RESULT_DTYPES = {
+        'live_cars': {
+            'make': 'category',
+            'model': 'category',
+            'year': pa.float64(),
+            'kilometers': pa.float64()
+        },
+        'historical': {
+            'dealer_code': 'category',
+            'dealer_name': 'category',
+            'make': 'category',
+            'model': 'category',
+            'time_on_app': pa.float64(),
+            'price': pa.float64(),
+            'year': pa.float64(),
+            'kilometers': pa.float64(),
+            'sylndr_acquisition_price': pa.float64(),
+            'market_retail_price': pa.float64(),
+            'median_asked_price': pa.float64(),
+            'refurbishment_cost': pa.float64()
+        },
+        'dealer_events': {
+            'dealer_code': 'category',
+            'dealer_name': 'category',
+            'event_type': 'category'
+        },
+        'dealer_activity': {
+            'dealer_code': 'category',
+            'dealer_name': 'category'
+        },
+        'recent_views': {
+            'dealer_code': 'category',
+            'make': 'category',
+            'model': 'category',
+            'trim': 'category',
+            'transmission': 'category',
+            'body_style': 'category',
+            'kilometrage': pa.float64(),
+            'buy_now_price': pa.float64()
+        },
+        'recent_filters': {
+            'dealer_code': 'category',
+            'make': 'category',
+            'model': 'category',
+            'group_filter': 'category',
+            'status': 'category'
+        },
+        'olx_listings': {
+            'dealer_code': 'category',
+            'make': 'category',
+            'model': 'category',
+            'condition': 'category',
+            'region': 'category',
+            'year': pa.float64(),
+            'kilometers': pa.float64(),
+            'price': pa.float64(),
+            'is_active': pa.bool_()
+        }
+    }
+
+    ARROW_TYPES_MAPPER = {
+        pa.string(): pd.StringDtype("pyarrow"),
+        pa.large_string(): pd.StringDtype("pyarrow"),
+        pa.int64(): pd.Int64Dtype(),
+        pa.bool_(): pd.BooleanDtype()
+    }.get
+
+
+    def arrow_to_dataframe(table, dtypes):
+        """
+        Convert an Arrow query result to a DataFrame using the declared column types.
+        Args:
+            table: pyarrow.Table returned by the query
+            dtypes: Dict mapping column names to an Arrow type or 'category'
+        Returns:
+            DataFrame with categorical, nullable and pyarrow-backed columns
+        """
+        for name, target in dtypes.items():
+            if name not in table.column_names:
+                continue
+            index = table.column_names.index(name)
+            column = table.column(index)
+            if target == 'category':
+                column = pc.dictionary_encode(column.cast(pa.string()))
+            elif column.type != target:
+                try:
+                    column = column.cast(target, safe=False)
+                except pa.ArrowInvalid:
+                    # Values that can't be parsed become nulls
+                    column = pa.chunked_array([pa.array(
+                        pd.to_numeric(column.to_pandas(), errors='coerce'), from_pandas=True
+                    ).cast(target, safe=False)])
+            table = table.set_column(index, name, column)
+
+        return table.to_pandas(date_as_object=False, types_mapper=ARROW_TYPES_MAPPER)
+
+
+    def drop_unused_categories(df):
+        """Remove categories that have no rows left after filtering a DataFrame."""
+        for col in df.select_dtypes('category').columns:
+            df[col] = df[col].cat.remove_unused_categories()
+        return df
+
+
+    # Durations kept per stage for the percentiles of the performance tab
+    SPAN_HISTORY = 1000
+    # Spans are also appended to this file as JSON lines when it is set, or printed with "-"
+    SPAN_LOG_PATH = os.environ.get("SET_SPAN_LOG")
+
+
+    class SpanRecorder:
+        """
+        Rolling durations of the instrumented stages, shared by all sessions and threads of this process.
+        """
+
+        def __init__(self, history=SPAN_HISTORY, log_path=SPAN_LOG_PATH):
+            self.lock = threading.Lock()
+            self.history = history
+            self.durations = {}  # Stage -> milliseconds of its latest spans
+            self.recent = deque(maxlen=history)
+            self.log_file = None
+            if log_path:
+                self.log_file = sys.stdout if log_path == "-" else open(log_path, 'a', buffering=1)
+
+        def record(self, stage, ms, **fields):
+            entry = {
+                'time': datetime.now(timezone.utc).isoformat(),
+                'span': stage,
+                'ms': round(ms, 3),
+                'thread': threading.current_thread().name,
+                **fields
+            }
+            with self.lock:
+                self.durations.setdefault(stage, deque(maxlen=self.history)).append(ms)
+                self.recent.append(entry)
+                if self.log_file is not None:
+                    self.log_file.write(json.dumps(entry, default=str) + "\n")
+
+        def percentiles(self):
+            """
+            Returns:
+                DataFrame with the span count and p50/p95/p99/max milliseconds of each stage, slowest first
+            """
+            with self.lock:
+                durations = {stage: np.array(values) for stage, values in self.durations.items()}
+            stats = pd.DataFrame(
+                [
+                    {'stage': stage, 'count': len(values), 'p50': np.percentile(values, 50),
+                     'p95': np.percentile(values, 95), 'p99': np.percentile(values, 99), 'max': values.max()}
+                    for stage, values in durations.items()
+                ],
+                columns=['stage', 'count', 'p50', 'p95', 'p99', 'max']
+            )
+            return stats.sort_values('p95', ascending=False, ignore_index=True)
+
+        def recent_spans(self):
+            """The latest spans of all stages, newest first."""
+            with self.lock:
+                return pd.DataFrame(list(reversed(self.recent)))
+
+        def reset(self):
+            with self.lock:
+                self.durations.clear()
+                self.recent.clear()
+
+
+    @st.cache_resource
+    def get_span_recorder():
+        """Span recorder shared by all sessions of this process."""
+        return SpanRecorder()
+
+
+    @contextmanager
+    def span(stage, **fields):
+        """
+        Time the enclosed block as one span of a stage.
+        Args:
+            stage: Stage name, the key of its percentiles
+            fields: Extra values for the JSON log, such as the dealer_code.
+                The block may add more to the yielded dict, such as its row count.
+        """
+        start = time.perf_counter()
+        try:
+            yield fields
+        except Exception as e:
+            fields['error'] = type(e).__name__
+            raise
+        finally:
+            get_span_recorder().record(stage, (time.perf_counter() - start) * 1000, **fields)
+
+
+    # SQLite file collecting the statistics of every BigQuery job
+    JOB_STATS_PATH = os.environ.get("SET_JOB_STATS_DB", "job_stats.sqlite")
+    JOB_STATS_REPORT_DAYS = 7
+
+
+    def current_session_id():
+        """Streamlit session running this thread, or None in background threads."""
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+        ctx = get_script_run_ctx(suppress_warning=True)
+        return ctx.session_id if ctx else None
+
+
+    def milliseconds_between(start, end):
+        return (end - start).total_seconds() * 1000 if start and end else None
+
+
+    class JobStatsStore:
+        """
+        Statistics of finished BigQuery jobs in a local SQLite file: bytes processed and billed,
+        slot time, cache hits and queue time, tagged with the query name, dealer and session.
+        """
+
+        def __init__(self, path=JOB_STATS_PATH):
+            self.lock = threading.Lock()
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            with self.connection:
+                self.connection.execute("""
+                    CREATE TABLE IF NOT EXISTS query_jobs (
+                        recorded_at TEXT NOT NULL,
+                        day TEXT NOT NULL,
+                        query_name TEXT NOT NULL,
+                        dealer_code TEXT,
+                        session_id TEXT,
+                        job_id TEXT,
+                        total_bytes_processed INTEGER,
+                        total_bytes_billed INTEGER,
+                        slot_millis INTEGER,
+                        cache_hit INTEGER,
+                        queue_ms REAL,
+                        run_ms REAL,
+                        rows INTEGER
+                    )
+                """)
+
+        def record(self, job, query_name, dealer_code=None, session_id=None, rows=None):
+            """Store the statistics of a finished job. Failures are printed, never raised."""
+            try:
+                now = datetime.now(timezone.utc)
+                stats = (
+                    now.isoformat(), now.date().isoformat(), query_name, dealer_code, session_id,
+                    getattr(job, 'job_id', None),
+                    getattr(job, 'total_bytes_processed', None),
+                    getattr(job, 'total_bytes_billed', None),
+                    getattr(job, 'slot_millis', None),
+                    getattr(job, 'cache_hit', None),
+                    milliseconds_between(getattr(job, 'created', None), getattr(job, 'started', None)),
+                    milliseconds_between(getattr(job, 'started', None), getattr(job, 'ended', None)),
+                    rows
+                )
+                with self.lock, self.connection:
+                    self.connection.execute(
+                        "INSERT INTO query_jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", stats
+                    )
+            except Exception as e:
+                print(f"Error recording job statistics for {query_name}: {e}")
+
+        def query(self, sql, params=()):
+            with self.lock:
+                return pd.read_sql_query(sql, self.connection, params=params)
+
+        def daily_report(self, days=JOB_STATS_REPORT_DAYS):
+            """Cost and latency of each query per day, most bytes billed first."""
+            return self.query("""
+                SELECT day, query_name,
+                       COUNT(*) AS jobs,
+                       SUM(total_bytes_billed) / 1e9 AS gb_billed,
+                       SUM(total_bytes_processed) / 1e9 AS gb_processed,
+                       SUM(slot_millis) / 1000.0 AS slot_seconds,
+                       SUM(cache_hit) AS cache_hits,
+                       AVG(queue_ms) AS avg_queue_ms,
+                       AVG(run_ms) AS avg_run_ms
+                FROM query_jobs
+                WHERE day >= DATE('now', ?)
+                GROUP BY day, query_name
+                ORDER BY day DESC, gb_billed DESC
+            """, (f"-{days} days",))
+
+        def dealer_view_report(self, days=JOB_STATS_REPORT_DAYS):
+            """
+            Cost of the queries run to open each dealer's profile, most bytes billed first.
+            Background prefetches have no session and are left out.
+            """
+            return self.query("""
+                SELECT dealer_code,
+                       COUNT(DISTINCT session_id) AS sessions,
+                       COUNT(*) AS jobs,
+                       SUM(total_bytes_billed) / 1e9 AS gb_billed,
+                       SUM(slot_millis) / 1000.0 AS slot_seconds,
+                       AVG(queue_ms + run_ms) AS avg_job_ms
+                FROM query_jobs
+                WHERE dealer_code IS NOT NULL AND session_id IS NOT NULL AND day >= DATE('now', ?)
+                GROUP BY dealer_code
+                ORDER BY gb_billed DESC
+            """, (f"-{days} days",))
+
+
+    @st.cache_resource
+    def get_job_stats_store():
+        """Job statistics store shared by all sessions of this process."""
+        return JobStatsStore()
+
+
+    def run_queries_concurrently(client, queries, job_configs=None, download=None, dealer_code=None):
+        """
+        Submit several queries at once and download their results in parallel.
+        Args:
+            client: BigQuery client
+            queries: Dict mapping a query name to its SQL
+            job_configs: Optional dict mapping a query name to its QueryJobConfig
+            download: Optional function (name, job) -> DataFrame, defaults to job.to_dataframe()
+            dealer_code: Dealer the queries are run for, recorded with their job statistics
+        Returns:
+            Tuple of (results, timings): DataFrames and elapsed seconds keyed by query name
+        Raises:
+            RuntimeError: If any query fails. Jobs still running are cancelled.
+        """
+        job_configs = job_configs or {}
+        jobs = {}
+        timings = {}
+        job_stats = get_job_stats_store()
+        session_id = current_session_id()
+
+        def run_query(name):
+            start = time.perf_counter()
+            with span(f"query.{name}"):
+                job = client.query(queries[name], job_config=job_configs.get(name))
+            jobs[name] = job
+            with span(f"download.{name}") as fields:
+                df = download(name, job) if download else job.to_dataframe()
+                fields['rows'] = len(df)
+            timings[name] = time.perf_counter() - start
+            job_stats.record(job, name, dealer_code=dealer_code, session_id=session_id, rows=len(df))
+            return df
+
+        executor = ThreadPoolExecutor(max_workers=len(queries), thread_name_prefix="bq-load")
+        futures = {executor.submit(run_query, name): name for name in queries}
+        results = {}
+        try:
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+        except Exception as e:
+            # Stop waiting on the other queries and cancel their jobs
+            executor.shutdown(wait=False, cancel_futures=True)
+            for job in list(jobs.values()):
+                if not job.done():
+                    job.cancel()
+            raise RuntimeError(f"Query '{futures[future]}' failed: {e}") from e
+
+        executor.shutdown()
+        return results, timings
+
+
+    # Number of days of Mixpanel events kept for recent views and filters
+    EVENT_WINDOW_DAYS = 30
+    EVENT_EPOCH = datetime(1970, 1, 1)
+
+
+    class EventWindow:
+        """
+        Rolling window of one Mixpanel event table, refreshed incrementally.
+        The newest event time is kept as a watermark so each refresh only fetches events from it on.
+        Event times are UTC: the Mixpanel `time` columns are TIMESTAMPs, and merge() converts them to be sure.
+        """
+
+        def __init__(self):
+            self.lock = threading.Lock()
+            self.frame = None
+            self.watermark = None
+
+        def seed(self, frame):
+            """Replace the window with a snapshot of it if the snapshot is newer."""
+            with self.lock:
+                if frame.empty or (self.watermark is not None and frame['time'].max() <= self.watermark):
+                    return
+                self.frame = frame
+                self.watermark = frame['time'].max().to_pydatetime()
+
+        def merge(self, new_events):
+            """
+            Append events from the watermark on that the window does not have yet, and drop those outside it.
+            Args:
+                new_events: DataFrame of events fetched from the watermark on, newest first
+            Returns:
+                DataFrame with the full window of events, newest first
+            """
+            new_events = new_events.assign(time=pd.to_datetime(new_events['time'], utc=True))
+            with self.lock:
+                if self.frame is None or self.frame.empty:
+                    frame = new_events
+                else:
+                    # Another session may have merged the same events in the meantime
+                    newest = self.frame['time'].max()
+                    new_events = new_events[new_events['time'] >= newest]
+                    # Events at the watermark can arrive after it was taken, so they are fetched again.
+                    # The tables have no event id; the columns of an event identify it.
+                    at_newest = (new_events['time'] == newest).to_numpy()
+                    if at_newest.any():
+                        known = event_keys(self.frame[self.frame['time'] == newest][new_events.columns])
+                        repeated = np.zeros(len(new_events), dtype=bool)
+                        repeated[at_newest] = event_keys(new_events[at_newest]).isin(known)
+                        new_events = new_events[~repeated]
+                    frame = concat_events(new_events, self.frame)
+
+                cutoff = pd.Timestamp.now(tz='UTC').normalize() - pd.Timedelta(days=EVENT_WINDOW_DAYS)
+                frame = frame[frame['time'] >= cutoff].reset_index(drop=True)
+
+                self.frame = frame
+                if not frame.empty:
+                    self.watermark = frame['time'].max().to_pydatetime()
+                return frame
+
+
+    def event_keys(events):
+        """Index of the events' column values, for finding events that were already merged."""
+        return pd.MultiIndex.from_frame(events.astype(str))
+
+
+    def concat_events(newer, older):
+        """Concatenate two event frames, keeping categorical columns categorical."""
+        newer = newer.copy()
+        older = older.copy()
+        for col in older.select_dtypes('category').columns:
+            if col in newer.columns:
+                categories = pd.api.types.union_categoricals(
+                    [older[col], newer[col].astype('category')]
+                ).categories
+                older[col] = older[col].cat.set_categories(categories)
+                newer[col] = newer[col].astype('category').cat.set_categories(categories)
+        return pd.concat([newer, older], ignore_index=True)
+
+
+    @st.cache_resource
+    def get_event_windows():
+        """Event windows shared by all sessions of this process."""
+        return {
+            'recent_views': EventWindow(),
+            'recent_filters': EventWindow()
+        }
+
+
+    # In lazy mode recent views and filters are fetched per dealer when their profile is opened,
+    # instead of downloading every dealer's events with the datasets
+    LAZY_RECENT_ACTIVITY = True
+    DEALER_CACHE_SIZE = 500
+    DEALER_CACHE_TTL = 1800  # seconds
+    PREFETCH_ATTENTION_DEALERS = 20
+    # How long a profile waits for a prefetch of the same dealer before querying itself
+    PREFETCH_WAIT_SECONDS = 30
+
+    # Request lists per dealer, bounded by their in-memory size
+    DEALER_LOOKUP_CACHE_MB = 256
+    DEALER_LOOKUP_CACHE_TTL = 900  # seconds
+
+
+    def load_credentials():
+        """Service account credentials from Streamlit secrets or service_account.json, or None."""
+        from google.oauth2 import service_account
+
         try:
-            credentials = service_account.Credentials.from_service_account_info(
+            return service_account.Credentials.from_service_account_info(
                 st.secrets["service_account"]
             )
         except (KeyError, FileNotFoundError):
-            # If secret not found, try to use service_account.json
             try:
-                credentials = service_account.Credentials.from_service_account_file(
+                return service_account.Credentials.from_service_account_file(
                     'service_account.json'
                 )
             except FileNotFoundError:
-                st.error(
-                    "No credentials found. Please configure either Streamlit secrets or provide a service_account.json file.")
-                return pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
+                return None
+
+
+    # HTTP connections per host kept by the shared BigQuery client, sized for concurrent sessions
+    BIGQUERY_POOL_SIZE = 32
+
+
+    class CountingAuthRequest:
+        """Transport for the token requests of an authorized session, calling on_request before each one."""
+
+        def __init__(self, request, on_request):
+            self.request = request
+            self.on_request = on_request
+
+        def __call__(self, *args, **kwargs):
+            self.on_request()
+            return self.request(*args, **kwargs)
+
+
+    class BigQueryClientFactory:
+        """
+        One authenticated BigQuery client per process, reused by every session and background thread.
+        Counts client reuse and token refreshes.
+        """
+
+        def __init__(self):
+            self.lock = threading.Lock()
+            self.credentials = None
+            self.client = None
+            self.bqstorage_client = None
+            self.metrics = {'clients_created': 0, 'client_reuses': 0, 'token_refreshes': 0}
+
+        def get_client(self):
+            """Returns the shared client, or None if no credentials are configured."""
+            with self.lock:
+                if self.client is not None:
+                    self.metrics['client_reuses'] += 1
+                    return self.client
+
+                credentials = load_credentials()
+                if credentials is None:
+                    return None
+
+                from google.auth.transport.requests import AuthorizedSession, Request
+                from google.cloud import bigquery
+                from requests.adapters import HTTPAdapter
+
+                # One authorized session whose connection pool is shared by concurrent queries.
+                # Every token refresh of the session sends one request through auth_request.
+                auth_request = CountingAuthRequest(Request(), self.count_token_refresh)
+                session = AuthorizedSession(credentials, auth_request=auth_request)
+                adapter = HTTPAdapter(pool_connections=BIGQUERY_POOL_SIZE, pool_maxsize=BIGQUERY_POOL_SIZE)
+                session.mount("https://", adapter)
+
+                self.credentials = credentials
+                self.client = bigquery.Client(
+                    project=credentials.project_id, credentials=credentials, _http=session
+                )
+                self.metrics['clients_created'] += 1
+                return self.client
+
+        def get_bqstorage_client(self):
+            """Returns the shared Storage Read API client, or None if it is not installed."""
+            with self.lock:
+                if self.bqstorage_client is None and self.credentials:
+                    try:
+                        from google.cloud import bigquery_storage
+                    except ImportError:  # Storage Read API is optional, downloads fall back to the REST API
+                        return None
+                    self.bqstorage_client = bigquery_storage.BigQueryReadClient(credentials=self.credentials)
+                return self.bqstorage_client
+
+        def count_token_refresh(self):
+            self.metrics['token_refreshes'] += 1
+
+
+    @st.cache_resource
+    def get_bigquery_client_factory():
+        """BigQuery client factory shared by all sessions of this process."""
+        return BigQueryClientFactory()
+
+
+    def get_bigquery_client():
+        """The shared BigQuery client, or None if no credentials are configured."""
+        return get_bigquery_client_factory().get_client()
+
+
+    def frames_nbytes(value):
+        """In-memory size of a DataFrame or a tuple of DataFrames, in bytes."""
+        frames = value if isinstance(value, tuple) else (value,)
+        return sum(int(df.memory_usage(index=True, deep=True).sum()) for df in frames)
+
+
+    class DealerCache:
+        """
+        Bounded LRU cache with a TTL for per-dealer query results, shared by all sessions.
+        maxsize counts entries, or bytes when getsizeof is given.
+        """
+
+        def __init__(self, maxsize, ttl, getsizeof=None):
+            self.cache = TTLCache(maxsize=maxsize, ttl=ttl, getsizeof=getsizeof)
+            self.loading = set()
+            self.lock = threading.Lock()
+            self.loaded = threading.Condition(self.lock)
+            self.hits = 0
+            self.misses = 0
+
+        def get(self, key):
+            with self.lock:
+                value = self.cache.get(key)
+                if value is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                return value
+
+        def put(self, key, value):
+            with self.lock:
+                try:
+                    self.cache[key] = value
+                except ValueError:
+                    # Larger than the whole cache
+                    pass
+                self.loading.discard(key)
+                self.loaded.notify_all()
+
+        def claim(self, key):
+            """Mark a key as being loaded. Returns False if it is cached or already loading."""
+            with self.lock:
+                if key in self.cache or key in self.loading:
+                    return False
+                self.loading.add(key)
+                return True
+
+        def release(self, key):
+            with self.lock:
+                self.loading.discard(key)
+                self.loaded.notify_all()
+
+        def wait(self, key, timeout):
+            """Wait for the thread loading a key. Returns its value, or None if the load failed or timed out."""
+            with self.lock:
+                self.loaded.wait_for(lambda: key not in self.loading, timeout)
+                return self.cache.get(key)
+
+
+    @st.cache_resource
+    def get_dealer_activity_cache():
+        """Recent views and filters per dealer_code, shared by all sessions of this process."""
+        return DealerCache(DEALER_CACHE_SIZE, DEALER_CACHE_TTL)
+
+
+    @st.cache_resource
+    def get_dealer_lookup_cache():
+        """Request lists per dealer and data version, shared by all sessions of this process."""
+        return DealerCache(DEALER_LOOKUP_CACHE_MB * 1024 ** 2, DEALER_LOOKUP_CACHE_TTL, getsizeof=frames_nbytes)
+
+
+    def cached_dealer_lookup(kind, dealer_code, version, fetch, cache=None):
+        """
+        Get a per-dealer lookup from the shared cache, calling fetch only on a miss.
+        Args:
+            kind: Name of the lookup, part of the cache key
+            dealer_code: The dealer's code
+            version: Data version the lookup belongs to
+            fetch: Returns a DataFrame or a tuple of DataFrames; results are not cached if it raises
+            cache: DealerCache to use, the shared lookup cache by default
+        Returns:
+            Copies of the cached frames that the caller may modify
+        """
+        if cache is None:
+            cache = get_dealer_lookup_cache()
+        key = (kind, dealer_code, version)
+        result = cache.get(key)
+        if result is None:
+            result = fetch()
+            cache.put(key, result)
+
+        if isinstance(result, tuple):
+            return tuple(df.copy() for df in result)
+        return result.copy()
+
+
+    @st.cache_resource
+    def get_prefetch_executor():
+        """Worker pool for background prefetching, shared by all sessions of this process."""
+        return ThreadPoolExecutor(max_workers=4, thread_name_prefix="prefetch")
+
+
+    def fetch_dealer_activity(client, dealer_code):
+        """
+        Get a dealer's recent car views and filters from the last 30 days.
+        Returns two dataframes: recent views and recent filters, newest first.
+        Raises:
+            RuntimeError: If either query fails
+        """
+        views_query = """
+        SELECT 
+            time,
+            make,
+            model,
+            trim,
+            year,
+            kilometrage,
+            transmission,
+            listing_title,
+            buy_now_price,
+            body_style,
+            entity_code as dealer_code
+        FROM `pricing-338819.silver_ajans_mixpanel.screen_car_profile_event`
+        WHERE DATE(time) >= DATE_SUB(CURRENT_DATE(), INTERVAL 30 DAY)
+        AND entity_code = @dealer_code
+        ORDER BY time DESC
+        """
+
+        filters_query = """
+        SELECT 
+            time,
+            make,
+            model,
+            year,
+            kilometrage,
+            group_filter,
+            status,
+            no_of_cars,
+            entity_code as dealer_code
+        FROM `pricing-338819.silver_ajans_mixpanel.action_filter`
+        WHERE DATE(time) >= DATE_SUB(CURRENT_DATE(), INTERVAL 30 DAY)
+        AND entity_code = @dealer_code
+        ORDER BY time DESC
+        """
+
+        from google.cloud import bigquery
+
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ScalarQueryParameter("dealer_code", "STRING", dealer_code)
+            ]
+        )
+
+        results, _ = run_queries_concurrently(
+            client,
+            {'recent_views': views_query, 'recent_filters': filters_query},
+            job_configs={'recent_views': job_config, 'recent_filters': job_config},
+            download=lambda name, job: arrow_to_dataframe(job.to_arrow(), RESULT_DTYPES[name]),
+            dealer_code=dealer_code
+        )
+        return results['recent_views'], results['recent_filters']
+
+
+    def get_dealer_activity(dealer_code):
+        """
+        Get a dealer's recent views and filters, from the cache when possible.
+        Returns two dataframes that the caller may modify.
+        """
+        cache = get_dealer_activity_cache()
+        activity = cache.get(dealer_code)
+
+        # A prefetch of this dealer is running the same queries; use its result
+        if activity is None and not cache.claim(dealer_code):
+            activity = cache.wait(dealer_code, PREFETCH_WAIT_SECONDS)
+            if activity is None:
+                cache.claim(dealer_code)
+
+        if activity is None:
+            client = get_bigquery_client()
+            if client is None:
+                cache.release(dealer_code)
+                st.error("No credentials found for BigQuery access")
+                return pd.DataFrame(), pd.DataFrame()
+
+            try:
+                activity = fetch_dealer_activity(client, dealer_code)
+            except RuntimeError as e:
+                print(f"Error executing query: {e}")
+                return pd.DataFrame(), pd.DataFrame()
+            finally:
+                if activity is None:
+                    cache.release(dealer_code)
+            cache.put(dealer_code, activity)
+
+        views, filters = activity
+        return views.copy(), filters.copy()
+
+
+    def prefetch_dealer_activity(dealer_codes):
+        """Load the recent views and filters of the given dealers into the cache in the background."""
+        cache = get_dealer_activity_cache()
+        dealer_codes = [code for code in dealer_codes if cache.claim(code)]
+        if not dealer_codes:
+            return
+
+        client = get_bigquery_client()
+        if client is None:
+            for code in dealer_codes:
+                cache.release(code)
+            return
+
+        def prefetch(code):
+            try:
+                cache.put(code, fetch_dealer_activity(client, code))
+            except Exception as e:
+                print(f"Error prefetching activity for {code}: {e}")
+                cache.release(code)
+
+        executor = get_prefetch_executor()
+        for code in dealer_codes:
+            executor.submit(prefetch, code)
+
+
+    # Windows and thresholds of the dealer segmentation, in days. Interval buckets are upper
+    # bounds; "(New)" and "(At Risk)" split a bucket at its midpoint.
+    SEGMENT_CONFIG = {
+        'short_window_days': 30,
+        'recent_window_days': 60,
+        'previous_window_days': 120,
+        'purchase_interval_buckets': [15, 30, 60],
+        'frequent_purchase_days': 30,
+        'active_purchase_days': 60,
+        'request_interval_buckets': [5, 10, 21],
+        'frequent_request_days': 10,
+        'active_request_days': 21
+    }
+
+    SEGMENT_COLUMNS = [
+        'user_vs_dealer_flag', 'purchase_segment_lifetime', 'purchase_segment_60d',
+        'purchase_segment_previous_60d', 'final_bucket_lifetime', 'final_bucket_60d',
+        'final_bucket_previous_60d', 'current_segmentation', 'request_segment_lifetime',
+        'request_segment_60d', 'request_activity_bucket_lifetime', 'request_activity_bucket_60d'
+    ]
+
+
+    # Labels of the two halves of current_segmentation, "<previous 60 days> - <last 60 days>"
+    PREVIOUS_PURCHASE_LABELS = ['No Purchase', 'Frequent', 'Active', 'Inactive']
+    RECENT_PURCHASE_LABELS = ['No Purchase', '1 Time Purchaser', 'Frequent (New)', 'Frequent', 'Frequent (At Risk)',
+                              'Active (New)', 'Active', 'Active (At Risk)', 'Inactive']
+
+
+    def round_half_away(values, decimals=2):
+        """Round like BigQuery's ROUND(), halves away from zero."""
+        factor = 10 ** decimals
+        return np.sign(values) * np.floor(np.abs(values) * factor + 0.5) / factor
+
+
+    def window_stats(codes, days, months, counts, mask, n_dealers):
+        """
+        Per-dealer statistics of the daily event counts selected by mask.
+        Returns:
+            Dict of arrays indexed by dealer: distinct dates, events, distinct months,
+            first and last event day, and average days between events
+        """
+        codes, days, months, counts = codes[mask], days[mask], months[mask], counts[mask]
+
+        dates = np.bincount(codes, minlength=n_dealers)
+        events = np.bincount(codes, weights=counts, minlength=n_dealers)
+        dealer_months = np.unique(np.stack([codes, months]), axis=1)[0]
+        active_months = np.bincount(dealer_months, minlength=n_dealers)
+
+        first = np.full(n_dealers, np.nan)
+        last = np.full(n_dealers, np.nan)
+        np.fmin.at(first, codes, days)
+        np.fmax.at(last, codes, days)
+
+        # Consecutive gaps between sorted events add up to last - first
+        with np.errstate(invalid='ignore', divide='ignore'):
+            avg_interval = np.where(events >= 2, (last - first) / (events - 1), np.nan)
+            per_month = round_half_away(np.where(active_months > 0, dates / active_months, np.nan))
+
+        return {
+            'dates': dates,
+            'events': events,
+            'per_month': per_month,
+            'first': first,
+            'last': last,
+            'avg_interval': avg_interval
+        }
+
+
+    def interval_segment(total, avg, buckets, none_label, one_label, split=False):
+        """Bucket dealers by their average days between events, like the CASE expressions."""
+        conditions = [total == 0, total == 1]
+        labels = [none_label, one_label]
+        low = 0
+        for high in buckets:
+            if split:
+                conditions += [avg <= (low + high) / 2, avg <= high]
+                labels += [f"{low:g}-{high:g} days (New)", f"{low:g}-{high:g} days (At Risk)"]
+            else:
+                conditions.append(avg <= high)
+                labels.append(f"{low:g}-{high:g} days")
+            low = high
+        return np.select(conditions, labels, default=f"{buckets[-1]:g}+ days")
+
+
+    def activity_bucket(total, avg, frequent, active, none_label, one_label, split=False):
+        """Bucket dealers as Frequent, Active or Inactive by their average days between events."""
+        conditions = [total == 0, total == 1]
+        labels = [none_label, one_label]
+        if split:
+            conditions += [avg <= frequent / 2, avg <= frequent, avg <= (frequent + active) / 2, avg <= active]
+            labels += ['Frequent (New)', 'Frequent (At Risk)', 'Active (New)', 'Active (At Risk)']
+        else:
+            conditions += [avg <= frequent, avg <= active]
+            labels += ['Frequent', 'Active']
+        return np.select(conditions, labels, default='Inactive')
+
+
+    def compute_segmentation(dealer_events, as_of=None, config=None):
+        """
+        Compute the dealer segmentation from daily purchase and request counts.
+        Args:
+            dealer_events: DataFrame with dealer_code, dealer_name, event_type ('purchase' or 'request'),
+                event_date and n_events, as returned by dealer_events_query
+            as_of: Date to segment at, defaults to today (UTC). Later events are ignored.
+            config: Windows and thresholds, defaults to SEGMENT_CONFIG
+        Returns:
+            DataFrame with one row per dealer and the same columns as the former dealer_seg_query
+        """
+        config = {**SEGMENT_CONFIG, **(config or {})}
+        as_of = pd.Timestamp(as_of) if as_of is not None else pd.Timestamp.now(tz='UTC').tz_localize(None)
+        as_of_day = np.datetime64(as_of.date(), 'D').astype(np.int64)
+        short_start = as_of_day - config['short_window_days']
+        recent_start = as_of_day - config['recent_window_days']
+        previous_start = as_of_day - config['previous_window_days']
+
+        dealers = dealer_events[['dealer_code', 'dealer_name']].drop_duplicates().reset_index(drop=True)
+        dealer_codes = pd.Index(dealers['dealer_code'].dropna().unique())
+        # The extra last slot collects dealers without a code, who never have events
+        n_dealers = len(dealer_codes) + 1
+        row_codes = dealer_codes.get_indexer(dealers['dealer_code'])
+        row_codes[row_codes < 0] = n_dealers - 1
+
+        events = dealer_events[dealer_events['event_type'].notna() & dealer_events['event_date'].notna()]
+        events = events.drop_duplicates(['dealer_code', 'event_type', 'event_date'])
+        event_dates = events['event_date'].to_numpy(dtype='datetime64[D]')
+        days = event_dates.astype(np.int64)
+        months = event_dates.astype('datetime64[M]').astype(np.int64)
+        codes = dealer_codes.get_indexer(events['dealer_code'])
+        counts = events['n_events'].to_numpy(dtype=float, na_value=0)
+
+        in_range = (codes >= 0) & (days <= as_of_day)
+        is_purchase = in_range & (events['event_type'] == 'purchase').to_numpy()
+        is_request = in_range & (events['event_type'] == 'request').to_numpy()
+
+        def stats(mask):
+            return window_stats(codes, days, months, counts, mask, n_dealers)
+
+        purchases = stats(is_purchase)
+        purchases_60d = stats(is_purchase & (days >= recent_start))
+        purchases_previous_60d = stats(is_purchase & (days >= previous_start) & (days <= recent_start))
+        purchases_30d = stats(is_purchase & (days >= short_start))
+        requests = stats(is_request)
+        requests_60d = stats(is_request & (days >= recent_start))
+        requests_30d = stats(is_request & (days >= short_start))
+
+        def per_dealer(values):
+            return values[row_codes]
+
+        total_purchases = per_dealer(purchases['dates'])
+        total_purchases_60d = per_dealer(purchases_60d['dates'])
+        total_purchases_previous_60d = per_dealer(purchases_previous_60d['dates'])
+        total_requests = per_dealer(requests['dates'])
+        total_requests_60d = per_dealer(requests_60d['dates'])
+        avg_purchases = per_dealer(purchases['avg_interval'])
+        avg_purchases_60d = per_dealer(purchases_60d['avg_interval'])
+        avg_purchases_previous_60d = per_dealer(purchases_previous_60d['avg_interval'])
+        avg_requests = per_dealer(requests['avg_interval'])
+        avg_requests_60d = per_dealer(requests_60d['avg_interval'])
+        last_purchase = per_dealer(purchases['last'])
+        last_purchase_previous_60d = per_dealer(purchases_previous_60d['last'])
+        days_since_last_purchase = as_of_day - last_purchase
+
+        def to_date(day_numbers):
+            return pd.to_datetime(day_numbers, unit='D')
+
+        def nullable_count(values):
+            # COUNT(*) joined with LEFT JOIN is NULL rather than 0 for dealers without events
+            return pd.array(np.where(values > 0, values, np.nan)).astype('Int64')
+
+        frequent = config['frequent_purchase_days']
+        active = config['active_purchase_days']
+        previous_part = np.select(
+            [total_purchases_previous_60d == 0, avg_purchases_previous_60d <= frequent,
+             avg_purchases_previous_60d <= active],
+            PREVIOUS_PURCHASE_LABELS[:-1],
+            default=PREVIOUS_PURCHASE_LABELS[-1]
+        )
+
+        def previous_is_slower(limit):
+            return (avg_purchases_previous_60d > limit) | np.isnan(avg_purchases_previous_60d)
+
+        recent_part = np.select(
+            [
+                total_purchases_60d == 0,
+                total_purchases_60d == 1,
+                (avg_purchases_60d <= frequent) & (days_since_last_purchase <= frequent / 2) & previous_is_slower(frequent),
+                (avg_purchases_60d <= frequent) & (days_since_last_purchase <= frequent / 2),
+                avg_purchases_60d <= frequent,
+                (avg_purchases_60d <= active) & (days_since_last_purchase <= active / 2) & previous_is_slower(active),
+                (avg_purchases_60d <= active) & (days_since_last_purchase <= active / 2),
+                avg_purchases_60d <= active
+            ],
+            RECENT_PURCHASE_LABELS[:-1],
+            default=RECENT_PURCHASE_LABELS[-1]
+        )
+        current_segmentation = np.select(
+            [
+                (total_purchases_previous_60d == 0) & (total_purchases_60d == 0),
+                (total_purchases_previous_60d == 1) & (total_purchases_60d == 0)
+            ],
+            ['No Purchase', '1 Time Purchaser - No Purchase'],
+            default=np.char.add(np.char.add(previous_part.astype(str), ' - '), recent_part.astype(str))
+        )
+
+        buckets = config['purchase_interval_buckets']
+        request_buckets = config['request_interval_buckets']
+        seg = pd.DataFrame({
+            'dealer_code': dealers['dealer_code'],
+            'dealer_name': dealers['dealer_name'],
+            'user_vs_dealer_flag': np.where(total_purchases > 0, 'Dealer', 'User'),
+            'lifetime_avg_days_between_purchases': avg_purchases,
+            'sixty_day_avg_days_between_purchases': avg_purchases_60d,
+            'previous_sixty_day_avg_days_between_purchases': avg_purchases_previous_60d,
+            'lifetime_avg_days_between_requests': avg_requests,
+            'sixty_day_avg_days_between_requests': avg_requests_60d,
+            'last_purchase_date': to_date(last_purchase),
+            'days_since_last_purchase': pd.array(days_since_last_purchase).astype('Int64'),
+            'last_purchase_date_previous_60d': to_date(last_purchase_previous_60d),
+            'days_since_last_purchase_previous_60d': pd.array(
+                recent_start - last_purchase_previous_60d).astype('Int64'),
+            'total_purchases_lifetime': total_purchases,
+            'total_purchases_60d': total_purchases_60d,
+            'total_purchases_previous_60d': total_purchases_previous_60d,
+            'total_requests_lifetime': total_requests,
+            'total_requests_60d': total_requests_60d,
+            'avg_purchases_per_month_lifetime': per_dealer(purchases['per_month']),
+            'avg_purchases_per_month_60d': per_dealer(purchases_60d['per_month']),
+            'avg_purchases_per_month_previous_60d': per_dealer(purchases_previous_60d['per_month']),
+            'avg_requests_per_month_lifetime': per_dealer(requests['per_month']),
+            'avg_requests_per_month_60d': per_dealer(requests_60d['per_month']),
+            'sold_cars_30d': nullable_count(per_dealer(purchases_30d['events'])),
+            'buy_requests_30d': nullable_count(per_dealer(requests_30d['events'])),
+            'purchase_segment_lifetime': interval_segment(
+                total_purchases, avg_purchases, buckets, 'No Purchase', '1 Time Purchaser'),
+            'purchase_segment_60d': interval_segment(
+                total_purchases_60d, avg_purchases_60d, buckets, 'No Purchase', '1 Time Purchaser', split=True),
+            'purchase_segment_previous_60d': interval_segment(
+                total_purchases_previous_60d, avg_purchases_previous_60d, buckets, 'No Purchase', '1 Time Purchaser'),
+            'final_bucket_lifetime': activity_bucket(
+                total_purchases, avg_purchases, frequent, active, 'No Purchase', '1 Time Purchaser'),
+            'final_bucket_60d': activity_bucket(
+                total_purchases_60d, avg_purchases_60d, frequent, active, 'No Purchase', '1 Time Purchaser',
+                split=True),
+            'final_bucket_previous_60d': activity_bucket(
+                total_purchases_previous_60d, avg_purchases_previous_60d, frequent, active,
+                'No Purchase', '1 Time Purchaser'),
+            'current_segmentation': current_segmentation,
+            'request_segment_lifetime': interval_segment(
+                total_requests, avg_requests, request_buckets, 'No Requests', '1 Request'),
+            'request_segment_60d': interval_segment(
+                total_requests_60d, avg_requests_60d, request_buckets, 'No Requests', '1 Request'),
+            'request_activity_bucket_lifetime': activity_bucket(
+                total_requests, avg_requests, config['frequent_request_days'], config['active_request_days'],
+                'No Requests', '1 Request'),
+            'request_activity_bucket_60d': activity_bucket(
+                total_requests_60d, avg_requests_60d, config['frequent_request_days'],
+                config['active_request_days'], 'No Requests', '1 Request')
+        })
+
+        for col in SEGMENT_COLUMNS:
+            seg[col] = seg[col].astype('category')
+
+        return seg.sort_values('total_requests_lifetime', ascending=False, kind='stable').reset_index(drop=True)
+
+
+    # Parquet snapshots of the load_data() results, used for warm restarts and offline mode
+    SNAPSHOT_DIR = os.environ.get("SET_SNAPSHOT_DIR", "snapshots")
+    SNAPSHOT_MAX_AGE = timedelta(hours=12)
+    SNAPSHOTS_KEPT = 3
+
+
+    def hash_queries(queries):
+        """Hash the SQL of all queries so snapshots from older queries are not reused."""
+        digest = hashlib.sha256()
+        for name in sorted(queries):
+            digest.update(name.encode())
+            digest.update(queries[name].encode())
+        return digest.hexdigest()
+
+
+    def write_snapshot(frames, query_hash, created_at):
+        """
+        Write the DataFrames as a new snapshot version and remove the oldest versions.
+        Args:
+            frames: Dict mapping a query name to its DataFrame
+            query_hash: Hash of the queries that produced the frames
+            created_at: Time the queries started, which load_data() also returns for these frames
+        """
+        version = created_at.strftime('%Y%m%dT%H%M%S%fZ')
+        tmp_path = os.path.join(SNAPSHOT_DIR, f".{version}.tmp")
+
+        try:
+            os.makedirs(tmp_path)
+            for name, df in frames.items():
+                df.to_parquet(os.path.join(tmp_path, f"{name}.parquet"), index=False)
+
+            metadata = {
+                'version': version,
+                'created_at': created_at.isoformat(),
+                'query_hash': query_hash,
+                'row_counts': {name: len(df) for name, df in frames.items()}
+            }
+            with open(os.path.join(tmp_path, 'metadata.json'), 'w') as f:
+                json.dump(metadata, f, indent=2)
+
+            # Publish the snapshot in one step so readers never see a partial version
+            os.rename(tmp_path, os.path.join(SNAPSHOT_DIR, version))
+        except (OSError, pa.ArrowException) as e:
+            print(f"Error writing snapshot: {e}")
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return
+
+        versions = sorted(v for v in os.listdir(SNAPSHOT_DIR) if not v.startswith('.'))
+        for old_version in versions[:-SNAPSHOTS_KEPT]:
+            shutil.rmtree(os.path.join(SNAPSHOT_DIR, old_version), ignore_errors=True)
+
+
+    def find_snapshot(query_hash, max_age=None):
+        """
+        Find the latest snapshot written by the same queries.
+        Args:
+            query_hash: Hash of the current queries
+            max_age: Optional timedelta, older snapshots are ignored
+        Returns:
+            Snapshot metadata dict with its 'path', or None if there is no usable snapshot
+        """
+        if not os.path.isdir(SNAPSHOT_DIR):
+            return None
+
+        for version in sorted(os.listdir(SNAPSHOT_DIR), reverse=True):
+            if version.startswith('.'):
+                continue
+            path = os.path.join(SNAPSHOT_DIR, version)
+            try:
+                with open(os.path.join(path, 'metadata.json')) as f:
+                    metadata = json.load(f)
+            except (OSError, ValueError):
+                continue
+
+            if metadata['query_hash'] != query_hash:
+                continue
+            age = datetime.now(timezone.utc) - datetime.fromisoformat(metadata['created_at'])
+            if max_age is not None and age > max_age:
+                return None
+            return {**metadata, 'path': path}
+
+        return None
+
+
+    def read_snapshot(snapshot):
+        """Read the DataFrames of a snapshot and seed the event windows with them."""
+        frames = {
+            name: pq.read_table(os.path.join(snapshot['path'], f"{name}.parquet")).to_pandas(
+                date_as_object=False, types_mapper=ARROW_TYPES_MAPPER
+            )
+            for name in snapshot['row_counts']
+        }
+        event_windows = get_event_windows()
+        for name, window in event_windows.items():
+            if name in frames:
+                window.seed(frames[name])
+        return frames
+
+
+    def snapshot_frames(frames):
+        """Segment the dealers and order the loaded DataFrames the way load_data() returns them."""
+        with span("segmentation"):
+            dealer_seg_df = compute_segmentation(frames['dealer_events'])
+        return (frames['historical'], frames['live_cars'], dealer_seg_df, frames['dealer_activity'],
+                frames['recent_views'], frames['recent_filters'], frames['olx_listings'])
+
 
-        # Create a BigQuery client using the credentials
-        client = bigquery.Client(credentials=credentials)
+    def report_load_problem(message, show=st.error):
+        """
+        Print a data loading problem, and show it in the page when a session is loading the data.
+        The background refresh has no page to show it in and reports failures through DatasetStore.status.
+        """
+        print(message)
+        if current_session_id() is not None:
+            show(message)
 
+
+    # Function to load data from BigQuery
+    def load_data(snapshot_max_age=SNAPSHOT_MAX_AGE):
+        """
+        Load the datasets from a fresh snapshot or from BigQuery.
+        Args:
+            snapshot_max_age: Snapshots younger than this are used instead of querying BigQuery
+        Returns:
+            Tuple of (datasets, created_at): the seven DataFrames and the time they were queried,
+            or empty DataFrames and None if loading failed
+        """
         # Live cars query
         live_cars_query = """
         WITH sold AS ( 
@@ -126,393 +1296,40 @@ if check_password():
         LEFT JOIN p ON s.vehicle_id = p.vehicle_id
         """
 
-        # Dealer segmentation query
-        dealer_seg_query = """
-       WITH dealer_purchases_60d AS (
-SELECT 
-    dealer_code,
-    dealer_name,
-    DATE(wholesale_vehicle_sold_date) as purchase_date
-FROM ajans_dealers.dealer_requests
-WHERE request_type = 'Buy Now' 
-AND DATE(wholesale_vehicle_sold_date) >= DATE_SUB(CURRENT_DATE(), INTERVAL 60 DAY)
-),
-
-dealer_purchases_previous_60d AS (
-    SELECT 
-        dealer_code,
-        dealer_name,
-        DATE(wholesale_vehicle_sold_date) as purchase_date
-    FROM ajans_dealers.dealer_requests
-    WHERE request_type = 'Buy Now' 
-    AND DATE(wholesale_vehicle_sold_date) BETWEEN DATE_SUB(CURRENT_DATE(), INTERVAL 120 DAY) AND DATE_SUB(CURRENT_DATE(), INTERVAL 60 DAY)
-),
-
-dealer_purchases_lifetime AS (
-    SELECT 
-        dealer_code,
-        dealer_name,
-        DATE(wholesale_vehicle_sold_date) as purchase_date
-    FROM ajans_dealers.dealer_requests
-    WHERE request_type = 'Buy Now' and wholesale_vehicle_sold_date is not null
-),
-
-dealer_requests_60d AS (
-    SELECT 
-        dealer_code,
-        dealer_name,
-        DATE(received_at) as request_date
-    FROM ajans_dealers.dealer_requests
-    WHERE request_type = 'Buy Now'
-    AND DATE(received_at) >= DATE_SUB(CURRENT_DATE(), INTERVAL 60 DAY)
-),
-
-dealer_requests_lifetime AS (
-    SELECT 
-        dealer_code,
-        dealer_name,
-        DATE(received_at) as request_date
-    FROM ajans_dealers.dealer_requests
-    WHERE request_type = 'Buy Now'
-),
-
-purchase_intervals_lifetime AS (
-    SELECT 
-        dealer_code,
-        purchase_date,
-        DATE_DIFF(purchase_date, 
-            LAG(purchase_date) OVER (PARTITION BY dealer_code ORDER BY purchase_date),
-            DAY) as days_between_purchases
-    FROM dealer_purchases_lifetime
-),
-
-purchase_intervals_60d AS (
-    SELECT 
-        dealer_code,
-        purchase_date,
-        DATE_DIFF(purchase_date, 
-            LAG(purchase_date) OVER (PARTITION BY dealer_code ORDER BY purchase_date),
-            DAY) as days_between_purchases
-    FROM dealer_purchases_60d
-),
-
-purchase_intervals_previous_60d AS (
-    SELECT 
-        dealer_code,
-        purchase_date,
-        DATE_DIFF(purchase_date, 
-            LAG(purchase_date) OVER (PARTITION BY dealer_code ORDER BY purchase_date),
-            DAY) as days_between_purchases
-    FROM dealer_purchases_previous_60d
-),
-
-request_intervals_lifetime AS (
-    SELECT 
-        dealer_code,
-        request_date,
-        DATE_DIFF(request_date, 
-            LAG(request_date) OVER (PARTITION BY dealer_code ORDER BY request_date),
-            DAY) as days_between_requests
-    FROM dealer_requests_lifetime
-),
-
-request_intervals_60d AS (
-    SELECT 
-        dealer_code,
-        request_date,
-        DATE_DIFF(request_date, 
-            LAG(request_date) OVER (PARTITION BY dealer_code ORDER BY request_date),
-            DAY) as days_between_requests
-    FROM dealer_requests_60d
-),
-
-avg_intervals AS (
-    SELECT 
-        dealer_code,
-        AVG(days_between_purchases) as lifetime_avg_days_between_purchases
-    FROM purchase_intervals_lifetime
-    WHERE days_between_purchases IS NOT NULL
-    GROUP BY dealer_code
-),
-
-avg_intervals_60d AS (
-    SELECT 
-        dealer_code,
-        AVG(days_between_purchases) as sixty_day_avg_days_between_purchases
-    FROM purchase_intervals_60d
-    WHERE days_between_purchases IS NOT NULL
-    GROUP BY dealer_code
-),
-
-avg_intervals_previous_60d AS (
-    SELECT 
-        dealer_code,
-        AVG(days_between_purchases) as previous_sixty_day_avg_days_between_purchases
-    FROM purchase_intervals_previous_60d
-    WHERE days_between_purchases IS NOT NULL
-    GROUP BY dealer_code
-),
-
-avg_request_intervals AS (
-    SELECT 
-        dealer_code,
-        AVG(days_between_requests) as lifetime_avg_days_between_requests
-    FROM request_intervals_lifetime
-    WHERE days_between_requests IS NOT NULL
-    GROUP BY dealer_code
-),
-
-avg_request_intervals_60d AS (
-    SELECT 
-        dealer_code,
-        AVG(days_between_requests) as sixty_day_avg_days_between_requests
-    FROM request_intervals_60d
-    WHERE days_between_requests IS NOT NULL
-    GROUP BY dealer_code
-),
-
-dealer_requests_30d AS (
-    SELECT 
-        dealer_code,
-        COUNT(*) as buy_requests_30d
-    FROM ajans_dealers.dealer_requests
-    WHERE request_type = 'Buy Now'
-    AND DATE(received_at) >= DATE_SUB(CURRENT_DATE(), INTERVAL 30 DAY)
-    GROUP BY dealer_code
-),
-
-sold_cars_30d AS (
-    SELECT 
-        dealer_code,
-        COUNT(*) as sold_cars_30d
-    FROM ajans_dealers.dealer_requests
-    WHERE request_type = 'Buy Now'
-    AND DATE(wholesale_vehicle_sold_date) >= DATE_SUB(CURRENT_DATE(), INTERVAL 30 DAY)
-    GROUP BY dealer_code
-),
-
-last_purchase_dates AS (
-    SELECT 
-        dealer_code,
-        MAX(DATE(wholesale_vehicle_sold_date)) as last_purchase_date,
-        DATE_DIFF(CURRENT_DATE(), MAX(DATE(wholesale_vehicle_sold_date)), DAY) as days_since_last_purchase
-    FROM ajans_dealers.dealer_requests
-    WHERE request_type = 'Buy Now' 
-    AND wholesale_vehicle_sold_date IS NOT NULL
-    GROUP BY dealer_code
-),
-
-last_purchase_dates_previous_60d AS (
-    SELECT 
-        dealer_code,
-        MAX(DATE(wholesale_vehicle_sold_date)) as last_purchase_date_previous_60d,
-        DATE_DIFF(DATE_SUB(CURRENT_DATE(), INTERVAL 60 DAY), 
-                 MAX(DATE(wholesale_vehicle_sold_date)), DAY) as days_since_last_purchase_previous_60d
-    FROM ajans_dealers.dealer_requests
-    WHERE request_type = 'Buy Now' 
-    AND DATE(wholesale_vehicle_sold_date) BETWEEN DATE_SUB(CURRENT_DATE(), INTERVAL 120 DAY) AND DATE_SUB(CURRENT_DATE(), INTERVAL 60 DAY)
-    GROUP BY dealer_code
-),
-
-metrics AS (
-    SELECT 
-        d.dealer_code,
-        d.dealer_name,
-        CASE 
-            WHEN COUNT(DISTINCT pl.purchase_date) > 0 THEN 'Dealer'
-            ELSE 'User'
-        END as user_vs_dealer_flag,
-        ai.lifetime_avg_days_between_purchases,
-        ai60.sixty_day_avg_days_between_purchases,
-        aip60.previous_sixty_day_avg_days_between_purchases,
-        ari.lifetime_avg_days_between_requests,
-        ari60.sixty_day_avg_days_between_requests,
-        lpd.last_purchase_date,
-        lpd.days_since_last_purchase,
-        lpdp.last_purchase_date_previous_60d,
-        lpdp.days_since_last_purchase_previous_60d,
-        COUNT(DISTINCT pl.purchase_date) as total_purchases_lifetime,
-        COUNT(DISTINCT p60.purchase_date) as total_purchases_60d,
-        COUNT(DISTINCT pp60.purchase_date) as total_purchases_previous_60d,
-        COUNT(DISTINCT rl.request_date) as total_requests_lifetime,
-        COUNT(DISTINCT r60.request_date) as total_requests_60d,
-        ROUND(COUNT(DISTINCT pl.purchase_date) / NULLIF(COUNT(DISTINCT DATE_TRUNC(pl.purchase_date, MONTH)), 0), 2) as avg_purchases_per_month_lifetime,
-        ROUND(COUNT(DISTINCT p60.purchase_date) / NULLIF(COUNT(DISTINCT DATE_TRUNC(p60.purchase_date, MONTH)), 0), 2) as avg_purchases_per_month_60d,
-        ROUND(COUNT(DISTINCT pp60.purchase_date) / NULLIF(COUNT(DISTINCT DATE_TRUNC(pp60.purchase_date, MONTH)), 0), 2) as avg_purchases_per_month_previous_60d,
-        ROUND(COUNT(DISTINCT rl.request_date) / NULLIF(COUNT(DISTINCT DATE_TRUNC(rl.request_date, MONTH)), 0), 2) as avg_requests_per_month_lifetime,
-        ROUND(COUNT(DISTINCT r60.request_date) / NULLIF(COUNT(DISTINCT DATE_TRUNC(r60.request_date, MONTH)), 0), 2) as avg_requests_per_month_60d,
-        sc.sold_cars_30d,
-        dr30.buy_requests_30d
-    FROM ajans_dealers.dealers d
-    LEFT JOIN dealer_purchases_lifetime pl ON d.dealer_code = pl.dealer_code
-    LEFT JOIN dealer_purchases_60d p60 ON d.dealer_code = p60.dealer_code
-    LEFT JOIN dealer_purchases_previous_60d pp60 ON d.dealer_code = pp60.dealer_code
-    LEFT JOIN dealer_requests_lifetime rl ON d.dealer_code = rl.dealer_code
-    LEFT JOIN dealer_requests_60d r60 ON d.dealer_code = r60.dealer_code
-    LEFT JOIN avg_intervals ai ON d.dealer_code = ai.dealer_code
-    LEFT JOIN avg_intervals_60d ai60 ON d.dealer_code = ai60.dealer_code
-    LEFT JOIN avg_intervals_previous_60d aip60 ON d.dealer_code = aip60.dealer_code
-    LEFT JOIN avg_request_intervals ari ON d.dealer_code = ari.dealer_code
-    LEFT JOIN avg_request_intervals_60d ari60 ON d.dealer_code = ari60.dealer_code
-    LEFT JOIN sold_cars_30d sc ON d.dealer_code = sc.dealer_code
-    LEFT JOIN dealer_requests_30d dr30 ON d.dealer_code = dr30.dealer_code
-    LEFT JOIN last_purchase_dates lpd ON d.dealer_code = lpd.dealer_code
-    LEFT JOIN last_purchase_dates_previous_60d lpdp ON d.dealer_code = lpdp.dealer_code
-    GROUP BY 
-        d.dealer_code,
-        d.dealer_name,
-        ai.lifetime_avg_days_between_purchases,
-        ai60.sixty_day_avg_days_between_purchases,
-        aip60.previous_sixty_day_avg_days_between_purchases,
-        ari.lifetime_avg_days_between_requests,
-        ari60.sixty_day_avg_days_between_requests,
-        lpd.last_purchase_date,
-        lpd.days_since_last_purchase,
-        lpdp.last_purchase_date_previous_60d,
-        lpdp.days_since_last_purchase_previous_60d,
-        sc.sold_cars_30d,
-        dr30.buy_requests_30d
-)
+        # Daily Buy Now purchase and request counts per dealer, segmented locally by compute_segmentation()
+        dealer_events_query = """
+        WITH events AS (
+            SELECT 
+                dealer_code,
+                'purchase' as event_type,
+                DATE(wholesale_vehicle_sold_date) as event_date,
+                COUNT(*) as n_events
+            FROM ajans_dealers.dealer_requests
+            WHERE request_type = 'Buy Now' 
+            AND wholesale_vehicle_sold_date IS NOT NULL
+            GROUP BY dealer_code, event_date
 
-SELECT 
-    *,
-    CASE 
-        WHEN total_purchases_lifetime = 0 THEN 'No Purchase'
-        WHEN total_purchases_lifetime = 1 THEN '1 Time Purchaser'
-        WHEN lifetime_avg_days_between_purchases <= 15 THEN '0-15 days'
-        WHEN lifetime_avg_days_between_purchases <= 30 THEN '15-30 days'
-        WHEN lifetime_avg_days_between_purchases <= 60 THEN '30-60 days'
-        ELSE '60+ days'
-    END as purchase_segment_lifetime,
-    CASE 
-        WHEN total_purchases_60d = 0 THEN 'No Purchase'
-        WHEN total_purchases_60d = 1 THEN '1 Time Purchaser'
-        WHEN sixty_day_avg_days_between_purchases <= 15 THEN 
-            CASE
-                WHEN sixty_day_avg_days_between_purchases <= 7.5 THEN '0-15 days (New)'
-                ELSE '0-15 days (At Risk)'
-            END
-        WHEN sixty_day_avg_days_between_purchases <= 30 THEN 
-            CASE
-                WHEN sixty_day_avg_days_between_purchases <= 22.5 THEN '15-30 days (New)'
-                ELSE '15-30 days (At Risk)'
-            END
-        WHEN sixty_day_avg_days_between_purchases <= 60 THEN 
-            CASE
-                WHEN sixty_day_avg_days_between_purchases <= 45 THEN '30-60 days (New)'
-                ELSE '30-60 days (At Risk)'
-            END
-        ELSE '60+ days'
-    END as purchase_segment_60d,
-    CASE 
-        WHEN total_purchases_previous_60d = 0 THEN 'No Purchase'
-        WHEN total_purchases_previous_60d = 1 THEN '1 Time Purchaser'
-        WHEN previous_sixty_day_avg_days_between_purchases <= 15 THEN '0-15 days'
-        WHEN previous_sixty_day_avg_days_between_purchases <= 30 THEN '15-30 days'
-        WHEN previous_sixty_day_avg_days_between_purchases <= 60 THEN '30-60 days'
-        ELSE '60+ days'
-    END as purchase_segment_previous_60d,
-    CASE 
-        WHEN total_purchases_lifetime = 0 THEN 'No Purchase'
-        WHEN total_purchases_lifetime = 1 THEN '1 Time Purchaser'
-        WHEN lifetime_avg_days_between_purchases <= 30 THEN 'Frequent'
-        WHEN lifetime_avg_days_between_purchases <= 60 THEN 'Active'
-        ELSE 'Inactive'
-    END as final_bucket_lifetime,
-    CASE 
-        WHEN total_purchases_60d = 0 THEN 'No Purchase'
-        WHEN total_purchases_60d = 1 THEN '1 Time Purchaser'
-        WHEN sixty_day_avg_days_between_purchases <= 30 THEN 
-            CASE
-                WHEN sixty_day_avg_days_between_purchases <= 15 THEN 'Frequent (New)'
-                ELSE 'Frequent (At Risk)'
-            END
-        WHEN sixty_day_avg_days_between_purchases <= 60 THEN 
-            CASE
-                WHEN sixty_day_avg_days_between_purchases <= 45 THEN 'Active (New)'
-                ELSE 'Active (At Risk)'
-            END
-        ELSE 'Inactive'
-    END as final_bucket_60d,
-    CASE 
-        WHEN total_purchases_previous_60d = 0 THEN 'No Purchase'
-        WHEN total_purchases_previous_60d = 1 THEN '1 Time Purchaser'
-        WHEN previous_sixty_day_avg_days_between_purchases <= 30 THEN 'Frequent'
-        WHEN previous_sixty_day_avg_days_between_purchases <= 60 THEN 'Active'
-        ELSE 'Inactive'
-    END as final_bucket_previous_60d,
-    CASE
-        WHEN total_purchases_previous_60d = 0 AND total_purchases_60d = 0 THEN 'No Purchase'
-        WHEN total_purchases_previous_60d = 0 AND total_purchases_60d = 1 THEN 'No Purchase - 1 Time Purchaser'
-        WHEN total_purchases_previous_60d = 1 AND total_purchases_60d = 0 THEN '1 Time Purchaser - No Purchase'
-        ELSE 
-            CONCAT(
-                CASE 
-                    WHEN total_purchases_previous_60d = 0 THEN 'No Purchase'
-                    WHEN previous_sixty_day_avg_days_between_purchases <= 30 THEN 'Frequent'
-                    WHEN previous_sixty_day_avg_days_between_purchases <= 60 THEN 'Active'
-                    ELSE 'Inactive'
-                END,
-                ' - ',
-                CASE 
-                    WHEN total_purchases_60d = 0 THEN 'No Purchase'
-                    WHEN total_purchases_60d = 1 THEN '1 Time Purchaser'
-                    WHEN sixty_day_avg_days_between_purchases <= 30 THEN 
-                        CASE
-                            WHEN days_since_last_purchase <= 15 THEN 
-                                CASE 
-                                    WHEN previous_sixty_day_avg_days_between_purchases > 30 
-                                         OR previous_sixty_day_avg_days_between_purchases IS NULL THEN 'Frequent (New)'
-                                    ELSE 'Frequent'
-                                END
-                            ELSE 'Frequent (At Risk)'
-                        END
-                    WHEN sixty_day_avg_days_between_purchases <= 60 THEN 
-                        CASE
-                            WHEN days_since_last_purchase <= 30 THEN 
-                                CASE 
-                                    WHEN previous_sixty_day_avg_days_between_purchases > 60 
-                                         OR previous_sixty_day_avg_days_between_purchases IS NULL THEN 'Active (New)'
-                                    ELSE 'Active'
-                                END
-                            ELSE 'Active (At Risk)'
-                        END
-                    ELSE 'Inactive'
-                END
-            )
-    END as current_segmentation,
-    CASE 
-        WHEN total_requests_lifetime = 0 THEN 'No Requests'
-        WHEN total_requests_lifetime = 1 THEN '1 Request'
-        WHEN lifetime_avg_days_between_requests <= 5 THEN '0-5 days'
-        WHEN lifetime_avg_days_between_requests <= 10 THEN '5-10 days'
-        WHEN lifetime_avg_days_between_requests <= 21 THEN '10-21 days'
-        ELSE '21+ days'
-    END as request_segment_lifetime,
-    CASE 
-        WHEN total_requests_60d = 0 THEN 'No Requests'
-        WHEN total_requests_60d = 1 THEN '1 Request'
-        WHEN sixty_day_avg_days_between_requests <= 5 THEN '0-5 days'
-        WHEN sixty_day_avg_days_between_requests <= 10 THEN '5-10 days'
-        WHEN sixty_day_avg_days_between_requests <= 21 THEN '10-21 days'
-        ELSE '21+ days'
-    END as request_segment_60d,
-    CASE 
-        WHEN total_requests_lifetime = 0 THEN 'No Requests'
-        WHEN total_requests_lifetime = 1 THEN '1 Request'
-        WHEN lifetime_avg_days_between_requests <= 10 THEN 'Frequent'
-        WHEN lifetime_avg_days_between_requests <= 21 THEN 'Active'
-        ELSE 'Inactive'
-    END as request_activity_bucket_lifetime,
-    CASE 
-        WHEN total_requests_60d = 0 THEN 'No Requests'
-        WHEN total_requests_60d = 1 THEN '1 Request'
-        WHEN sixty_day_avg_days_between_requests <= 10 THEN 'Frequent'
-        WHEN sixty_day_avg_days_between_requests <= 21 THEN 'Active'
-        ELSE 'Inactive'
-    END as request_activity_bucket_60d
-FROM metrics
-ORDER BY total_requests_lifetime DESC NULLS LAST;
+            UNION ALL
+
+            SELECT 
+                dealer_code,
+                'request' as event_type,
+                DATE(received_at) as event_date,
+                COUNT(*) as n_events
+            FROM ajans_dealers.dealer_requests
+            WHERE request_type = 'Buy Now'
+            AND received_at IS NOT NULL
+            GROUP BY dealer_code, event_date
+        )
+
+        SELECT 
+            d.dealer_code,
+            d.dealer_name,
+            e.event_type,
+            e.event_date,
+            e.n_events
+        FROM (SELECT DISTINCT dealer_code, dealer_name FROM ajans_dealers.dealers) d
+        LEFT JOIN events e ON d.dealer_code = e.dealer_code
         """
 
         # Dealer activity query
@@ -560,7 +1377,8 @@ ORDER BY total_requests_lifetime DESC NULLS LAST;
             total_car_events_30d DESC
         """
 
-        # New query for recent car views
+        # Query for recent car views, only fetching events from the newest one in the cached window on.
+        # time is a TIMESTAMP (UTC), compared with the TIMESTAMP watermark and the UTC window cutoff.
         recent_views_query = """
         SELECT 
             time,
@@ -575,12 +1393,13 @@ ORDER BY total_requests_lifetime DESC NULLS LAST;
             body_style,
             entity_code as dealer_code
         FROM `pricing-338819.silver_ajans_mixpanel.screen_car_profile_event`
-        WHERE DATE(time) >= DATE_SUB(CURRENT_DATE(), INTERVAL 30 DAY)
+        WHERE DATE(time) >= GREATEST(DATE_SUB(CURRENT_DATE(), INTERVAL 30 DAY), DATE(@watermark))
+        AND time >= @watermark
         AND entity_code IS NOT NULL
         ORDER BY time DESC
         """
 
-        # New query for recent filters
+        # Query for recent filters, only fetching events from the newest one in the cached window on
         recent_filters_query = """
         SELECT 
             time,
@@ -593,34 +1412,357 @@ ORDER BY total_requests_lifetime DESC NULLS LAST;
             no_of_cars,
             entity_code as dealer_code
         FROM `pricing-338819.silver_ajans_mixpanel.action_filter`
-        WHERE DATE(time) >= DATE_SUB(CURRENT_DATE(), INTERVAL 30 DAY)
+        WHERE DATE(time) >= GREATEST(DATE_SUB(CURRENT_DATE(), INTERVAL 30 DAY), DATE(@watermark))
+        AND time >= @watermark
         AND entity_code IS NOT NULL
         ORDER BY time DESC
         """
 
-        # Execute all queries
-        live_cars_df = client.query(live_cars_query).to_dataframe()
-        historical_df = client.query(historical_query).to_dataframe()
-        dealer_seg_df = client.query(dealer_seg_query).to_dataframe()
-        activity_df = client.query(dealer_activity_query).to_dataframe()
-        recent_views_df = client.query(recent_views_query).to_dataframe()
-        recent_filters_df = client.query(recent_filters_query).to_dataframe()
+        # OLX listings of the last 30 days matched to dealers by normalized phone number
+        olx_listings_query = """
+        WITH cleaned_numbers AS (
+            SELECT
+                DISTINCT id,
+                title,
+                year,
+                kilometers,
+                make,
+                model,
+                condition,
+                region,
+                price,
+                is_active,
+                added_at,
+                REGEXP_REPLACE(seller_phone_number, r'[^0-9,]', '') AS cleaned_phone_number
+            FROM olx.listings
+            WHERE added_at >= DATE_SUB(CURRENT_DATE(), INTERVAL 30 DAY)
+        ),
+        flattened_numbers AS (
+            SELECT
+                DISTINCT id,
+                title,
+                year,
+                kilometers,
+                make,
+                model,
+                condition,
+                region,
+                price,
+                is_active,
+                added_at,
+                SUBSTR(phone_number, 2) AS phone_number
+            FROM cleaned_numbers,
+            UNNEST(SPLIT(cleaned_phone_number, ',')) AS phone_number
+        )
 
-        # Convert date columns
-        historical_df['request_date'] = pd.to_datetime(historical_df['request_date'])
-        live_cars_df['date_key'] = pd.to_datetime(live_cars_df['date_key'])
+        SELECT 
+            f.*,
+            d.dealer_code
+        FROM flattened_numbers f
+        INNER JOIN gold_wholesale.dim_dealers d
+        ON f.phone_number = d.dealer_phone
+        ORDER BY added_at DESC
+        """
 
-        # Convert numeric columns
-        numeric_columns = ['time_on_app', 'price', 'year', 'kilometers', 'sylndr_acquisition_price',
-                           'market_retail_price', 'median_asked_price', 'refurbishment_cost']
-        for col in numeric_columns:
-            if col in historical_df.columns:
-                historical_df[col] = pd.to_numeric(historical_df[col], errors='coerce')
+        # Execute all queries concurrently
+        queries = {
+            'live_cars': live_cars_query,
+            'historical': historical_query,
+            'dealer_events': dealer_events_query,
+            'dealer_activity': dealer_activity_query,
+            'olx_listings': olx_listings_query
+        }
+        # In lazy mode each dealer's views and filters are fetched when their profile is opened
+        if not LAZY_RECENT_ACTIVITY:
+            queries['recent_views'] = recent_views_query
+            queries['recent_filters'] = recent_filters_query
+        query_hash = hash_queries(queries)
+
+        # Start from a fresh snapshot on disk when there is one
+        snapshot = find_snapshot(query_hash, max_age=snapshot_max_age)
+        if snapshot:
+            print(f"Loaded snapshot {snapshot['version']} created at {snapshot['created_at']}")
+            return snapshot_frames(read_snapshot(snapshot)), datetime.fromisoformat(snapshot['created_at'])
+
+        # Use the shared BigQuery client of this process
+        client_factory = get_bigquery_client_factory()
+        client = client_factory.get_client()
+        if client is None:
+            # Run offline from the latest snapshot, however old it is
+            snapshot = find_snapshot(query_hash)
+            if snapshot:
+                report_load_problem(f"No credentials found. Showing offline data from {snapshot['created_at']}.",
+                                    st.warning)
+                return snapshot_frames(read_snapshot(snapshot)), datetime.fromisoformat(snapshot['created_at'])
+
+            report_load_problem(
+                "No credentials found. Please configure either Streamlit secrets or provide a service_account.json file.")
+            return (pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), pd.DataFrame(),
+                    pd.DataFrame()), None
+
+        # Large results are read through the Storage Read API when it is installed
+        bqstorage_client = client_factory.get_bqstorage_client()
+
+        from google.cloud import bigquery
+
+        event_windows = get_event_windows()
+        job_configs = {
+            name: bigquery.QueryJobConfig(
+                query_parameters=[
+                    bigquery.ScalarQueryParameter("watermark", "TIMESTAMP", window.watermark or EVENT_EPOCH)
+                ]
+            )
+            for name, window in event_windows.items()
+            if name in queries
+        }
+
+        created_at = datetime.now(timezone.utc)
+        try:
+            results, timings = run_queries_concurrently(
+                client,
+                queries,
+                job_configs=job_configs,
+                download=lambda name, job: arrow_to_dataframe(
+                    job.to_arrow(bqstorage_client=bqstorage_client), RESULT_DTYPES[name]
+                )
+            )
+        except RuntimeError as e:
+            report_load_problem(f"Error loading data from BigQuery: {e}")
+            return (pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), pd.DataFrame(),
+                    pd.DataFrame()), None
+
+        for name, seconds in timings.items():
+            print(f"Query {name} finished in {seconds:.2f}s ({len(results[name])} rows)")
+
+        if LAZY_RECENT_ACTIVITY:
+            results['recent_views'] = pd.DataFrame()
+            results['recent_filters'] = pd.DataFrame()
+        else:
+            results['recent_views'] = event_windows['recent_views'].merge(results['recent_views'])
+            results['recent_filters'] = event_windows['recent_filters'].merge(results['recent_filters'])
+
+        write_snapshot(results, query_hash, created_at)
+
+        return snapshot_frames(results), created_at
+
+
+    # Datasets are rebuilt in the background once they are this old, ahead of the 12-hour expiry
+    DATA_REFRESH_AFTER = timedelta(hours=11)
+    DATA_RETRY_AFTER = timedelta(minutes=10)
+    DATA_REFRESH_CHECK_SECONDS = 60
+
+
+    class DealerIndex:
+        """
+        Row positions of each dealer_code in every dataset, built once per data version
+        so the profile view looks dealers up instead of scanning whole frames.
+        """
+
+        def __init__(self, tables):
+            self.tables = tables
+            self.positions = {
+                name: df.groupby('dealer_code', observed=True, sort=False).indices
+                for name, df in tables.items()
+                if 'dealer_code' in df.columns
+            }
+
+        @classmethod
+        def from_datasets(cls, datasets):
+            historical_df, _, dealer_seg_df, activity_df, recent_views_df, recent_filters_df, _ = datasets
+            return cls({
+                'historical': historical_df,
+                'dealer_seg': dealer_seg_df,
+                'dealer_activity': activity_df,
+                'recent_views': recent_views_df,
+                'recent_filters': recent_filters_df
+            })
+
+        def rows(self, name, dealer_code):
+            """Rows of a dataset for one dealer, empty if the dealer has none."""
+            df = self.tables[name]
+            positions = self.positions.get(name, {}).get(dealer_code)
+            if positions is None:
+                return df.iloc[0:0]
+            return df.iloc[positions]
+
+
+    # Columns kept in the compact OLX listings table
+    OLX_LISTING_COLUMNS = ['id', 'added_at', 'title', 'make', 'model', 'year', 'kilometers',
+                           'price', 'condition', 'is_active', 'region']
+
+
+    class OlxIndex:
+        """
+        OLX listings matched to dealers by normalized phone number, built once per data version
+        so profile views look a dealer's listings up instead of scanning olx.listings.
+        """
+
+        def __init__(self, matches):
+            if matches.empty:
+                matches = pd.DataFrame(columns=OLX_LISTING_COLUMNS + ['phone_number', 'dealer_code'])
+
+            # One row per listing, newest first
+            self.listings = (
+                matches.drop_duplicates('id')[OLX_LISTING_COLUMNS]
+                .sort_values('added_at', ascending=False, kind='stable')
+                .reset_index(drop=True)
+            )
+            listing_positions = pd.Index(self.listings['id'])
+            pairs = matches[['dealer_code', 'id']].drop_duplicates()
+            self.dealer_listings = {
+                dealer_code: np.sort(listing_positions.get_indexer(ids))
+                for dealer_code, ids in pairs.groupby('dealer_code', observed=True, sort=False)['id']
+            }
+
+        def listings_for_dealer(self, dealer_code):
+            """The dealer's listings, newest first, empty if the dealer has none."""
+            positions = self.dealer_listings.get(dealer_code)
+            if positions is None:
+                return self.listings.iloc[0:0]
+            return self.listings.iloc[positions]
+
+
+    class Dataset:
+        """
+        One version of the datasets, loaded once per process and shared read-only by all sessions.
+        Sessions read the frames without copying them; copy-on-write keeps their changes private.
+        """
+
+        def __init__(self, version, loaded_at, datasets):
+            self.version = version
+            self.loaded_at = loaded_at
+            self.frames = datasets
+            with span("dataset.index"):
+                self.index = DealerIndex.from_datasets(datasets)
+                self.olx = OlxIndex(datasets[6])
+            with span("dataset.recommendations"):
+                preferences = DealerPreferences(datasets[0])
+                self.recommendations = RecommendationEngine(preferences, datasets[1])
+            with span("dataset.buyers"):
+                self.buyers = BuyerIndex(preferences, datasets[1])
+
+
+    class DatasetStore:
+        """
+        Current dataset shared by all sessions, rebuilt by a daemon thread before it expires.
+        Sessions keep reading the previous version during a refresh and the new one is swapped in at once.
+        """
+
+        def __init__(self):
+            self.dataset = None  # Current Dataset, replaced as a whole
+            self.version = 0
+            self.status = 'idle'
+            self.last_error = None
+            self.last_error_at = None
+            self.load_lock = threading.Lock()
+            self.thread = threading.Thread(target=self.run, name="dataset-refresh", daemon=True)
+            self.thread.start()
+
+        def get(self):
+            """
+            Returns:
+                The current Dataset, or None if the data could not be loaded.
+                Only the first load of the process blocks.
+            """
+            dataset = self.dataset
+            if dataset is not None:
+                return dataset
+
+            with self.load_lock:
+                if self.dataset is None:
+                    with span("load_data"):
+                        datasets, created_at = load_data()
+                    if created_at is None:
+                        return None
+                    self.swap(datasets, created_at)
+                return self.dataset
+
+        def swap(self, datasets, created_at):
+            """Publish a new version; sessions holding the previous one keep using it."""
+            self.version += 1
+            self.dataset = Dataset(self.version, created_at, datasets)
+
+        def age(self):
+            dataset = self.dataset
+            return datetime.now(timezone.utc) - dataset.loaded_at if dataset else None
+
+        def refresh(self):
+            """Rebuild the datasets and swap them in, keeping the previous version on failure."""
+            with self.load_lock:
+                self.status = 'refreshing'
+                # Reuse a snapshot only if another replica wrote it after our data went stale
+                with span("load_data"):
+                    datasets, created_at = load_data(snapshot_max_age=SNAPSHOT_MAX_AGE - DATA_REFRESH_AFTER)
+                if created_at is None:
+                    self.fail("could not load data")
+                    return
+                # Offline, load_data() serves the old snapshot again; back off instead of rebuilding it every check
+                if created_at <= self.dataset.loaded_at:
+                    self.fail("no newer data than the current version")
+                    return
+                self.swap(datasets, created_at)
+                self.status = 'idle'
+
+        def fail(self, error):
+            """Keep the current version and retry the refresh after DATA_RETRY_AFTER."""
+            print(f"Data refresh failed: {error}")
+            self.status = 'failed'
+            self.last_error = error
+            self.last_error_at = datetime.now(timezone.utc)
+
+        def run(self):
+            while True:
+                time.sleep(DATA_REFRESH_CHECK_SECONDS)
+                age = self.age()
+                if age is None or age < DATA_REFRESH_AFTER:
+                    continue
+                if self.status == 'failed' and datetime.now(timezone.utc) - self.last_error_at < DATA_RETRY_AFTER:
+                    continue
+                try:
+                    self.refresh()
+                except Exception as e:
+                    self.fail(f"error refreshing data: {e}")
+
+
+    @st.cache_resource
+    def get_dataset_store():
+        """Dataset store shared by all sessions of this process."""
+        return DatasetStore()
+
+
+    def show_data_status(store):
+        """Show the age of the datasets and the background refresh status in the sidebar."""
+        dataset = store.dataset
+        if dataset is None:
+            return
+
+        age = datetime.now(timezone.utc) - dataset.loaded_at
+        hours, remainder = divmod(int(age.total_seconds()), 3600)
+        st.sidebar.caption(f"Data version {dataset.version}, age: {hours}h {remainder // 60}m")
+        if store.status == 'refreshing':
+            st.sidebar.caption("🔄 Refreshing data in the background...")
+        elif store.status == 'failed':
+            st.sidebar.caption(f"⚠️ Last refresh failed at {store.last_error_at:%H:%M} UTC ({store.last_error}), retrying")
+
+
+    def show_client_metrics():
+        """Show reuse and token refresh counts of the shared BigQuery client."""
+        metrics = get_bigquery_client_factory().metrics
+        st.caption(
+            f"BigQuery client: {metrics['clients_created']} created, {metrics['client_reuses']} reuses, "
+            f"{metrics['token_refreshes']} token refreshes"
+        )
 
-        live_cars_df['year'] = pd.to_numeric(live_cars_df['year'], errors='coerce')
-        live_cars_df['kilometers'] = pd.to_numeric(live_cars_df['kilometers'], errors='coerce')
 
-        return historical_df, live_cars_df, dealer_seg_df, activity_df, recent_views_df, recent_filters_df
+    def show_cache_metrics():
+        """Show hit and miss counts of the per-dealer caches."""
+        lookups = get_dealer_lookup_cache()
+        activity = get_dealer_activity_cache()
+        st.caption(
+            f"Dealer cache: {lookups.hits} hits, {lookups.misses} misses, "
+            f"{lookups.cache.currsize / 1024 ** 2:.1f} of {DEALER_LOOKUP_CACHE_MB} MB; "
+            f"activity cache: {activity.hits} hits, {activity.misses} misses"
+        )
 
 
     # Define priority cases at the module level
@@ -674,251 +1816,465 @@ ORDER BY total_requests_lifetime DESC NULLS LAST;
     ]
 
 
-    def get_priority(row):
-        """Determine priority level based on current segmentation."""
-        current_seg = row['current_segmentation']
+    PRIORITY_LEVELS = ['🔴 Critical Priority', '🟠 High Priority', '🟡 Medium Priority', '⚪ Low Priority']
 
-        if any(case in current_seg for case in critical_cases):
-            return '🔴 Critical Priority'
-        elif any(case in current_seg for case in high_cases):
-            return '🟠 High Priority'
-        elif any(case in current_seg for case in medium_cases):
-            return '🟡 Medium Priority'
-        else:
-            return '⚪ Low Priority'
+
+    # Every current_segmentation value compute_segmentation() can produce
+    SEGMENTATION_VALUES = ['No Purchase', '1 Time Purchaser - No Purchase'] + [
+        f"{previous} - {recent}" for previous in PREVIOUS_PURCHASE_LABELS for recent in RECENT_PURCHASE_LABELS
+    ]
+
+
+    def match_priority_cases(segmentation):
+        """
+        Priority of one segmentation by the case lists: the first level with a case contained in it,
+        and the position of the first such case in that level's list.
+        Returns:
+            Tuple of (status_code, priority_score, matched); unmatched segmentations are Low Priority
+            and sort after the listed low cases
+        """
+        for level, cases in enumerate([critical_cases, high_cases, medium_cases, low_cases]):
+            for score, case in enumerate(cases):
+                if case in segmentation:
+                    return level, score, True
+        return len(PRIORITY_LEVELS) - 1, len(low_cases), False
+
+
+    def compile_priority_table():
+        """
+        Match every segmentation value against the case lists once, so dealers are classified by lookup.
+        Returns:
+            DataFrame indexed by segmentation with the status code (position in PRIORITY_LEVELS),
+            the priority score (position of the matching case in its list) and whether a case matched
+        """
+        rows = {segmentation: match_priority_cases(segmentation) for segmentation in SEGMENTATION_VALUES}
+        return pd.DataFrame.from_dict(rows, orient='index', columns=['status_code', 'priority_score', 'matched'])
+
+
+    PRIORITY_TABLE = compile_priority_table()
+
+
+    def classify_segmentations(segmentations):
+        """
+        Look up the priority of each segmentation in PRIORITY_TABLE.
+        Segmentations missing from the table are matched against the case lists one by one.
+        Args:
+            segmentations: Series of current_segmentation strings
+        Returns:
+            Tuple of (status, priority_score, matched): a Categorical in PRIORITY_LEVELS order
+            and two arrays aligned with segmentations
+        """
+        segmentations = pd.Index(segmentations, dtype=object)
+        table = PRIORITY_TABLE
+        missing = segmentations.unique().difference(table.index)
+        if len(missing):
+            table = pd.concat([table, pd.DataFrame(
+                [match_priority_cases(str(segmentation)) for segmentation in missing],
+                index=missing, columns=table.columns
+            )])
+        rows = table.reindex(segmentations)
+        return (pd.Categorical.from_codes(rows['status_code'].to_numpy(), categories=PRIORITY_LEVELS),
+                rows['priority_score'].to_numpy(), rows['matched'].to_numpy())
 
 
     def get_dealers_needing_attention(dealer_seg_df):
         """Identify dealers who need attention based on their current segmentation and transitions."""
 
         # Filter out users, keep only dealers
-        attention_needed = dealer_seg_df[dealer_seg_df['user_vs_dealer_flag'] == 'Dealer'].copy()
+        attention_needed = dealer_seg_df[dealer_seg_df['user_vs_dealer_flag'] == 'Dealer']
 
         # Add priority based on current segmentation
-        attention_needed['status'] = attention_needed.apply(get_priority, axis=1)
+        status, priority_score, _ = classify_segmentations(attention_needed['current_segmentation'])
+        attention_needed = attention_needed.assign(
+            status=status,
+            priority_score=priority_score,
+            activity_drop=(
+                    attention_needed['avg_requests_per_month_lifetime'] -
+                    attention_needed['avg_requests_per_month_60d']
+            )
+        )
 
-        # Calculate activity metrics
-        attention_needed['activity_drop'] = (
-                attention_needed['avg_requests_per_month_lifetime'] -
-                attention_needed['avg_requests_per_month_60d']
+        # Sort by priority (Critical -> High -> Medium -> Low, the category order) and then by activity drop
+        return attention_needed.sort_values(
+            ['status', 'priority_score', 'activity_drop'],
+            ascending=[True, True, False]
         )
 
-        # Sort by priority (Critical -> High -> Medium -> Low) and then by activity drop
-        priority_order = ['🔴 Critical Priority', '🟠 High Priority', '🟡 Medium Priority', '⚪ Low Priority']
 
-        def get_priority_score(row):
-            current_seg = row['current_segmentation']
+    # Recommended cars shown on a dealer profile
+    RECOMMENDED_CARS_SHOWN = 100
 
-            # Get the list of cases for the row's priority level
-            if row['status'] == '🔴 Critical Priority':
-                cases = critical_cases
-            elif row['status'] == '🟠 High Priority':
-                cases = high_cases
-            elif row['status'] == '🟡 Medium Priority':
-                cases = medium_cases
-            else:
-                cases = low_cases
 
-            # Find the index of the case in its priority level list
-            for i, case in enumerate(cases):
-                if case in current_seg:
-                    return i
-            return len(cases)  # If not found, put at end of its priority group
+    def lookup_scores(scores, keys):
+        """
+        Look up a score for every key, 0 where the key has no score.
+        Args:
+            scores: Series of scores indexed by key (an Index or a MultiIndex)
+            keys: Index or MultiIndex of the keys to look up
+        Returns:
+            Float array aligned with keys
+        """
+        # A trailing 0 is what position -1 of a missing key picks up
+        positions = scores.index.get_indexer(keys)
+        return np.append(scores.to_numpy(dtype=float), 0.0)[positions]
+
+
+    def closeness_scores(values, mean, std):
+        """
+        Score values 0-2 by their distance from the mean in standard deviations, 0 where unknown
+        or where the spread is zero. mean and std may be scalars or column vectors of several dealers.
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            score = 2 - np.abs(values - mean) / std
+        return np.where((std > 0) & (score > 0), np.minimum(score, 2), 0.0)
 
-        attention_needed['priority_score'] = attention_needed.apply(get_priority_score, axis=1)
 
-        return attention_needed.sort_values(
-            ['status', 'priority_score', 'activity_drop'],
-            ascending=[True, True, False],
-            key=lambda x: pd.Categorical(x, categories=priority_order) if x.name == 'status' else x
+    def score_live_cars(dealer_historical, live_cars):
+        """
+        Score every live car against a dealer's historical purchases.
+        Args:
+            dealer_historical: The dealer's purchases
+            live_cars: Cars currently in inventory
+        Returns:
+            Tuple of (make, model, year, mileage) score arrays aligned with the rows of live_cars
+        """
+        # Make preferences, 0-3 points
+        make_counts = dealer_historical['make'].value_counts()
+        make_scores = make_counts / len(dealer_historical) * 3
+        make_scores.index = make_scores.index.astype(object)
+
+        # Model preferences within each make, 0-2 points
+        model_counts = dealer_historical.groupby(['make', 'model'], observed=True).size()
+        model_scores = model_counts / make_counts.reindex(model_counts.index.get_level_values('make')).to_numpy() * 2
+        model_scores.index = pd.MultiIndex.from_arrays(
+            [model_scores.index.get_level_values(level).astype(object) for level in range(2)]
+        )
+
+        makes = pd.Index(live_cars['make'].astype(object))
+        models = pd.Index(live_cars['model'].astype(object))
+        make_score = lookup_scores(make_scores, makes)
+        model_score = lookup_scores(model_scores, pd.MultiIndex.from_arrays([makes, models]))
+
+        # Year and mileage closeness, 0-2 points each
+        year_score = closeness_scores(
+            live_cars['year'].to_numpy(dtype=float, na_value=np.nan),
+            dealer_historical['year'].mean(), dealer_historical['year'].std()
+        )
+        km_score = closeness_scores(
+            live_cars['kilometers'].to_numpy(dtype=float, na_value=np.nan),
+            dealer_historical['kilometers'].mean(), dealer_historical['kilometers'].std()
         )
+        return make_score, model_score, year_score, km_score
 
 
-    def get_recommended_cars(dealer_historical, live_cars):
+    def get_recommended_cars(dealer_historical, live_cars, top_k=RECOMMENDED_CARS_SHOWN):
         """
         Generate car recommendations based on dealer's historical purchases.
-        Returns a DataFrame with recommended cars and their match scores.
+        Args:
+            dealer_historical: The dealer's purchases
+            live_cars: Cars currently in inventory
+            top_k: Number of best matches to return, or None for all cars
+        Returns:
+            DataFrame with the recommended cars and their match scores, best first,
+            indexed by position in live_cars
         """
         if dealer_historical.empty or live_cars.empty:
             return pd.DataFrame()
 
-        # Calculate make preferences
-        make_counts = dealer_historical['make'].value_counts()
-        total_purchases = len(dealer_historical)
-        make_scores = make_counts / total_purchases * 3  # Scale to 0-3 points
-
-        # Calculate model preferences within each make
-        model_preferences = {}
-        for make in make_counts.index:
-            make_data = dealer_historical[dealer_historical['make'] == make]
-            model_counts = make_data['model'].value_counts()
-            model_preferences[make] = model_counts / len(make_data) * 2  # Scale to 0-2 points
-
-        # Calculate year and mileage ranges
-        year_mean = dealer_historical['year'].mean()
-        year_std = dealer_historical['year'].std()
-        km_mean = dealer_historical['kilometers'].mean()
-        km_std = dealer_historical['kilometers'].std()
-
-        # Score each available car
-        scored_cars = []
-        for _, car in live_cars.iterrows():
-            # Initialize score components
-            make_score = make_scores.get(car['make'], 0)
-            model_score = model_preferences.get(car['make'], pd.Series()).get(car['model'], 0)
-
-            # Year score (0-2 points)
-            year_diff = abs(car['year'] - year_mean)
-            year_score = max(0, 2 - (year_diff / year_std)) if year_std > 0 else 0
-            year_score = min(2, max(0, year_score))  # Clamp between 0 and 2
-
-            # Kilometer score (0-2 points)
-            km_diff = abs(car['kilometers'] - km_mean)
-            km_score = max(0, 2 - (km_diff / km_std)) if km_std > 0 else 0
-            km_score = min(2, max(0, km_score))  # Clamp between 0 and 2
-
-            # Total score
-            total_score = make_score + model_score + year_score + km_score
-
-            # Create score breakdown
-            score_breakdown = f"Make: {make_score:.1f}, Model: {model_score:.1f}, Year: {year_score:.1f}, Mileage: {km_score:.1f}"
-
-            # Add to results
-            scored_cars.append({
-                'sf_vehicle_name': car['sf_vehicle_name'],
-                'make': car['make'],
-                'model': car['model'],
-                'year': car['year'],
-                'kilometers': car['kilometers'],
-                'match_score': total_score,
-                'score_breakdown': score_breakdown
-            })
+        make_score, model_score, year_score, km_score = score_live_cars(dealer_historical, live_cars)
+        total_score = make_score + model_score + year_score + km_score
 
-        # Convert to DataFrame and sort by score
-        recommendations = pd.DataFrame(scored_cars)
-        if not recommendations.empty:
-            recommendations = recommendations.sort_values('match_score', ascending=False)
+        # Select the best matches before sorting and formatting only those
+        top = np.arange(len(total_score))
+        if top_k is not None and top_k < len(total_score):
+            top = np.argpartition(-total_score, top_k - 1)[:top_k]
+        top = top[np.argsort(-total_score[top], kind='stable')]
 
+        recommendations = live_cars.iloc[top][['sf_vehicle_name', 'make', 'model', 'year', 'kilometers']]
+        recommendations.index = top
+        recommendations['match_score'] = total_score[top]
+        recommendations['score_breakdown'] = format_breakdowns(
+            make_score[top], model_score[top], year_score[top], km_score[top])
         return recommendations
 
 
-    def get_olx_listings_for_dealer(client, dealer_id):
+    # Memory used by one chunk of the dealers x live cars score matrices
+    RECOMMENDATION_CHUNK_BYTES = 256 * 1024 ** 2
+
+
+    class DealerPreferences:
         """
-        Get OLX listings for a specific dealer from the last 30 days.
-        Args:
-            client: BigQuery client
-            dealer_id: The dealer's code to search for
-        Returns:
-            DataFrame containing the dealer's OLX listings
+        Purchase preferences of every dealer from one pass over the historical purchases:
+        make share (0-3 points), model share within make (0-2 points), and year and mileage spread.
         """
-        olx_query = """
-        WITH cleaned_numbers AS (
-            SELECT
-                DISTINCT seller_name,
-                REGEXP_REPLACE(seller_phone_number, r'[^0-9,]', '') AS cleaned_phone_number,
-                id,
-                title,
-                transmission_type,
-                year,
-                kilometers,
-                make,
-                model,
-                payment_options,
-                condition,
-                engine_capacity,
-                extra_features,
-                color,
-                body_type,
-                ad_type,
-                fuel_type,
-                description,
-                images,
-                region,
-                price,
-                is_active,
-                added_at,
-                deactivated_at,
-                is_dealer,
-                created_at
-            FROM olx.listings
-            WHERE added_at >= DATE_SUB(CURRENT_DATE(), INTERVAL 30 DAY)
-        ),
-        split_numbers AS (
-            SELECT
-                *,
-                SPLIT(cleaned_phone_number, ',') AS phone_numbers
-            FROM cleaned_numbers
-        ),
-        flattened_numbers AS (
-            SELECT
-                DISTINCT
-                id,
-                title,
-                transmission_type,
-                year,
-                kilometers,
-                make,
-                model,
-                payment_options,
-                condition,
-                engine_capacity,
-                extra_features,
-                color,
-                body_type,
-                ad_type,
-                fuel_type,
-                description,
-                images,
-                region,
-                price,
-                seller_name,
-                is_active,
-                added_at,
-                deactivated_at,
-                is_dealer,
-                created_at,
-                SUBSTR(phone_number, 2) AS phone_number
-            FROM split_numbers,
-            UNNEST(phone_numbers) AS phone_number
+
+        def __init__(self, historical):
+            historical = historical[historical['dealer_code'].notna()] if not historical.empty else historical
+            if historical.empty:
+                historical = pd.DataFrame(columns=['dealer_code', 'dealer_name', 'make', 'model', 'year', 'kilometers'])
+
+            purchases = historical.groupby('dealer_code', observed=True)
+            totals = purchases.size()
+            self.dealer_codes = pd.Index(totals.index)
+            self.dealer_names = purchases['dealer_name'].first().reindex(self.dealer_codes).to_numpy(dtype=object)
+            stats = purchases[['year', 'kilometers']].agg(['mean', 'std']).astype(float)
+            self.year_mean = stats[('year', 'mean')].to_numpy()
+            self.year_std = stats[('year', 'std')].to_numpy()
+            self.km_mean = stats[('kilometers', 'mean')].to_numpy()
+            self.km_std = stats[('kilometers', 'std')].to_numpy()
+
+            make_counts = historical.groupby(['dealer_code', 'make'], observed=True).size()
+            model_counts = historical.groupby(['dealer_code', 'make', 'model'], observed=True).size()
+            make_shares = make_counts / totals.reindex(make_counts.index.get_level_values('dealer_code')).to_numpy() * 3
+            model_shares = model_counts / make_counts.reindex(model_counts.index.droplevel('model')).to_numpy() * 2
+
+            # Flat (dealer position, key, share) arrays with object keys for lookups against live cars
+            self.make_dealers = self.dealer_codes.get_indexer(make_shares.index.get_level_values('dealer_code'))
+            self.make_keys = make_shares.index.get_level_values('make').astype(object).to_numpy()
+            self.make_values = make_shares.to_numpy(dtype=float)
+            self.model_dealers = self.dealer_codes.get_indexer(model_shares.index.get_level_values('dealer_code'))
+            self.model_keys = pd.MultiIndex.from_arrays([
+                model_shares.index.get_level_values(level).astype(object) for level in ('make', 'model')
+            ])
+            self.model_values = model_shares.to_numpy(dtype=float)
+
+
+    def live_car_keys(live_cars):
+        """Makes, (make, model) pairs, years and mileages of the live cars as lookup-ready arrays."""
+        makes = pd.Index(live_cars['make'].astype(object))
+        models = pd.Index(live_cars['model'].astype(object))
+        return (
+            makes,
+            pd.MultiIndex.from_arrays([makes, models]),
+            live_cars['year'].to_numpy(dtype=float, na_value=np.nan),
+            live_cars['kilometers'].to_numpy(dtype=float, na_value=np.nan)
         )
 
-        SELECT 
-            f.*,
-            d.dealer_name,
-            d.dealer_code,
-            d.dealer_status,
-            d.dealer_email,
-            d.branch_city,
-            d.dealer_account_manager_name,
-            d.dealer_account_manager_email
-        FROM flattened_numbers f
-        INNER JOIN gold_wholesale.dim_dealers d
-        ON f.phone_number = d.dealer_phone
-        WHERE d.dealer_code = @dealer_id
-        ORDER BY added_at DESC
+
+    def format_breakdowns(make_score, model_score, year_score, km_score):
+        """Score breakdown strings, only for the rows that are shown."""
+        return [
+            f"Make: {make:.1f}, Model: {model:.1f}, Year: {year:.1f}, Mileage: {km:.1f}"
+            for make, model, year, km in zip(make_score, model_score, year_score, km_score)
+        ]
+
+
+    class RecommendationEngine:
+        """
+        Top recommended cars of every dealer, scored in one pass per data version so profile views
+        only look them up. Scores match get_recommended_cars() up to floating-point summation order.
         """
 
-        job_config = bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("dealer_id", "STRING", dealer_id)
-            ]
-        )
+        def __init__(self, preferences, live_cars, top_n=RECOMMENDED_CARS_SHOWN, chunk_bytes=RECOMMENDATION_CHUNK_BYTES):
+            self.dealer_rows = {}
+            if live_cars.empty or preferences.dealer_codes.empty:
+                return
+            self.live_cars = live_cars[['sf_vehicle_name', 'make', 'model', 'year', 'kilometers']]
+            prefs = preferences
+            n_dealers = len(prefs.dealer_codes)
+
+            # Live cars as positions into the makes and (make, model) pairs bought by any dealer; -1 if none did
+            makes = pd.Index(prefs.make_keys).unique()
+            pairs = prefs.model_keys.unique()
+            live_makes, live_pairs, live_years, live_km = live_car_keys(live_cars)
+            live_make_pos = makes.get_indexer(live_makes)
+            live_pair_pos = pairs.get_indexer(live_pairs)
+
+            # Dense share matrices with a trailing zero column, so position -1 scores 0
+            make_matrix = np.zeros((n_dealers, len(makes) + 1))
+            make_matrix[prefs.make_dealers, makes.get_indexer(prefs.make_keys)] = prefs.make_values
+            model_pairs = pairs.get_indexer(prefs.model_keys)
+
+            n_cars = len(live_cars)
+            self.top_n = min(top_n, n_cars)
+            chunk = max(1, chunk_bytes // (n_cars * 8 * 6))
+
+            self.cars = np.empty((n_dealers, self.top_n), dtype=np.int64)
+            self.scores = np.empty((n_dealers, self.top_n, 5))
+            for start in range(0, n_dealers, chunk):
+                rows = slice(start, min(start + chunk, n_dealers))
+                model_matrix = np.zeros((rows.stop - rows.start, len(pairs) + 1))
+                in_chunk = (prefs.model_dealers >= rows.start) & (prefs.model_dealers < rows.stop)
+                model_matrix[prefs.model_dealers[in_chunk] - rows.start, model_pairs[in_chunk]] = \
+                    prefs.model_values[in_chunk]
+
+                make_score = make_matrix[rows][:, live_make_pos]
+                model_score = model_matrix[:, live_pair_pos]
+                year_score = closeness_scores(live_years, prefs.year_mean[rows, None], prefs.year_std[rows, None])
+                km_score = closeness_scores(live_km, prefs.km_mean[rows, None], prefs.km_std[rows, None])
+                total_score = make_score + model_score + year_score + km_score
+
+                top = np.argpartition(-total_score, self.top_n - 1, axis=1)[:, :self.top_n]
+                top = np.take_along_axis(
+                    top, np.argsort(-np.take_along_axis(total_score, top, axis=1), axis=1, kind='stable'), axis=1
+                )
+                self.cars[rows] = top
+                for i, score in enumerate((total_score, make_score, model_score, year_score, km_score)):
+                    self.scores[rows, :, i] = np.take_along_axis(score, top, axis=1)
 
-        try:
-            df = client.query(olx_query, job_config=job_config).to_dataframe()
-            return df
-        except Exception as e:
-            print(f"Error executing query: {e}")
-            return pd.DataFrame()
+            self.dealer_rows = {code: i for i, code in enumerate(prefs.dealer_codes)}
+
+        def for_dealer(self, dealer_code):
+            """The dealer's recommendations in the format of get_recommended_cars(), empty without purchases."""
+            row = self.dealer_rows.get(dealer_code)
+            if row is None:
+                return pd.DataFrame()
+
+            cars = self.cars[row]
+            total_score, make_score, model_score, year_score, km_score = self.scores[row].T
+            recommendations = self.live_cars.iloc[cars]
+            recommendations.index = cars
+            recommendations['match_score'] = total_score
+            recommendations['score_breakdown'] = format_breakdowns(make_score, model_score, year_score, km_score)
+            return recommendations
+
+
+    # Likely buyers kept per live car
+    BUYERS_PER_CAR = 20
+
+
+    class BuyerIndex:
+        """
+        Dealers most likely to buy each live car, with the scoring of get_recommended_cars().
+        An inverted index from make to the dealers who bought it limits each car to those dealers.
+        """
 
+        def __init__(self, preferences, live_cars, top_n=BUYERS_PER_CAR, chunk_bytes=RECOMMENDATION_CHUNK_BYTES):
+            self.preferences = preferences
+            prefs = preferences
+            live_makes, live_pairs, live_years, live_km = live_car_keys(live_cars)
+
+            # Inverted indexes from make to positions in the make shares and in the model shares
+            make_buyers = pd.Series(np.arange(len(prefs.make_keys))).groupby(prefs.make_keys, sort=False).indices
+            make_model_shares = pd.Series(np.arange(len(prefs.model_keys))).groupby(
+                prefs.model_keys.get_level_values(0).to_numpy(), sort=False).indices
+            model_names = prefs.model_keys.get_level_values(1)
+
+            columns = {name: [] for name in ('car', 'rank', 'dealer', 'match_score', 'make', 'model', 'year', 'km')}
+            candidates = np.zeros(len(live_cars), dtype=np.int64)
+            cars_by_make = pd.Series(np.arange(len(live_cars))).groupby(live_makes.to_numpy(), sort=False).indices
+            for make, cars in cars_by_make.items():
+                shares = make_buyers.get(make)
+                if shares is None:
+                    continue
+                dealers = prefs.make_dealers[shares]
+                candidates[cars] = len(dealers)
+
+                # Model shares of all dealers for the models of these cars, trailing zero column for none
+                models = live_pairs[cars].get_level_values(1)
+                model_columns = pd.Index(models.unique())
+                model_matrix = np.zeros((len(prefs.dealer_codes), len(model_columns) + 1))
+                model_rows = make_model_shares.get(make, np.array([], dtype=np.int64))
+                known = model_columns.get_indexer(model_names[model_rows])
+                model_rows = model_rows[known >= 0]
+                model_matrix[prefs.model_dealers[model_rows], known[known >= 0]] = prefs.model_values[model_rows]
+                car_models = model_columns.get_indexer(models)
+
+                n = min(top_n, len(dealers))
+                chunk = max(1, chunk_bytes // (len(dealers) * 8 * 6))
+                for start in range(0, len(cars), chunk):
+                    rows = slice(start, start + chunk)
+                    car_rows = cars[rows]
+                    make_score = np.broadcast_to(prefs.make_values[shares], (len(car_rows), len(dealers)))
+                    model_score = model_matrix[dealers][:, car_models[rows]].T
+                    year_score = closeness_scores(
+                        live_years[car_rows, None], prefs.year_mean[dealers], prefs.year_std[dealers])
+                    km_score = closeness_scores(
+                        live_km[car_rows, None], prefs.km_mean[dealers], prefs.km_std[dealers])
+                    total_score = make_score + model_score + year_score + km_score
+
+                    top = np.argpartition(-total_score, n - 1, axis=1)[:, :n]
+                    top = np.take_along_axis(
+                        top, np.argsort(-np.take_along_axis(total_score, top, axis=1), axis=1, kind='stable'), axis=1
+                    )
+                    columns['car'].append(np.repeat(car_rows, n))
+                    columns['rank'].append(np.tile(np.arange(1, n + 1), len(car_rows)))
+                    columns['dealer'].append(dealers[top].ravel())
+                    for name, score in (('match_score', total_score), ('make', make_score), ('model', model_score),
+                                        ('year', year_score), ('km', km_score)):
+                        columns[name].append(np.take_along_axis(score, top, axis=1).ravel())
+
+            self.matches = pd.DataFrame({
+                name: np.concatenate(parts) if parts else np.array([]) for name, parts in columns.items()
+            })
+            self.car_rows = self.matches.groupby('car', sort=False).indices
+
+            # One row per live car with its best buyer
+            best = self.matches[self.matches['rank'] == 1].set_index('car')
+            self.cars = live_cars[['sf_vehicle_name', 'make', 'model', 'year', 'kilometers']].reset_index(drop=True)
+            self.cars['candidate_dealers'] = candidates
+            self.cars['top_dealer'] = None
+            self.cars.loc[best.index, 'top_dealer'] = prefs.dealer_names[best['dealer'].to_numpy(dtype=np.int64)]
+            self.cars['top_score'] = best['match_score'].reindex(self.cars.index)
+
+        def buyers_for_car(self, car):
+            """Ranked likely buyers of the live car at position car, empty if no dealer bought its make."""
+            positions = self.car_rows.get(car)
+            if positions is None:
+                return pd.DataFrame()
+
+            matches = self.matches.iloc[positions]
+            dealers = matches['dealer'].to_numpy(dtype=np.int64)
+            return pd.DataFrame({
+                'rank': matches['rank'].to_numpy(dtype=np.int64),
+                'dealer_name': self.preferences.dealer_names[dealers],
+                'dealer_code': np.asarray(self.preferences.dealer_codes)[dealers],
+                'match_score': matches['match_score'].to_numpy(),
+                'score_breakdown': format_breakdowns(
+                    matches['make'], matches['model'], matches['year'], matches['km'])
+            })
+
+
+    # Rows shown per request list
+    REQUESTS_PER_LIST = 10
+
+    # Columns of each request list, keyed by request_status (None for all requests)
+    REQUEST_LIST_COLUMNS = {
+        None: ['dealer_code', 'vehicle_request_created_at', 'request_type', 'request_status',
+               'contacted_at', 'contacted_user', 'visited_at', 'visited_user', 'succeeded_at',
+               'failed_before_visit_at', 'failed_after_visit_at', 'failure_reason'],
+        'Succeeded': ['dealer_code', 'vehicle_request_created_at', 'request_type', 'contacted_at',
+                      'contacted_user', 'visited_at', 'visited_user', 'succeeded_at'],
+        'Failed Before Visit': ['dealer_code', 'vehicle_request_created_at', 'request_type', 'contacted_at',
+                                'contacted_user', 'failed_before_visit_at', 'failure_reason'],
+        'Failed After Visit': ['dealer_code', 'vehicle_request_created_at', 'request_type', 'contacted_at',
+                               'contacted_user', 'visited_at', 'visited_user', 'failed_after_visit_at',
+                               'failure_reason'],
+    }
+    REQUEST_CAR_COLUMNS = ['car_name', 'car_make', 'car_model', 'car_year', 'car_kilometrage',
+                           'buy_now_price', 'discounted_price']
+
+
+    def split_dealer_requests(requests_df):
+        """
+        Split the ranked rows of get_dealer_requests into the four request lists.
+        Args:
+            requests_df: Rows with all_rank and status_rank columns
+        Returns:
+            Tuple of all, succeeded, failed before visit and failed after visit requests
+        """
+        lists = []
+        for status, columns in REQUEST_LIST_COLUMNS.items():
+            if status is None:
+                mask = requests_df['all_rank'] <= REQUESTS_PER_LIST
+                order = 'all_rank'
+            else:
+                mask = (requests_df['request_status'] == status) & (requests_df['status_rank'] <= REQUESTS_PER_LIST)
+                order = 'status_rank'
+            lists.append(
+                requests_df[mask].sort_values(order)[columns + REQUEST_CAR_COLUMNS].reset_index(drop=True)
+            )
+        return tuple(lists)
 
-    def get_dealer_requests(client, dealer_code):
+
+    def get_dealer_requests(client, dealer_code, version=None, cache=None, session_id=None):
         """
-        Get dealer requests data for a specific dealer.
+        Get dealer requests data for a specific dealer, cached per data version.
         Returns four dataframes: all requests, succeeded, failed before visit, and failed after visit requests.
+        The latest requests overall and per status are ranked in one query and split locally.
+        The session opening the profile is recorded with the job statistics.
         """
-        # Query for all requests
-        all_requests_query = """
+        requests_query = """
         SELECT 
             dealer_code,
             vehicle_request_created_at,
@@ -938,131 +2294,287 @@ ORDER BY total_requests_lifetime DESC NULLS LAST;
             car_year,
             car_kilometrage,
             buy_now_price,
-            discounted_price
+            discounted_price,
+            ROW_NUMBER() OVER (ORDER BY vehicle_request_created_at DESC) AS all_rank,
+            ROW_NUMBER() OVER (
+                PARTITION BY request_status ORDER BY vehicle_request_created_at DESC
+            ) AS status_rank
         FROM `pricing-338819.ajans_dealers.dealer_requests` 
         WHERE dealer_code = @dealer_id 
-        ORDER BY vehicle_request_created_at DESC
-        LIMIT 10
+        QUALIFY all_rank <= @per_list
+            OR (request_status IN ('Succeeded', 'Failed Before Visit', 'Failed After Visit')
+                AND status_rank <= @per_list)
         """
 
-        # Query for succeeded requests
-        succeeded_query = """
-        SELECT 
-            dealer_code,
-            vehicle_request_created_at,
-            request_type,
-            contacted_at,
-            contacted_user,
-            visited_at,
-            visited_user,
-            succeeded_at,
-            car_name,
-            car_make,
-            car_model,
-            car_year,
-            car_kilometrage,
-            buy_now_price,
-            discounted_price
-        FROM `pricing-338819.ajans_dealers.dealer_requests` 
-        WHERE dealer_code = @dealer_id 
-        AND request_status = 'Succeeded'
-        ORDER BY vehicle_request_created_at DESC
-        LIMIT 10
-        """
-
-        # Query for failed before visit requests
-        failed_before_query = """
-        SELECT 
-            dealer_code,
-            vehicle_request_created_at,
-            request_type,
-            contacted_at,
-            contacted_user,
-            failed_before_visit_at,
-            failure_reason,
-            car_name,
-            car_make,
-            car_model,
-            car_year,
-            car_kilometrage,
-            buy_now_price,
-            discounted_price
-        FROM `pricing-338819.ajans_dealers.dealer_requests` 
-        WHERE dealer_code = @dealer_id 
-        AND request_status = 'Failed Before Visit'
-        ORDER BY vehicle_request_created_at DESC
-        LIMIT 10
-        """
-
-        # Query for failed after visit requests
-        failed_after_query = """
-        SELECT 
-            dealer_code,
-            vehicle_request_created_at,
-            request_type,
-            contacted_at,
-            contacted_user,
-            visited_at,
-            visited_user,
-            failed_after_visit_at,
-            failure_reason,
-            car_name,
-            car_make,
-            car_model,
-            car_year,
-            car_kilometrage,
-            buy_now_price,
-            discounted_price
-        FROM `pricing-338819.ajans_dealers.dealer_requests` 
-        WHERE dealer_code = @dealer_id 
-        AND request_status = 'Failed After Visit'
-        ORDER BY vehicle_request_created_at DESC
-        LIMIT 10
-        """
+        from google.cloud import bigquery
 
+        job_stats = get_job_stats_store()
         job_config = bigquery.QueryJobConfig(
             query_parameters=[
-                bigquery.ScalarQueryParameter("dealer_id", "STRING", dealer_code)
+                bigquery.ScalarQueryParameter("dealer_id", "STRING", dealer_code),
+                bigquery.ScalarQueryParameter("per_list", "INT64", REQUESTS_PER_LIST)
             ]
         )
 
-        try:
-            all_requests_df = client.query(all_requests_query, job_config=job_config).to_dataframe()
-            succeeded_df = client.query(succeeded_query, job_config=job_config).to_dataframe()
-            failed_before_df = client.query(failed_before_query, job_config=job_config).to_dataframe()
-            failed_after_df = client.query(failed_after_query, job_config=job_config).to_dataframe()
+        def fetch():
+            with span("query.dealer_requests", dealer_code=dealer_code):
+                job = client.query(requests_query, job_config=job_config)
+                df = job.to_dataframe()
+            job_stats.record(job, 'dealer_requests', dealer_code=dealer_code, session_id=session_id, rows=len(df))
 
             # Format datetime columns
             datetime_columns = ['vehicle_request_created_at', 'contacted_at', 'visited_at',
                                 'succeeded_at', 'failed_before_visit_at', 'failed_after_visit_at']
-
-            for df in [all_requests_df, succeeded_df, failed_before_df, failed_after_df]:
-                for col in datetime_columns:
-                    if col in df.columns:
-                        df[col] = pd.to_datetime(df[col]).dt.strftime('%Y-%m-%d %H:%M:%S')
+            for col in datetime_columns:
+                df[col] = pd.to_datetime(df[col]).dt.strftime('%Y-%m-%d %H:%M:%S')
 
             # Format price columns
-            if 'buy_now_price' in df.columns:
-                df['buy_now_price'] = df['buy_now_price'].apply(
-                    lambda x: f"EGP {x:,.0f}" if pd.notnull(x) else "N/A"
-                )
-            if 'discounted_price' in df.columns:
-                df['discounted_price'] = df['discounted_price'].apply(
+            for col in ['buy_now_price', 'discounted_price']:
+                df[col] = df[col].apply(
                     lambda x: f"EGP {x:,.0f}" if pd.notnull(x) else "N/A"
                 )
 
             # Format kilometrage
-            if 'car_kilometrage' in df.columns:
-                df['car_kilometrage'] = df['car_kilometrage'].apply(
-                    lambda x: f"{x:,.0f} km" if pd.notnull(x) else "N/A"
-                )
+            df['car_kilometrage'] = df['car_kilometrage'].apply(
+                lambda x: f"{x:,.0f} km" if pd.notnull(x) else "N/A"
+            )
 
-            return all_requests_df, succeeded_df, failed_before_df, failed_after_df
+            return split_dealer_requests(df)
+
+        try:
+            with span("dealer_requests", dealer_code=dealer_code):
+                return cached_dealer_lookup('requests', dealer_code, version, fetch, cache)
         except Exception as e:
             print(f"Error executing query: {e}")
             return pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
 
 
+    # Worker threads fetching the remote sections of dealer profiles
+    PROFILE_FETCH_WORKERS = 8
+
+
+    @st.cache_resource
+    def get_profile_executor():
+        """Worker pool for the remote profile sections, shared by all sessions of this process."""
+        return ThreadPoolExecutor(max_workers=PROFILE_FETCH_WORKERS, thread_name_prefix="profile")
+
+
+    def start_profile_fetches(dealer_code, version):
+        """
+        Start fetching a dealer's request lists on the profile worker pool.
+        The client, cache and session are resolved here, since the workers have no script context.
+        Returns:
+            Dict of futures keyed by section, or None if no credentials are configured
+        """
+        client = get_bigquery_client()
+        if client is None:
+            return None
+
+        cache = get_dealer_lookup_cache()
+        executor = get_profile_executor()
+        return {
+            'requests': executor.submit(
+                get_dealer_requests, client, dealer_code, version, cache, current_session_id()
+            )
+        }
+
+
+    @st.fragment
+    def render_dealer_requests(all_requests, succeeded_requests, failed_before_requests, failed_after_requests):
+        """Render the four request lists of a dealer as tabs."""
+        # Create tabs for different request types
+        req_tab1, req_tab2, req_tab3, req_tab4 = st.tabs([
+            "📋 All Requests",
+            "✅ Succeeded Requests",
+            "❌ Failed Before Visit",
+            "⚠️ Failed After Visit"
+        ])
+
+        with req_tab1:
+            if not all_requests.empty:
+                st.dataframe(
+                    all_requests,
+                    column_config={
+                        "vehicle_request_created_at": "Request Date",
+                        "request_type": "Request Type",
+                        "request_status": "Status",
+                        "contacted_at": "Contacted At",
+                        "contacted_user": "Contacted By",
+                        "visited_at": "Visit Date",
+                        "visited_user": "Visited By",
+                        "succeeded_at": "Success Date",
+                        "failed_before_visit_at": "Failed Before Visit At",
+                        "failed_after_visit_at": "Failed After Visit At",
+                        "failure_reason": "Failure Reason",
+                        "car_name": "Car Name",
+                        "car_make": "Make",
+                        "car_model": "Model",
+                        "car_year": "Year",
+                        "car_kilometrage": "Mileage",
+                        "buy_now_price": "Buy Now Price",
+                        "discounted_price": "Discounted Price"
+                    },
+                    use_container_width=True
+                )
+            else:
+                st.info("No requests found")
+
+        with req_tab2:
+            if not succeeded_requests.empty:
+                st.dataframe(
+                    succeeded_requests,
+                    column_config={
+                        "vehicle_request_created_at": "Request Date",
+                        "request_type": "Request Type",
+                        "contacted_at": "Contacted At",
+                        "contacted_user": "Contacted By",
+                        "visited_at": "Visit Date",
+                        "visited_user": "Visited By",
+                        "succeeded_at": "Success Date",
+                        "car_name": "Car Name",
+                        "car_make": "Make",
+                        "car_model": "Model",
+                        "car_year": "Year",
+                        "car_kilometrage": "Mileage",
+                        "buy_now_price": "Buy Now Price",
+                        "discounted_price": "Discounted Price"
+                    },
+                    use_container_width=True
+                )
+            else:
+                st.info("No successful requests found")
+
+        with req_tab3:
+            if not failed_before_requests.empty:
+                st.dataframe(
+                    failed_before_requests,
+                    column_config={
+                        "vehicle_request_created_at": "Request Date",
+                        "request_type": "Request Type",
+                        "contacted_at": "Contacted At",
+                        "contacted_user": "Contacted By",
+                        "failed_before_visit_at": "Failed At",
+                        "failure_reason": "Failure Reason",
+                        "car_name": "Car Name",
+                        "car_make": "Make",
+                        "car_model": "Model",
+                        "car_year": "Year",
+                        "car_kilometrage": "Mileage",
+                        "buy_now_price": "Buy Now Price",
+                        "discounted_price": "Discounted Price"
+                    },
+                    use_container_width=True
+                )
+            else:
+                st.info("No requests failed before visit")
+
+        with req_tab4:
+            if not failed_after_requests.empty:
+                st.dataframe(
+                    failed_after_requests,
+                    column_config={
+                        "vehicle_request_created_at": "Request Date",
+                        "request_type": "Request Type",
+                        "contacted_at": "Contacted At",
+                        "contacted_user": "Contacted By",
+                        "visited_at": "Visit Date",
+                        "visited_user": "Visited By",
+                        "failed_after_visit_at": "Failed At",
+                        "failure_reason": "Failure Reason",
+                        "car_name": "Car Name",
+                        "car_make": "Make",
+                        "car_model": "Model",
+                        "car_year": "Year",
+                        "car_kilometrage": "Mileage",
+                        "buy_now_price": "Buy Now Price",
+                        "discounted_price": "Discounted Price"
+                    },
+                    use_container_width=True
+                )
+            else:
+                st.info("No requests failed after visit")
+
+
+    @st.fragment
+    def render_olx_listings(olx_listings):
+        """Render a dealer's OLX listings with summary metrics."""
+        if not olx_listings.empty:
+            # Format the dataframe for display
+            display_df = olx_listings[[
+                'added_at', 'title', 'make', 'model', 'year', 'kilometers',
+                'price', 'condition', 'is_active', 'region'
+            ]].copy()
+
+            # Format date columns
+            display_df['added_at'] = pd.to_datetime(display_df['added_at']).dt.strftime(
+                '%Y-%m-%d %H:%M')
+
+            # Format price
+            display_df['price'] = display_df['price'].apply(
+                lambda x: f"{x:,.0f} EGP" if pd.notnull(x) else "N/A"
+            )
+
+            st.dataframe(
+                display_df,
+                column_config={
+                    "added_at": "Listed Date",
+                    "title": "Title",
+                    "make": "Make",
+                    "model": "Model",
+                    "year": "Year",
+                    "kilometers": "Mileage",
+                    "price": "Price",
+                    "condition": "Condition",
+                    "is_active": "Active",
+                    "region": "Region"
+                },
+                use_container_width=True
+            )
+
+            # Add summary metrics
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                active_listings = int(olx_listings['is_active'].sum())
+                st.metric("Active Listings", active_listings)
+            with col2:
+                avg_price = olx_listings['price'].mean()
+                st.metric("Average Price", f"{avg_price:,.0f} EGP")
+            with col3:
+                unique_models = len(olx_listings[['make', 'model']].drop_duplicates())
+                st.metric("Unique Models", unique_models)
+        else:
+            st.info("No OLX listings found for this dealer in the last 30 days")
+
+
+    def fill_remote_sections(fetches, placeholders):
+        """
+        Render each remote profile section into its placeholder as soon as its fetch completes.
+        The renderers are fragments, so their reruns redraw the fetched result instead of fetching again.
+        Args:
+            fetches: Futures from start_profile_fetches, or None without credentials
+            placeholders: st.empty placeholders keyed like fetches
+        """
+        if fetches is None:
+            for placeholder in placeholders.values():
+                placeholder.error("No credentials found for BigQuery access")
+            return
+
+        renderers = {
+            'requests': lambda result: render_dealer_requests(*result)
+        }
+        errors = {
+            'requests': "Error fetching dealer requests"
+        }
+        sections = {future: name for name, future in fetches.items()}
+        for future in as_completed(sections):
+            name = sections[future]
+            with placeholders[name].container():
+                try:
+                    renderers[name](future.result())
+                except Exception as e:
+                    st.error(f"{errors[name]}: {str(e)}")
+
+
     @st.dialog("Makes Distribution Analysis")
     def show_makes_analysis(all_makes):
         st.write("**Makes Distribution:**")
@@ -1102,23 +2614,695 @@ ORDER BY total_requests_lifetime DESC NULLS LAST;
             st.write(f"• {p}th percentile: EGP {value:,.0f}")
 
 
+    # Dealers per page of the Attention Inbox
+    INBOX_PAGE_SIZE = 50
+
+    # Inbox sort orders: columns and ascending flags, applied to the priority-sorted dealers
+    INBOX_SORTS = {
+        "Priority": ([], []),
+        "Activity Drop": (['activity_drop'], [False]),
+        "30-day Requests": (['buy_requests_30d'], [False]),
+        "Dealer Name": (['dealer_name'], [True])
+    }
+
+
+    def filter_attention_dealers(attention_dealers, statuses, search, sort_by):
+        """
+        Filter and sort the inbox on the server.
+        Args:
+            attention_dealers: Dealers from get_dealers_needing_attention(), in priority order
+            statuses: Priority levels to keep
+            search: Case-insensitive text to find in the dealer name or code
+            sort_by: Key of INBOX_SORTS
+        Returns:
+            The matching dealers in the requested order
+        """
+        mask = attention_dealers['status'].isin(statuses)
+        if search:
+            mask &= (
+                attention_dealers['dealer_name'].astype(str).str.contains(search, case=False, regex=False) |
+                attention_dealers['dealer_code'].astype(str).str.contains(search, case=False, regex=False)
+            )
+        dealers = attention_dealers[mask]
+
+        columns, ascending = INBOX_SORTS[sort_by]
+        if columns:
+            # Categories are in first-appearance order, so sort categorical columns by their values
+            dealers = dealers.sort_values(
+                columns, ascending=ascending, kind='stable',
+                key=lambda values: values.astype(str) if values.dtype == 'category' else values
+            )
+        return dealers
+
+
+    def show_inbox_table(page_dealers, key):
+        """
+        Show one page of the inbox as a single table with row selection.
+        Returns:
+            The dealer name of the selected row, or None
+        """
+        event = st.dataframe(
+            page_dealers[['status', 'dealer_name', 'dealer_code', 'current_segmentation',
+                          'avg_requests_per_month_lifetime', 'avg_requests_per_month_60d', 'activity_drop',
+                          'buy_requests_30d', 'sold_cars_30d']],
+            column_config={
+                "status": "Priority",
+                "dealer_name": "Dealer",
+                "dealer_code": "Dealer Code",
+                "current_segmentation": "Segmentation",
+                "avg_requests_per_month_lifetime": st.column_config.NumberColumn("Lifetime Monthly Requests", format="%.1f"),
+                "avg_requests_per_month_60d": st.column_config.NumberColumn("Recent Monthly Requests", format="%.1f"),
+                "activity_drop": st.column_config.NumberColumn("Activity Drop", format="%.1f"),
+                "buy_requests_30d": "30-day Requests",
+                "sold_cars_30d": "30-day Purchases"
+            },
+            hide_index=True,
+            use_container_width=True,
+            on_select="rerun",
+            selection_mode="single-row",
+            key=key
+        )
+        st.caption("Select a row to open the dealer's profile")
+
+        rows = event.selection.rows
+        return page_dealers['dealer_name'].iloc[rows[0]] if rows else None
+
+
+    def show_inbox_cards(page_dealers):
+        """
+        Show one page of the inbox as expandable cards.
+        Returns:
+            The dealer name whose profile button was clicked, or None
+        """
+        selected_dealer = None
+        for _, dealer in page_dealers.iterrows():
+            with st.expander(
+                    f"{dealer['status']} - {dealer['dealer_name']}"
+            ):
+                col1, col2 = st.columns([2, 1])
+
+                with col1:
+                    st.write("**Activity Metrics:**")
+                    st.write(f"• Lifetime Monthly Requests: {dealer['avg_requests_per_month_lifetime']:.1f}")
+                    st.write(f"• Recent Monthly Requests: {dealer['avg_requests_per_month_60d']:.1f}")
+                    st.write(f"• Activity Drop: {dealer['activity_drop']:.1f} requests/month")
+
+                with col2:
+                    st.write("**Recent Activity:**")
+                    st.write(f"• 30-day Requests: {dealer['buy_requests_30d']}")
+                    st.write(f"• 30-day Purchases: {dealer['sold_cars_30d']}")
+
+                # Add navigation button
+                if st.button("👤 View Full Profile", key=f"view_profile_{dealer['dealer_name']}"):
+                    selected_dealer = dealer['dealer_name']
+        return selected_dealer
+
+
+    # Live cars per page of the inventory matches view
+    INVENTORY_PAGE_SIZE = 50
+
+
+    @st.fragment
+    def show_inventory_matches(buyers):
+        """Every live car with its most likely buyers, one page at a time."""
+        cars = buyers.cars
+        if cars.empty:
+            st.info("No live cars available")
+            return
+
+        col1, col2 = st.columns(2)
+        with col1:
+            makes = ["All Makes"] + sorted(cars['make'].dropna().astype(str).unique())
+            make = st.selectbox("Make", makes, key="inventory_make")
+        filtered = cars if make == "All Makes" else cars[cars['make'] == make]
+        filtered = filtered.sort_values('top_score', ascending=False, na_position='last', kind='stable')
+
+        pages = max(1, -(-len(filtered) // INVENTORY_PAGE_SIZE))
+        with col2:
+            page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1,
+                                   key=f"inventory_page_{make}")
+        page_cars = filtered.iloc[(page - 1) * INVENTORY_PAGE_SIZE:page * INVENTORY_PAGE_SIZE]
+        st.caption(f"{len(filtered)} live cars, best matches first")
+
+        st.dataframe(
+            page_cars,
+            column_config={
+                "sf_vehicle_name": "Vehicle",
+                "make": "Make",
+                "model": "Model",
+                "year": "Year",
+                "kilometers": st.column_config.NumberColumn("Mileage", format="%d km"),
+                "candidate_dealers": "Dealers Buying Make",
+                "top_dealer": "Most Likely Buyer",
+                "top_score": st.column_config.ProgressColumn(
+                    "Best Match Score", format="%.1f", min_value=0, max_value=9
+                )
+            },
+            hide_index=True,
+            use_container_width=True
+        )
+
+        car = st.selectbox(
+            "Likely buyers of",
+            page_cars.index,
+            format_func=lambda i: f"{cars.at[i, 'sf_vehicle_name']} - {cars.at[i, 'make']} {cars.at[i, 'model']}",
+            key="inventory_car"
+        )
+        matches = buyers.buyers_for_car(car)
+        if matches.empty:
+            st.info("No dealer has bought this make yet")
+        else:
+            st.dataframe(
+                matches,
+                column_config={
+                    "rank": "Rank",
+                    "dealer_name": "Dealer",
+                    "dealer_code": "Dealer Code",
+                    "match_score": st.column_config.ProgressColumn(
+                        "Match Score", format="%.1f", min_value=0, max_value=9
+                    ),
+                    "score_breakdown": "Score Breakdown"
+                },
+                hide_index=True,
+                use_container_width=True
+            )
+
+
+    @st.fragment
+    def show_attention_inbox(attention_dealers):
+        """
+        Filters, pages and the dealer list of the inbox. Changing them reruns only this section;
+        opening a dealer reruns the app.
+        """
+        # Filter, sort and page on the server; only the visible page is sent to the browser
+        filter_col1, filter_col2, filter_col3, filter_col4 = st.columns([2, 2, 1, 1])
+        with filter_col1:
+            statuses = st.multiselect("Priority", PRIORITY_LEVELS, default=PRIORITY_LEVELS, key="inbox_status")
+        with filter_col2:
+            search = st.text_input("Search dealer name or code", key="inbox_search")
+        with filter_col3:
+            sort_by = st.selectbox("Sort by", list(INBOX_SORTS), key="inbox_sort")
+        with filter_col4:
+            inbox_view = st.radio("View", ["Table", "Cards"], horizontal=True, key="inbox_view")
+
+        with span("inbox_filter"):
+            inbox_dealers = filter_attention_dealers(attention_dealers, statuses, search, sort_by)
+        pages = max(1, -(-len(inbox_dealers) // INBOX_PAGE_SIZE))
+        # The page lives in Session State only, so it can be clamped when the filters shrink the list
+        st.session_state.setdefault('inbox_page', 1)
+        if st.session_state['inbox_page'] > pages:
+            st.session_state['inbox_page'] = pages
+        page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, key="inbox_page")
+        page_dealers = inbox_dealers.iloc[(page - 1) * INBOX_PAGE_SIZE:page * INBOX_PAGE_SIZE]
+        st.caption(f"{len(inbox_dealers)} of {len(attention_dealers)} dealers")
+
+        # Warm the recent activity cache for the dealers on screen
+        if LAZY_RECENT_ACTIVITY and PREFETCH_ATTENTION_DEALERS:
+            prefetch_dealer_activity(page_dealers['dealer_code'].head(PREFETCH_ATTENTION_DEALERS))
+
+        if inbox_view == "Table":
+            selected_dealer = show_inbox_table(page_dealers, key=f"inbox_table_{page}_{sort_by}_{search}_{statuses}")
+            # A table selection persists across reruns; only act when it changes
+            if selected_dealer == st.session_state.get('inbox_selected'):
+                selected_dealer = None
+            else:
+                st.session_state['inbox_selected'] = selected_dealer
+        else:
+            selected_dealer = show_inbox_cards(page_dealers)
+
+        # Open the selected dealer's profile
+        if selected_dealer is not None:
+            st.query_params["dealer"] = selected_dealer
+            st.query_params["tab"] = "Dealer Profile"
+            st.rerun()
+
+
+    @st.fragment
+    def show_dealer_picker(valid_dealers_df):
+        """
+        Dealer selection for the sidebar. Fragments cannot write to st.sidebar, so call this inside `with st.sidebar:`.
+        Switching the search method reruns only the picker; picking another dealer reruns the app.
+        Args:
+            valid_dealers_df: Unique dealer names and codes
+        Returns:
+            The selected dealer code and name
+        """
+        full_run = st.session_state.pop('profile_full_run', False)
+        st.header("Filters")
+
+        # Add search method selection
+        search_method = st.radio(
+            "Search by",
+            ["Dealer Name", "Dealer Code"]
+        )
+
+        # The URL holds the open dealer, whether it came from the inbox or from here
+        default_dealer = st.query_params.get('dealer', None)
+
+        if search_method == "Dealer Name":
+            # Sort dealers by name
+            valid_dealers = sorted(valid_dealers_df['dealer_name'].unique())
+            default_index = valid_dealers.index(default_dealer) if default_dealer in valid_dealers else 0
+
+            # Dealer selection
+            selected_dealer_name = st.selectbox(
+                "Select Dealer",
+                options=valid_dealers,
+                index=default_index
+            )
+            # Get corresponding dealer code
+            selected_dealer_code = \
+            valid_dealers_df[valid_dealers_df['dealer_name'] == selected_dealer_name]['dealer_code'].iloc[0]
+        else:
+            # Sort dealers by code
+            valid_dealer_codes = sorted(valid_dealers_df['dealer_code'].unique())
+            default_codes = valid_dealers_df[valid_dealers_df['dealer_name'] == default_dealer]['dealer_code']
+            default_index = valid_dealer_codes.index(default_codes.iloc[0]) if not default_codes.empty else 0
+
+            selected_dealer_code = st.selectbox(
+                "Select Dealer Code",
+                options=valid_dealer_codes,
+                index=default_index
+            )
+            # Get corresponding dealer name
+            selected_dealer_name = \
+            valid_dealers_df[valid_dealers_df['dealer_code'] == selected_dealer_code]['dealer_name'].iloc[0]
+
+        # Display selected dealer info
+        st.info(f"Selected Dealer: {selected_dealer_name}\nDealer Code: {selected_dealer_code}")
+
+        if st.query_params.get('dealer') != selected_dealer_name:
+            st.query_params['dealer'] = selected_dealer_name
+            # A picker rerun has only redrawn the sidebar; the profile needs the whole app
+            if not full_run:
+                st.rerun()
+        return selected_dealer_code, selected_dealer_name
+
+
+    @st.fragment
+    def show_profile_metrics(dealer_activity, dealer_historical):
+        """Key metrics of a dealer; the analysis buttons rerun only this section."""
+        # Initialize metrics variables
+        top_makes_str = "No data"
+        top_models_str = "No data"
+        top_mileage_str = "No data"
+        price_range = "No data"
+
+        # Get historical purchase patterns
+        if not dealer_historical.empty:
+            dealer_historical = dealer_historical.copy()
+
+            # Calculate top makes
+            top_makes = dealer_historical['make'].value_counts().head(3)
+            top_makes_str = ", ".join([f"{make} ({count})" for make, count in top_makes.items()])
+            all_makes = dealer_historical['make'].value_counts()
+
+            # Calculate top models
+            top_models = dealer_historical.groupby(['make', 'model'], observed=True).size().sort_values(ascending=False).head(3)
+            top_models_str = ", ".join([f"{make} {model} ({count})" for (make, model), count in top_models.items()])
+            all_models = dealer_historical.groupby(['make', 'model'], observed=True).size().sort_values(ascending=False)
+
+            # Calculate mileage ranges
+            dealer_historical['mileage_range'] = pd.cut(
+                dealer_historical['kilometers'],
+                bins=[0, 50000, 100000, 150000, float('inf')],
+                labels=['0-50K', '50K-100K', '100K-150K', '150K+']
+            )
+            top_mileage = dealer_historical['mileage_range'].value_counts().head(2)
+            top_mileage_str = ", ".join([f"{range_} ({count})" for range_, count in top_mileage.items()])
+            all_mileage = dealer_historical['mileage_range'].value_counts()
+
+            # Calculate average price range
+            avg_price = dealer_historical['price'].mean()
+            price_std = dealer_historical['price'].std()
+            price_range = f"EGP {(avg_price - price_std):,.0f} - {(avg_price + price_std):,.0f}"
+
+            # Calculate detailed price statistics
+            price_stats = {
+                'Average Price': f"EGP {avg_price:,.0f}",
+                'Minimum Price': f"EGP {dealer_historical['price'].min():,.0f}",
+                'Maximum Price': f"EGP {dealer_historical['price'].max():,.0f}",
+                'Median Price': f"EGP {dealer_historical['price'].median():,.0f}",
+                'Price Range (±1 std)': price_range
+            }
+
+        # Key metrics
+        col1, col2, col3, col4 = st.columns(4)
+
+        with col1:
+            st.metric("Active Days (30d)", int(dealer_activity['active_days_30d']))
+            st.metric("Car Events (30d)", int(dealer_activity['total_car_events_30d']))
+
+        with col2:
+            st.metric("Active Days (7d)", int(dealer_activity['active_days_7d']))
+            st.metric("Car Events (7d)", int(dealer_activity['total_car_events_7d']))
+
+        with col3:
+            st.metric("Top Makes", len(all_makes) if not dealer_historical.empty else "No data")
+            if not dealer_historical.empty and st.button("Top Makes Analysis", key="show_makes"):
+                show_makes_analysis(all_makes)
+
+            st.metric("Preferred Mileage", len(all_mileage) if not dealer_historical.empty else "No data")
+            if not dealer_historical.empty and st.button("Mileage Analysis", key="show_mileage"):
+                show_mileage_analysis(all_mileage)
+
+        with col4:
+            st.metric("Top Models", len(all_models) if not dealer_historical.empty else "No data")
+            if not dealer_historical.empty and st.button("Models Analysis", key="show_models"):
+                show_models_analysis(all_models)
+
+            st.metric("Price Analysis", "View" if not dealer_historical.empty else "No data")
+            if not dealer_historical.empty and st.button("Price Analysis", key="show_price"):
+                show_price_analysis(dealer_historical, price_stats)
+
+
+    @st.fragment
+    def show_profile_segmentation(dealer_info):
+        """Lifetime and 60-day segments of a dealer."""
+        st.subheader("Dealer Segmentation")
+
+        seg_col1, seg_col2 = st.columns(2)
+
+        with seg_col1:
+            st.info(f"Lifetime Segment: {dealer_info['final_bucket_lifetime']}")
+            st.info(f"60-Day Segment: {dealer_info['final_bucket_60d']}")
+
+        with seg_col2:
+            st.info(f"Request Activity (Lifetime): {dealer_info['request_activity_bucket_lifetime']}")
+            st.info(f"Request Activity (60d): {dealer_info['request_activity_bucket_60d']}")
+
+
+    @st.fragment
+    def show_recent_activity(dealer_index, dealer_code):
+        """Recent car views and filters of a dealer."""
+        st.subheader("Recent Activity")
+
+        # Get dealer's recent views and filters
+        with span("recent_activity", dealer_code=dealer_code):
+            if LAZY_RECENT_ACTIVITY:
+                dealer_views, dealer_filters = get_dealer_activity(dealer_code)
+            else:
+                dealer_views = dealer_index.rows('recent_views', dealer_code).copy()
+                dealer_filters = dealer_index.rows('recent_filters', dealer_code).copy()
+
+        # Create tabs for views and filters
+        recent_tab1, recent_tab2 = st.tabs(["🔍 Recent Views", "🎯 Recent Filters"])
+
+        with recent_tab1:
+            if not dealer_views.empty:
+                # Format the time column
+                dealer_views['time'] = pd.to_datetime(dealer_views['time']).dt.strftime('%Y-%m-%d %H:%M:%S')
+
+                # Format the price column
+                dealer_views['buy_now_price'] = dealer_views['buy_now_price'].apply(
+                    lambda x: f"EGP {x:,.0f}" if pd.notnull(x) else "N/A"
+                )
+
+                # Format the kilometrage column
+                dealer_views['kilometrage'] = dealer_views['kilometrage'].apply(
+                    lambda x: f"{x:,.0f} km" if pd.notnull(x) else "N/A"
+                )
+
+                # Display recent views
+                st.dataframe(
+                    dealer_views[['time', 'make', 'model', 'trim', 'year', 'kilometrage',
+                                  'transmission', 'buy_now_price', 'body_style']],
+                    column_config={
+                        "time": "Viewed At",
+                        "make": "Make",
+                        "model": "Model",
+                        "trim": "Trim",
+                        "year": "Year",
+                        "kilometrage": "Mileage",
+                        "transmission": "Transmission",
+                        "buy_now_price": "Price",
+                        "body_style": "Body Style"
+                    },
+                    use_container_width=True
+                )
+            else:
+                st.info("No recent car views found for this dealer")
+
+        with recent_tab2:
+            if not dealer_filters.empty:
+                # Format the time column
+                dealer_filters['time'] = pd.to_datetime(dealer_filters['time']).dt.strftime('%Y-%m-%d %H:%M:%S')
+
+                # Format the kilometrage column
+                dealer_filters['kilometrage'] = dealer_filters['kilometrage'].apply(
+                    lambda x: f"{x:,.0f} km" if pd.notnull(x) else "N/A"
+                )
+
+                # Display recent filters
+                st.dataframe(
+                    dealer_filters[['time', 'make', 'model', 'year', 'kilometrage',
+                                    'group_filter', 'status', 'no_of_cars']],
+                    column_config={
+                        "time": "Filter Applied At",
+                        "make": "Make",
+                        "model": "Model",
+                        "year": "Year",
+                        "kilometrage": "Mileage Range",
+                        "group_filter": "Filter Group",
+                        "status": "Status",
+                        "no_of_cars": st.column_config.NumberColumn(
+                            "Number of Cars",
+                            help="Number of cars matching the filter criteria"
+                        )
+                    },
+                    use_container_width=True
+                )
+            else:
+                st.info("No recent filter applications found for this dealer")
+
+
+    @st.fragment
+    def show_recommended_cars(recommendations, dealer_code, has_history):
+        """Best matching live cars for a dealer."""
+        st.subheader("Recommended Cars")
+
+        if has_history:
+            with span("recommendations", dealer_code=dealer_code):
+                recommended_cars = recommendations.for_dealer(dealer_code)
+
+            if not recommended_cars.empty:
+                st.dataframe(
+                    recommended_cars,
+                    column_config={
+                        "match_score": st.column_config.ProgressColumn(
+                            "Match Score",
+                            help="How well this car matches the dealer's preferences (max 9 points)",
+                            format="%.1f",
+                            min_value=0,
+                            max_value=9
+                        ),
+                        "score_breakdown": "Score Breakdown",
+                        "sf_vehicle_name": "Vehicle",
+                        "make": "Make",
+                        "model": "Model",
+                        "year": "Year",
+                        "kilometers": st.column_config.NumberColumn(
+                            "Mileage",
+                            format="%d km"
+                        )
+                    },
+                    use_container_width=True
+                )
+
+                # Add explanation of scoring system
+                st.info("""
+                **Scoring System:**
+                - Make: 0-3 points (based on frequency of purchases)
+                - Model: 0-2 points (based on frequency within make)
+                - Year: 0-2 points (based on preferred year ranges)
+                - Mileage: 0-2 points (based on preferred km ranges)
+                Total possible score: 9 points
+                """)
+            else:
+                st.info("No matching cars found in current inventory")
+        else:
+            st.info("Cannot generate recommendations without historical data")
+
+
+    @st.fragment
+    def show_purchase_charts(dealer_historical):
+        """Charts of a dealer's historical purchases."""
+        st.subheader("Historical Purchase Analysis")
+
+        if not dealer_historical.empty:
+            import plotly.express as px
+
+            # Clean the data for visualization
+            dealer_historical = dealer_historical.copy()
+            dealer_historical['kilometers'] = dealer_historical['kilometers'].fillna(
+                dealer_historical['kilometers'].mean())
+
+            # Create tabs for different visualizations
+            hist_tab1, hist_tab2, hist_tab3 = st.tabs(
+                ["Purchase Timeline", "Price Distribution", "Make Distribution"])
+
+            with hist_tab1:
+                # Create time series of purchases with better handling of missing values
+                with span("charts.timeline"):
+                    fig = px.scatter(dealer_historical,
+                                     x='request_date',
+                                     y='price',
+                                     color='make',
+                                     size='kilometers',
+                                     hover_data=['model', 'year'],
+                                     title='Historical Purchases Over Time',
+                                     size_max=30)  # Limit maximum bubble size
+
+                    # Customize the layout
+                    fig.update_layout(
+                        xaxis_title="Request Date",
+                        yaxis_title="Price (EGP)",
+                        showlegend=True
+                    )
+                st.plotly_chart(fig, use_container_width=True)
+
+            with hist_tab2:
+                # Price distribution by make
+                with span("charts.price"):
+                    fig = px.box(dealer_historical,
+                                 x='make',
+                                 y='price',
+                                 title='Price Distribution by Make',
+                                 points="all")  # Show all points
+                st.plotly_chart(fig, use_container_width=True)
+
+            with hist_tab3:
+                # Make distribution
+                with span("charts.makes"):
+                    make_counts = dealer_historical['make'].value_counts()
+                    fig = px.pie(values=make_counts.values,
+                                 names=make_counts.index,
+                                 title='Distribution of Makes in Historical Purchases')
+                st.plotly_chart(fig, use_container_width=True)
+
+        else:
+            st.warning("No historical purchase data available for this dealer")
+
+
+    @st.fragment
+    def show_performance_panel():
+        """Span percentiles, client and cache counters and the latest spans of this process, for the admin user."""
+        recorder = get_span_recorder()
+
+        # Either button reruns only this panel, with fresh percentiles
+        col1, col2 = st.columns([4, 1])
+        with col1:
+            st.caption(f"Latest {SPAN_HISTORY} spans of each stage in this process, in milliseconds")
+        with col2:
+            st.button("🔄 Refresh", key="refresh_spans")
+            if st.button("Reset", key="reset_spans"):
+                recorder.reset()
+
+        show_client_metrics()
+        show_cache_metrics()
+
+        stats = recorder.percentiles()
+        if stats.empty:
+            st.info("No spans recorded yet")
+            return
+
+        st.dataframe(
+            stats,
+            column_config={
+                "stage": "Stage",
+                "count": "Spans",
+                "p50": st.column_config.NumberColumn("p50", format="%.1f"),
+                "p95": st.column_config.NumberColumn("p95", format="%.1f"),
+                "p99": st.column_config.NumberColumn("p99", format="%.1f"),
+                "max": st.column_config.NumberColumn("Max", format="%.1f")
+            },
+            hide_index=True,
+            use_container_width=True
+        )
+
+        st.subheader("Latest Spans")
+        st.dataframe(recorder.recent_spans().head(100), hide_index=True, use_container_width=True)
+
+
+    @st.fragment
+    def show_query_costs():
+        """Most expensive BigQuery queries per day and per dealer profile, from the job statistics store."""
+        st.subheader("💰 Query Costs")
+        days = st.number_input("Days", min_value=1, max_value=90, value=JOB_STATS_REPORT_DAYS, key="job_stats_days")
+        job_stats = get_job_stats_store()
+
+        daily = job_stats.daily_report(days)
+        if daily.empty:
+            st.info("No BigQuery jobs recorded yet")
+            return
+
+        st.write("**Per Query and Day**")
+        st.dataframe(
+            daily,
+            column_config={
+                "day": "Day",
+                "query_name": "Query",
+                "jobs": "Jobs",
+                "gb_billed": st.column_config.NumberColumn("GB Billed", format="%.2f"),
+                "gb_processed": st.column_config.NumberColumn("GB Processed", format="%.2f"),
+                "slot_seconds": st.column_config.NumberColumn("Slot Seconds", format="%.2f"),
+                "cache_hits": "Cache Hits",
+                "avg_queue_ms": st.column_config.NumberColumn("Avg Queue (ms)", format="%.2f"),
+                "avg_run_ms": st.column_config.NumberColumn("Avg Run (ms)", format="%.2f")
+            },
+            hide_index=True,
+            use_container_width=True
+        )
+
+        st.write("**Per Dealer Profile**")
+        st.dataframe(
+            job_stats.dealer_view_report(days),
+            column_config={
+                "dealer_code": "Dealer Code",
+                "sessions": "Sessions",
+                "jobs": "Jobs",
+                "gb_billed": st.column_config.NumberColumn("GB Billed", format="%.2f"),
+                "slot_seconds": st.column_config.NumberColumn("Slot Seconds", format="%.2f"),
+                "avg_job_ms": st.column_config.NumberColumn("Avg Job (ms)", format="%.2f")
+            },
+            hide_index=True,
+            use_container_width=True
+        )
+
+
     def main():
         st.title("🚗 SET - Sales Enablement Tool")
 
         # Load data
+        store = get_dataset_store()
         with st.spinner("Loading data..."):
-            historical_df, live_cars_df, dealer_seg_df, activity_df, recent_views_df, recent_filters_df = load_data()
+            dataset = store.get()
+        show_data_status(store)
+
+        if dataset is None:
+            st.warning("No data available. Please check your Google Sheet connection.")
+            return
+
+        # Shared with all sessions: read-only, never copied
+        historical_df, live_cars_df, dealer_seg_df, activity_df, recent_views_df, recent_filters_df, _ = dataset.frames
+        dealer_index = dataset.index
 
         if historical_df.empty or dealer_seg_df.empty:
             st.warning("No data available. Please check your Google Sheet connection.")
             return
 
-        # Create main navigation
-        main_tab1, main_tab2 = st.tabs(["📥 Attention Inbox", "👤 Dealer Profile"])
+        # Create main navigation; admins also get the performance tab
+        tab_names = ["📥 Attention Inbox", "👤 Dealer Profile", "🚙 Inventory Matches"]
+        is_admin = st.session_state.get("authenticated_user") == "admin"
+        if is_admin:
+            tab_names.append("⏱️ Performance")
+        main_tabs = st.tabs(tab_names)
+        main_tab1, main_tab2, main_tab3 = main_tabs[:3]
 
         with main_tab1:
             # Get dealers needing attention
-            attention_dealers = get_dealers_needing_attention(dealer_seg_df)
+            with span("inbox"):
+                attention_dealers = get_dealers_needing_attention(dealer_seg_df)
 
             if attention_dealers.empty:
                 st.success("No dealers currently need attention! 🎉")
@@ -1140,29 +3324,17 @@ ORDER BY total_requests_lifetime DESC NULLS LAST;
                 # Add debug section to show all unique segmentation cases
                 with st.expander("Debug: All Segmentation Cases"):
                     st.write("**All Unique Segmentation Cases Found:**")
-                    all_cases = attention_dealers['current_segmentation'].unique()
+                    all_cases = sorted(attention_dealers['current_segmentation'].unique())
 
                     # Group cases by priority
-                    critical_found = []
-                    high_found = []
-                    medium_found = []
-                    low_found = []
+                    case_status, _, case_matched = classify_segmentations(pd.Series(all_cases))
+                    found = {level: [] for level in PRIORITY_LEVELS}
                     unmatched = []
-
-                    for case in sorted(all_cases):
-                        test_row = pd.Series({'current_segmentation': case})
-                        priority = get_priority(test_row)
-
-                        if priority == '🔴 Critical Priority':
-                            critical_found.append(case)
-                        elif priority == '🟠 High Priority':
-                            high_found.append(case)
-                        elif priority == '🟡 Medium Priority':
-                            medium_found.append(case)
-                        elif priority == '⚪ Low Priority':
-                            low_found.append(case)
-                        else:
+                    for case, priority, matched in zip(all_cases, case_status, case_matched):
+                        found[priority].append(case)
+                        if not matched:
                             unmatched.append(case)
+                    critical_found, high_found, medium_found, low_found = found.values()
 
                     col1, col2 = st.columns(2)
                     with col1:
@@ -1184,86 +3356,39 @@ ORDER BY total_requests_lifetime DESC NULLS LAST;
                             st.write(f"- {case}")
 
                     if unmatched:
-                        st.error("**Unmatched Cases:**")
+                        st.error("**Unmatched Cases (shown as Low Priority):**")
                         for case in sorted(unmatched):
                             st.write(f"- {case}")
 
-                # Display dealer list with key metrics and direct links
-                for _, dealer in attention_dealers.iterrows():
-                    with st.expander(
-                            f"{dealer['status']} - {dealer['dealer_name']}"
-                    ):
-                        col1, col2 = st.columns([2, 1])
-
-                        with col1:
-                            st.write("**Activity Metrics:**")
-                            st.write(f"• Lifetime Monthly Requests: {dealer['avg_requests_per_month_lifetime']:.1f}")
-                            st.write(f"• Recent Monthly Requests: {dealer['avg_requests_per_month_60d']:.1f}")
-                            st.write(f"• Activity Drop: {dealer['activity_drop']:.1f} requests/month")
-
-                        with col2:
-                            st.write("**Recent Activity:**")
-                            st.write(f"• 30-day Requests: {dealer['buy_requests_30d']}")
-                            st.write(f"• 30-day Purchases: {dealer['sold_cars_30d']}")
-
-                        # Add navigation button
-                        if st.button("👤 View Full Profile", key=f"view_profile_{dealer['dealer_name']}"):
-                            st.query_params["dealer"] = dealer['dealer_name']
-                            st.query_params["tab"] = "Dealer Profile"
-                            st.rerun()
+                show_attention_inbox(attention_dealers)
 
-        with main_tab2:
-            # Sidebar filters
-            st.sidebar.header("Filters")
+        # Rendered before the profile, which returns early when a dealer has no data
+        with main_tab3:
+            show_inventory_matches(dataset.buyers)
 
-            # Add search method selection
-            search_method = st.sidebar.radio(
-                "Search by",
-                ["Dealer Name", "Dealer Code"]
-            )
+        if is_admin:
+            with main_tabs[3]:
+                show_performance_panel()
+                show_query_costs()
 
+        with main_tab2:
             # Get list of dealers and their codes
             valid_dealers_df = pd.DataFrame({
                 'dealer_name': dealer_seg_df['dealer_name'],
                 'dealer_code': dealer_seg_df['dealer_code']
             }).drop_duplicates()
 
-            # Check if we came from inbox
-            default_dealer = st.query_params.get('dealer', None)
-
-            if search_method == "Dealer Name":
-                # Sort dealers by name
-                valid_dealers = sorted(valid_dealers_df['dealer_name'].unique())
-                default_index = valid_dealers.index(default_dealer) if default_dealer in valid_dealers else 0
-
-                # Dealer selection
-                selected_dealer_name = st.sidebar.selectbox(
-                    "Select Dealer",
-                    options=valid_dealers,
-                    index=default_index
-                )
-                # Get corresponding dealer code
-                selected_dealer_code = \
-                valid_dealers_df[valid_dealers_df['dealer_name'] == selected_dealer_name]['dealer_code'].iloc[0]
-            else:
-                # Sort dealers by code
-                valid_dealer_codes = sorted(valid_dealers_df['dealer_code'].unique())
-
-                selected_dealer_code = st.sidebar.selectbox(
-                    "Select Dealer Code",
-                    options=valid_dealer_codes
-                )
-                # Get corresponding dealer name
-                selected_dealer_name = \
-                valid_dealers_df[valid_dealers_df['dealer_code'] == selected_dealer_code]['dealer_name'].iloc[0]
-
-            # Display selected dealer info
-            st.sidebar.info(f"Selected Dealer: {selected_dealer_name}\nDealer Code: {selected_dealer_code}")
+            # Sidebar filters
+            st.session_state['profile_full_run'] = True
+            with st.sidebar:
+                selected_dealer_code, selected_dealer_name = show_dealer_picker(valid_dealers_df)
 
-            # Get dealer details using the name (since that's how the dataframes are indexed)
-            dealer_info = dealer_seg_df[dealer_seg_df['dealer_name'] == selected_dealer_name]
-            dealer_activity = activity_df[activity_df['dealer_name'] == selected_dealer_name]
-            dealer_historical = historical_df[historical_df['dealer_name'] == selected_dealer_name].copy()
+            # Get dealer details by code from the dealer index
+            with span("dealer_lookup", dealer_code=selected_dealer_code):
+                dealer_info = dealer_index.rows('dealer_seg', selected_dealer_code)
+                dealer_activity = dealer_index.rows('dealer_activity', selected_dealer_code)
+                dealer_historical = drop_unused_categories(
+                    dealer_index.rows('historical', selected_dealer_code).copy())
 
             if dealer_info.empty:
                 st.error(f"No segmentation data found for dealer: {selected_dealer_name}")
@@ -1273,489 +3398,30 @@ ORDER BY total_requests_lifetime DESC NULLS LAST;
                 st.error(f"No activity data found for dealer: {selected_dealer_name}")
                 return
 
-            # Get single row data
-            dealer_info = dealer_info.iloc[0]
-            dealer_activity = dealer_activity.iloc[0]
-
-            # Initialize metrics variables
-            top_makes_str = "No data"
-            top_models_str = "No data"
-            top_mileage_str = "No data"
-            price_range = "No data"
-
-            # Get historical purchase patterns
-            if not dealer_historical.empty:
-                # Calculate top makes
-                top_makes = dealer_historical['make'].value_counts().head(3)
-                top_makes_str = ", ".join([f"{make} ({count})" for make, count in top_makes.items()])
-                all_makes = dealer_historical['make'].value_counts()
-
-                # Calculate top models
-                top_models = dealer_historical.groupby(['make', 'model']).size().sort_values(ascending=False).head(3)
-                top_models_str = ", ".join([f"{make} {model} ({count})" for (make, model), count in top_models.items()])
-                all_models = dealer_historical.groupby(['make', 'model']).size().sort_values(ascending=False)
-
-                # Calculate mileage ranges
-                dealer_historical['mileage_range'] = pd.cut(
-                    dealer_historical['kilometers'],
-                    bins=[0, 50000, 100000, 150000, float('inf')],
-                    labels=['0-50K', '50K-100K', '100K-150K', '150K+']
-                )
-                top_mileage = dealer_historical['mileage_range'].value_counts().head(2)
-                top_mileage_str = ", ".join([f"{range_} ({count})" for range_, count in top_mileage.items()])
-                all_mileage = dealer_historical['mileage_range'].value_counts()
-
-                # Calculate average price range
-                avg_price = dealer_historical['price'].mean()
-                price_std = dealer_historical['price'].std()
-                price_range = f"EGP {(avg_price - price_std):,.0f} - {(avg_price + price_std):,.0f}"
-
-                # Calculate detailed price statistics
-                price_stats = {
-                    'Average Price': f"EGP {avg_price:,.0f}",
-                    'Minimum Price': f"EGP {dealer_historical['price'].min():,.0f}",
-                    'Maximum Price': f"EGP {dealer_historical['price'].max():,.0f}",
-                    'Median Price': f"EGP {dealer_historical['price'].median():,.0f}",
-                    'Price Range (±1 std)': price_range
-                }
-
-            # Key metrics
-            col1, col2, col3, col4 = st.columns(4)
-
-            with col1:
-                st.metric("Active Days (30d)", int(dealer_activity['active_days_30d']))
-                st.metric("Car Events (30d)", int(dealer_activity['total_car_events_30d']))
-
-            with col2:
-                st.metric("Active Days (7d)", int(dealer_activity['active_days_7d']))
-                st.metric("Car Events (7d)", int(dealer_activity['total_car_events_7d']))
-
-            with col3:
-                st.metric("Top Makes", len(all_makes) if not dealer_historical.empty else "No data")
-                if not dealer_historical.empty and st.button("Top Makes Analysis", key="show_makes"):
-                    show_makes_analysis(all_makes)
-
-                st.metric("Preferred Mileage", len(all_mileage) if not dealer_historical.empty else "No data")
-                if not dealer_historical.empty and st.button("Mileage Analysis", key="show_mileage"):
-                    show_mileage_analysis(all_mileage)
-
-            with col4:
-                st.metric("Top Models", len(all_models) if not dealer_historical.empty else "No data")
-                if not dealer_historical.empty and st.button("Models Analysis", key="show_models"):
-                    show_models_analysis(all_models)
-
-                st.metric("Price Analysis", "View" if not dealer_historical.empty else "No data")
-                if not dealer_historical.empty and st.button("Price Analysis", key="show_price"):
-                    show_price_analysis(dealer_historical, price_stats)
-
-            # Segmentation Information
-            st.subheader("Dealer Segmentation")
-
-            seg_col1, seg_col2 = st.columns(2)
-
-            with seg_col1:
-                st.info(f"Lifetime Segment: {dealer_info['final_bucket_lifetime']}")
-                st.info(f"60-Day Segment: {dealer_info['final_bucket_60d']}")
-
-            with seg_col2:
-                st.info(f"Request Activity (Lifetime): {dealer_info['request_activity_bucket_lifetime']}")
-                st.info(f"Request Activity (60d): {dealer_info['request_activity_bucket_60d']}")
-
-            # Recent Activity section
-            st.subheader("Recent Activity")
-
-            # Get dealer's recent views and filters
-            dealer_views = recent_views_df[recent_views_df['dealer_code'] == dealer_info['dealer_code']].copy()
-            dealer_filters = recent_filters_df[recent_filters_df['dealer_code'] == dealer_info['dealer_code']].copy()
+            # Start the remote lookups so the local sections render while they run
+            remote_fetches = start_profile_fetches(selected_dealer_code, dataset.version)
 
-            # Create tabs for views and filters
-            recent_tab1, recent_tab2 = st.tabs(["🔍 Recent Views", "🎯 Recent Filters"])
+            # Each section is a fragment: its widgets rerun only that section
+            show_profile_metrics(dealer_activity.iloc[0], dealer_historical)
+            show_profile_segmentation(dealer_info.iloc[0])
+            show_recent_activity(dealer_index, selected_dealer_code)
 
-            with recent_tab1:
-                if not dealer_views.empty:
-                    # Format the time column
-                    dealer_views['time'] = pd.to_datetime(dealer_views['time']).dt.strftime('%Y-%m-%d %H:%M:%S')
-
-                    # Format the price column
-                    dealer_views['buy_now_price'] = dealer_views['buy_now_price'].apply(
-                        lambda x: f"EGP {x:,.0f}" if pd.notnull(x) else "N/A"
-                    )
-
-                    # Format the kilometrage column
-                    dealer_views['kilometrage'] = dealer_views['kilometrage'].apply(
-                        lambda x: f"{x:,.0f} km" if pd.notnull(x) else "N/A"
-                    )
-
-                    # Display recent views
-                    st.dataframe(
-                        dealer_views[['time', 'make', 'model', 'trim', 'year', 'kilometrage',
-                                      'transmission', 'buy_now_price', 'body_style']],
-                        column_config={
-                            "time": "Viewed At",
-                            "make": "Make",
-                            "model": "Model",
-                            "trim": "Trim",
-                            "year": "Year",
-                            "kilometrage": "Mileage",
-                            "transmission": "Transmission",
-                            "buy_now_price": "Price",
-                            "body_style": "Body Style"
-                        },
-                        use_container_width=True
-                    )
-                else:
-                    st.info("No recent car views found for this dealer")
-
-            with recent_tab2:
-                if not dealer_filters.empty:
-                    # Format the time column
-                    dealer_filters['time'] = pd.to_datetime(dealer_filters['time']).dt.strftime('%Y-%m-%d %H:%M:%S')
-
-                    # Format the kilometrage column
-                    dealer_filters['kilometrage'] = dealer_filters['kilometrage'].apply(
-                        lambda x: f"{x:,.0f} km" if pd.notnull(x) else "N/A"
-                    )
-
-                    # Display recent filters
-                    st.dataframe(
-                        dealer_filters[['time', 'make', 'model', 'year', 'kilometrage',
-                                        'group_filter', 'status', 'no_of_cars']],
-                        column_config={
-                            "time": "Filter Applied At",
-                            "make": "Make",
-                            "model": "Model",
-                            "year": "Year",
-                            "kilometrage": "Mileage Range",
-                            "group_filter": "Filter Group",
-                            "status": "Status",
-                            "no_of_cars": st.column_config.NumberColumn(
-                                "Number of Cars",
-                                help="Number of cars matching the filter criteria"
-                            )
-                        },
-                        use_container_width=True
-                    )
-                else:
-                    st.info("No recent filter applications found for this dealer")
-
-            # Add Dealer Requests section
+            # Dealer Requests fill in when their fetch completes
             st.subheader("Dealer Requests")
+            requests_placeholder = st.empty()
+            requests_placeholder.info("Loading dealer requests...")
 
-            if dealer_info.empty:
-                st.warning("No dealer information available")
-            else:
-                try:
-                    # Get credentials and create client
-                    try:
-                        credentials = service_account.Credentials.from_service_account_info(
-                            st.secrets["service_account"]
-                        )
-                    except (KeyError, FileNotFoundError):
-                        try:
-                            credentials = service_account.Credentials.from_service_account_file(
-                                'service_account.json'
-                            )
-                        except FileNotFoundError:
-                            st.error("No credentials found for BigQuery access")
-                            credentials = None
-
-                    if credentials:
-                        client = bigquery.Client(credentials=credentials)
-                        dealer_data = dealer_seg_df[dealer_seg_df['dealer_name'] == selected_dealer_name].iloc[0]
-                        dealer_id = dealer_data['dealer_code']
-
-                        all_requests, succeeded_requests, failed_before_requests, failed_after_requests = get_dealer_requests(
-                            client, dealer_id)
-
-                        # Create tabs for different request types
-                        req_tab1, req_tab2, req_tab3, req_tab4 = st.tabs([
-                            "📋 All Requests",
-                            "✅ Succeeded Requests",
-                            "❌ Failed Before Visit",
-                            "⚠️ Failed After Visit"
-                        ])
-
-                        with req_tab1:
-                            if not all_requests.empty:
-                                st.dataframe(
-                                    all_requests,
-                                    column_config={
-                                        "vehicle_request_created_at": "Request Date",
-                                        "request_type": "Request Type",
-                                        "request_status": "Status",
-                                        "contacted_at": "Contacted At",
-                                        "contacted_user": "Contacted By",
-                                        "visited_at": "Visit Date",
-                                        "visited_user": "Visited By",
-                                        "succeeded_at": "Success Date",
-                                        "failed_before_visit_at": "Failed Before Visit At",
-                                        "failed_after_visit_at": "Failed After Visit At",
-                                        "failure_reason": "Failure Reason",
-                                        "car_name": "Car Name",
-                                        "car_make": "Make",
-                                        "car_model": "Model",
-                                        "car_year": "Year",
-                                        "car_kilometrage": "Mileage",
-                                        "buy_now_price": "Buy Now Price",
-                                        "discounted_price": "Discounted Price"
-                                    },
-                                    use_container_width=True
-                                )
-                            else:
-                                st.info("No requests found")
-
-                        with req_tab2:
-                            if not succeeded_requests.empty:
-                                st.dataframe(
-                                    succeeded_requests,
-                                    column_config={
-                                        "vehicle_request_created_at": "Request Date",
-                                        "request_type": "Request Type",
-                                        "contacted_at": "Contacted At",
-                                        "contacted_user": "Contacted By",
-                                        "visited_at": "Visit Date",
-                                        "visited_user": "Visited By",
-                                        "succeeded_at": "Success Date",
-                                        "car_name": "Car Name",
-                                        "car_make": "Make",
-                                        "car_model": "Model",
-                                        "car_year": "Year",
-                                        "car_kilometrage": "Mileage",
-                                        "buy_now_price": "Buy Now Price",
-                                        "discounted_price": "Discounted Price"
-                                    },
-                                    use_container_width=True
-                                )
-                            else:
-                                st.info("No successful requests found")
-
-                        with req_tab3:
-                            if not failed_before_requests.empty:
-                                st.dataframe(
-                                    failed_before_requests,
-                                    column_config={
-                                        "vehicle_request_created_at": "Request Date",
-                                        "request_type": "Request Type",
-                                        "contacted_at": "Contacted At",
-                                        "contacted_user": "Contacted By",
-                                        "failed_before_visit_at": "Failed At",
-                                        "failure_reason": "Failure Reason",
-                                        "car_name": "Car Name",
-                                        "car_make": "Make",
-                                        "car_model": "Model",
-                                        "car_year": "Year",
-                                        "car_kilometrage": "Mileage",
-                                        "buy_now_price": "Buy Now Price",
-                                        "discounted_price": "Discounted Price"
-                                    },
-                                    use_container_width=True
-                                )
-                            else:
-                                st.info("No requests failed before visit")
-
-                        with req_tab4:
-                            if not failed_after_requests.empty:
-                                st.dataframe(
-                                    failed_after_requests,
-                                    column_config={
-                                        "vehicle_request_created_at": "Request Date",
-                                        "request_type": "Request Type",
-                                        "contacted_at": "Contacted At",
-                                        "contacted_user": "Contacted By",
-                                        "visited_at": "Visit Date",
-                                        "visited_user": "Visited By",
-                                        "failed_after_visit_at": "Failed At",
-                                        "failure_reason": "Failure Reason",
-                                        "car_name": "Car Name",
-                                        "car_make": "Make",
-                                        "car_model": "Model",
-                                        "car_year": "Year",
-                                        "car_kilometrage": "Mileage",
-                                        "buy_now_price": "Buy Now Price",
-                                        "discounted_price": "Discounted Price"
-                                    },
-                                    use_container_width=True
-                                )
-                            else:
-                                st.info("No requests failed after visit")
-                except Exception as e:
-                    st.error(f"Error fetching dealer requests: {str(e)}")
-
-            # Add OLX Listings section
+            # OLX listings come from the index of the current data version
             st.subheader("OLX Listings")
+            with span("olx_listings", dealer_code=selected_dealer_code):
+                olx_listings = dataset.olx.listings_for_dealer(selected_dealer_code)
+            render_olx_listings(olx_listings)
 
-            if dealer_info.empty:
-                st.warning("No dealer information available")
-            else:
-                try:
-                    # Get credentials and create client
-                    try:
-                        credentials = service_account.Credentials.from_service_account_info(
-                            st.secrets["service_account"]
-                        )
-                    except (KeyError, FileNotFoundError):
-                        try:
-                            credentials = service_account.Credentials.from_service_account_file(
-                                'service_account.json'
-                            )
-                        except FileNotFoundError:
-                            st.error("No credentials found for BigQuery access")
-                            credentials = None
-
-                    if credentials:
-                        client = bigquery.Client(credentials=credentials)
-                        dealer_data = dealer_seg_df[dealer_seg_df['dealer_name'] == selected_dealer_name].iloc[0]
-                        dealer_id = dealer_data['dealer_code']
-
-                        olx_listings = get_olx_listings_for_dealer(client, dealer_id)
-
-                        if not olx_listings.empty:
-                            # Format the dataframe for display
-                            display_df = olx_listings[[
-                                'added_at', 'title', 'make', 'model', 'year', 'kilometers',
-                                'price', 'condition', 'is_active', 'region'
-                            ]].copy()
-
-                            # Format date columns
-                            display_df['added_at'] = pd.to_datetime(display_df['added_at']).dt.strftime(
-                                '%Y-%m-%d %H:%M')
-
-                            # Format price
-                            display_df['price'] = display_df['price'].apply(
-                                lambda x: f"{x:,.0f} EGP" if pd.notnull(x) else "N/A"
-                            )
-
-                            st.dataframe(
-                                display_df,
-                                column_config={
-                                    "added_at": "Listed Date",
-                                    "title": "Title",
-                                    "make": "Make",
-                                    "model": "Model",
-                                    "year": "Year",
-                                    "kilometers": "Mileage",
-                                    "price": "Price",
-                                    "condition": "Condition",
-                                    "is_active": "Active",
-                                    "region": "Region"
-                                },
-                                use_container_width=True
-                            )
-
-                            # Add summary metrics
-                            col1, col2, col3 = st.columns(3)
-                            with col1:
-                                active_listings = len(olx_listings[olx_listings['is_active']])
-                                st.metric("Active Listings", active_listings)
-                            with col2:
-                                avg_price = olx_listings['price'].mean()
-                                st.metric("Average Price", f"{avg_price:,.0f} EGP")
-                            with col3:
-                                unique_models = len(olx_listings[['make', 'model']].drop_duplicates())
-                                st.metric("Unique Models", unique_models)
-                        else:
-                            st.info("No OLX listings found for this dealer in the last 30 days")
-                except Exception as e:
-                    st.error("Error fetching OLX listings")
-
-            # Get dealer historical data for recommendations and analysis
-            dealer_historical = historical_df[historical_df['dealer_name'] == selected_dealer_name].copy()
-
-            # Recommended Cars section
-            st.subheader("Recommended Cars")
-
-            if not dealer_historical.empty:
-                recommended_cars = get_recommended_cars(dealer_historical, live_cars_df)
-
-                if not recommended_cars.empty:
-                    st.dataframe(
-                        recommended_cars,
-                        column_config={
-                            "match_score": st.column_config.ProgressColumn(
-                                "Match Score",
-                                help="How well this car matches the dealer's preferences (max 9 points)",
-                                format="%.1f",
-                                min_value=0,
-                                max_value=9
-                            ),
-                            "score_breakdown": "Score Breakdown",
-                            "sf_vehicle_name": "Vehicle",
-                            "make": "Make",
-                            "model": "Model",
-                            "year": "Year",
-                            "kilometers": st.column_config.NumberColumn(
-                                "Mileage",
-                                format="%d km"
-                            )
-                        },
-                        use_container_width=True
-                    )
-
-                    # Add explanation of scoring system
-                    st.info("""
-                    **Scoring System:**
-                    - Make: 0-3 points (based on frequency of purchases)
-                    - Model: 0-2 points (based on frequency within make)
-                    - Year: 0-2 points (based on preferred year ranges)
-                    - Mileage: 0-2 points (based on preferred km ranges)
-                    Total possible score: 9 points
-                    """)
-                else:
-                    st.info("No matching cars found in current inventory")
-            else:
-                st.info("Cannot generate recommendations without historical data")
-
-            # Historical Purchase Analysis
-            st.subheader("Historical Purchase Analysis")
-
-            if not dealer_historical.empty:
-                # Clean the data for visualization
-                dealer_historical['kilometers'] = dealer_historical['kilometers'].fillna(
-                    dealer_historical['kilometers'].mean())
-
-                # Create tabs for different visualizations
-                hist_tab1, hist_tab2, hist_tab3 = st.tabs(
-                    ["Purchase Timeline", "Price Distribution", "Make Distribution"])
-
-                with hist_tab1:
-                    # Create time series of purchases with better handling of missing values
-                    fig = px.scatter(dealer_historical,
-                                     x='request_date',
-                                     y='price',
-                                     color='make',
-                                     size='kilometers',
-                                     hover_data=['model', 'year'],
-                                     title='Historical Purchases Over Time',
-                                     size_max=30)  # Limit maximum bubble size
-
-                    # Customize the layout
-                    fig.update_layout(
-                        xaxis_title="Request Date",
-                        yaxis_title="Price (EGP)",
-                        showlegend=True
-                    )
-                    st.plotly_chart(fig, use_container_width=True)
-
-                with hist_tab2:
-                    # Price distribution by make
-                    fig = px.box(dealer_historical,
-                                 x='make',
-                                 y='price',
-                                 title='Price Distribution by Make',
-                                 points="all")  # Show all points
-                    st.plotly_chart(fig, use_container_width=True)
-
-                with hist_tab3:
-                    # Make distribution
-                    make_counts = dealer_historical['make'].value_counts()
-                    fig = px.pie(values=make_counts.values,
-                                 names=make_counts.index,
-                                 title='Distribution of Makes in Historical Purchases')
-                    st.plotly_chart(fig, use_container_width=True)
-
-            else:
-                st.warning("No historical purchase data available for this dealer")
+            show_recommended_cars(dataset.recommendations, selected_dealer_code, not dealer_historical.empty)
+            show_purchase_charts(dealer_historical)
 
+            fill_remote_sections(remote_fetches, {'requests': requests_placeholder})
 
     if __name__ == "__main__":
-        main()
+        with span("rerun"):
+            main()